@@ -215,14 +215,18 @@ def execute_usb_emulation(bb_dut, args, config):
     notest = ""
     if args.notest:
         notest = "--notest"
+    reuse_results = ""
+    if args.reuse_results:
+        reuse_results = "--reuse-results"
     try:
         output = remote_execute(bb_dut["bb_ip"],
                                 ["cd", "/root/workspace" + current_dir,";aft",
-                                dut, img_path, notest,  record, "--emulateusb"],
+                                dut, img_path, notest,  record, reuse_results,
+                                "--emulateusb"],
                                 timeout=1200, config = config)
     finally:
         log_files = ["aft.log", "serial.log", "ssh.log", "kb_emulator.log",
-                     "serial.log.raw"]
+                     "serial.log.raw.gz", "serial.log.raw.gz.idx"]
         for log in log_files:
             if os.path.isfile(log):
                 os.rename(log, "test_" + log)
@@ -261,7 +265,7 @@ def execute_flashing(bb_dut, args, config):
 
     finally:
         log_files = ["aft.log", "serial.log", "ssh.log", "kb_emulator.log",
-                     "serial.log.raw"]
+                     "serial.log.raw.gz", "serial.log.raw.gz.idx"]
         for log in log_files:
             if os.path.isfile(log):
                 os.rename(log, "flash_" + log)
@@ -283,15 +287,19 @@ def execute_testing(bb_dut, args, config):
         record = "--record"
     if args.testplan:
         testplan = "--testplan=" + args.testplan
+    reuse_results = ""
+    if args.reuse_results:
+        reuse_results = "--reuse-results"
     try:
         output = remote_execute(bb_dut["bb_ip"],
                                 ["cd", "/root/workspace" + current_dir,";aft",
-                                dut, record, testplan, "--noflash"],
+                                dut, record, testplan, reuse_results,
+                                "--noflash"],
                                 timeout=1200, config = config)
 
     finally:
         log_files = ["aft.log", "serial.log", "ssh.log", "kb_emulator.log",
-                     "serial.log.raw"]
+                     "serial.log.raw.gz", "serial.log.raw.gz.idx"]
         for log in log_files:
             if os.path.isfile(log):
                 os.rename(log, "test_" + log)
@@ -323,7 +331,7 @@ def dut_setout(bb_dut, args, config):
                                 timeout=1200, config = config)
     finally:
         log_files = ["aft.log", "serial.log", "ssh.log", "kb_emulator.log",
-                     "serial.log.raw"]
+                     "serial.log.raw.gz", "serial.log.raw.gz.idx"]
         for log in log_files:
             if os.path.isfile(log):
                 os.rename(log, "flash_" + log)
@@ -456,6 +464,13 @@ def parse_args():
              "the test plan name without .cfg extension. On default the test " +
              "plan for the device in AFT device settings is used.")
 
+    parser.add_argument(
+        "--reuse-results",
+        action="store_true",
+        default=False,
+        help="Don't run test cases that already passed on the same image " +
+             "and device model, report the cached results instead")
+
     parser.add_argument(
         "--noblacklisting",
         action="store_true",
@@ -21,6 +21,10 @@ SERIAL_LOG_NAME = "serial.log"
 AFT_LOG_NAME = "aft.log"
 NFS_FOLDER = "/home/tester/"
 KNOWN_GOOD_IMAGE_FOLDER = "/home/tester/good_test_images"
+KEYSTROKE_CACHE_FOLDER = "/var/cache/aft/kbsequences/"
+RESULT_CACHE_FOLDER = "/var/cache/aft/results/"
+MAX_PARALLEL_TEST_CASES = 4
+SERIAL_TRIGGERS = ""
 
 import sys
 try:
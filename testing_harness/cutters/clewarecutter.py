@@ -21,9 +21,12 @@ try:
     import subprocess32
 except ImportError:
     import subprocess as subprocess32
-import aft.tools.misc as misc
-import random
-from time import sleep
+import os
+import socket
+import aft.tools.cutterbroker as cutterbroker
+import aft.tools.list_cutters as list_cutters
+import aft.config as config
+from aft.logger import Logger as logger
 
 from aft.cutters.cutter import Cutter
 
@@ -33,12 +36,8 @@ class ClewareCutter(Cutter):
     Wrapper for controlling cutters from Cleware Gmbh.
 
     Attributes:
-        _RETRIES (integer):
-            Number of retries in case of failure
-        _MIN_SLEEP_DURATION (integer):
-            Minimum amount of time between retry attempts
-        _MAX_SLEEP_DURATION (integer):
-            Maximum amount of time between retry attempts
+        _BROKER_SOCKET_NAME (str):
+            Name of the cutter broker socket in config.LOCK_FILE directory
         _POWER_ON (str):
             The string passed to clewarecontrol to turn the device on
         _POWER_OFF (str):
@@ -46,20 +45,19 @@ class ClewareCutter(Cutter):
     """
     # if two devices try to access same cutter at the same time, it fails
     # sporadically (two instances of clewarecontrol seem to interfere with
-    # each other). If this happens, retry with random delay so that devices
-    # hopefully don't collide again
-    _RETRIES = 3
-    _MIN_SLEEP_DURATION = 1
-    _MAX_SLEEP_DURATION = 10
+    # each other). Because of this all commands go through a per-host broker
+    # which runs one clewarecontrol at a time.
+    _BROKER_SOCKET_NAME = "aft_cutter_broker.sock"
 
     _POWER_ON = "1"
     _POWER_OFF = "0"
 
     def __init__(self, config):
+        super(ClewareCutter, self).__init__()
         self._cutter_id = config["cutter"]
         self._channel = config["channel"]
 
-    def connect(self):
+    def _connect(self):
         """
         Turns power on
 
@@ -72,7 +70,7 @@ class ClewareCutter(Cutter):
         """
         self._send_command(self._POWER_ON)
 
-    def disconnect(self):
+    def _disconnect(self):
         """
         Turns power off
 
@@ -87,8 +85,9 @@ class ClewareCutter(Cutter):
 
     def _send_command(self, power_status):
         """
-        Either turns power on or off. Retries on failure up to self._RETRIES
-        times.
+        Either turns power on or off through the cutter broker. If the broker
+        can't be reached, runs clewarecontrol directly while holding the host
+        wide clewarecontrol lock.
 
         Args:
             power_status (string):
@@ -101,30 +100,27 @@ class ClewareCutter(Cutter):
             subprocess32.CalledProcessError or subprocess32.TimeoutExpired
             on failure
         """
-        error = ""
-        for _ in range(self._RETRIES):
-            try:
-                misc.local_execute(
-                    [
-                        "clewarecontrol",
-                        "-d",
-                        str(self._cutter_id),
-                        "-c",
-                        "1",
-                        "-as",
-                        str(self._channel),
-                        str(power_status)
-                    ])
-            except (subprocess32.CalledProcessError,
-                    subprocess32.TimeoutExpired) as err:
-                error = err
-                sleep(
-                    random.randint(
-                        self._MIN_SLEEP_DURATION, self._MAX_SLEEP_DURATION))
-            else:
-                return
-
-        raise error
+        socket_path = os.path.join(config.LOCK_FILE, self._BROKER_SOCKET_NAME)
+        try:
+            cutterbroker.send_power_command(socket_path, self._cutter_id,
+                                            self._channel, power_status)
+            return
+        except socket.error as err:
+            logger.warning("Cutter broker unavailable: " + str(err) +
+                           ", running clewarecontrol directly")
+
+        cutterbroker.execute_locked(
+            [
+                "clewarecontrol",
+                "-d",
+                str(self._cutter_id),
+                "-c",
+                "1",
+                "-as",
+                str(self._channel),
+                str(power_status)
+            ],
+            cutterbroker.cleware_lock_path(socket_path))
 
     def get_cutter_config(self):
         """
@@ -150,30 +146,12 @@ class ClewareCutter(Cutter):
                 List of dictionaries with the following format:
                 {
                     "type": "cleware",
-                    "cutter": (int) cleware_cutter_id
-                    "sockets": (int) number_of_sockets
+                    "cutter": (int) cleware_cutter_id,
+                    "sockets": (int) number_of_sockets,
+                    "usb_path": "1-1.2"
                 }
+                usb_path is missing if the serial numbers had to be read with
+                clewarecontrol.
         """
 
-        ids_to_sockets = {}
-        ids_to_sockets["512"] = 4
-        ids_to_sockets["29"] = 4
-        ids_to_sockets["51"] = 1
-
-        output = misc.local_execute(["clewarecontrol", "-l"])
-        output = output.split("\n")
-
-        cutter_arrays = [line.split(",") for line in output if "Device: " in line]
-
-        cutter_values = [(line[2].strip().split(" ")[1], line[3].strip().split(" ")[2])
-            for line in cutter_arrays]
-
-        cutters = []
-        for val in cutter_values:
-            cutters.append({
-                "type": "cleware",
-                "cutter": int(val[1]),
-                "sockets": ids_to_sockets[val[0]]
-            })
-
-        return cutters
+        return list_cutters.find_cleware_cutters()
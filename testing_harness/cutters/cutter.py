@@ -18,27 +18,252 @@ Base class for Cutter devices.
 """
 
 import abc
+import time
+import threading
 from six import with_metaclass
 
+from aft.logger import Logger as logger
+import aft.errors as errors
+
 class Cutter(with_metaclass(abc.ABCMeta, object)):
     """
     Common abstract base class for all the makes of cutters.
+
+    Keeps track of the power state so that redundant transitions are skipped,
+    and records every transition to the power timeline. Subclasses implement
+    _connect() and _disconnect(), and read_power_state() if the hardware can
+    report its state.
+
+    connect_async() and disconnect_async() run the power change in a
+    background thread. Use set_power_state() to power several cutters at once.
+
+    Attributes:
+        power_state (boolean):
+            True if powered, False if not, None if unknown
+        power_timeline (list):
+            (timestamp, power_state) tuples of the transitions
     """
     DEFAULT_TIMEOUT = 5
 
-    @abc.abstractmethod
+    def __init__(self):
+        self.power_state = None
+        self.power_timeline = []
+        self._power_lock = threading.Lock()
+
     def connect(self):
+        """
+        Connects the channel, powering up the device. Does nothing if the
+        channel is already known to be connected.
+        """
+        self._set_power_state(True)
+
+    def disconnect(self):
+        """
+        Disconnects the channel, powering down the device. Does nothing if the
+        channel is already known to be disconnected.
+        """
+        self._set_power_state(False)
+
+    def connect_async(self):
+        """
+        Start connecting the channel in the background
+
+        Returns:
+            PowerOperation of the power change
+        """
+        return PowerOperation(self.connect)
+
+    def disconnect_async(self):
+        """
+        Start disconnecting the channel in the background
+
+        Returns:
+            PowerOperation of the power change
+        """
+        return PowerOperation(self.disconnect)
+
+    def read_power_state(self):
+        """
+        Read the power state from the hardware.
+
+        Returns:
+            True if powered, False if not, None if the cutter can't report it
+        """
+        return None
+
+    def last_off_time(self):
+        """
+        Returns the timestamp of the last power off transition made by this
+        cutter, or None if it hasn't powered off since its last power on. The
+        power may have been turned off by others afterwards, so this only
+        tells how long the power has been off at least.
+        """
+        if not self.power_timeline or self.power_timeline[-1][1]:
+            return None
+        return self.power_timeline[-1][0]
+
+    def _set_power_state(self, power_on):
+        """
+        Change the power state unless it already is power_on, and verify the
+        change if the hardware can report its state.
+
+        Raises:
+            aft.errors.AFTDeviceError if the hardware reports the wrong state
+        """
+        with self._power_lock:
+            self._change_power_state(power_on)
+
+    def _change_power_state(self, power_on):
+        state_name = "on" if power_on else "off"
+        if self.power_state is None:
+            self.power_state = self.read_power_state()
+        if self.power_state == power_on:
+            logger.info("Power already " + state_name + ", skipping")
+            return
+
+        timestamp = time.time()
+        # State is unknown until the hardware has done its part
+        self.power_state = None
+        if power_on:
+            self._connect()
+        else:
+            self._disconnect()
+
+        actual_state = self.read_power_state()
+        if actual_state is not None and actual_state != power_on:
+            self.power_state = actual_state
+            raise errors.AFTDeviceError("Cutter reports power " +
+                                        ("on" if actual_state else "off") +
+                                        " after turning it " + state_name)
+
+        self._record_transition(power_on, timestamp)
+
+    def _record_transition(self, power_on, timestamp=None):
+        """
+        Store the new power state and add it to the power timeline
+        """
+        if timestamp is None:
+            timestamp = time.time()
+        self.power_state = power_on
+        self.power_timeline.append((timestamp, power_on))
+        logger.info("Power " + ("on" if power_on else "off") + " at " +
+                    "{0:.3f}".format(timestamp))
+
+    @classmethod
+    def _group_power_operations(cls, cutters, power_on):
+        """
+        Start powering cutters of this class on or off together. Cutters that
+        can change several channels with one command override this.
+
+        Returns:
+            List of the started PowerOperations
+        """
+        if power_on:
+            return [cutter.connect_async() for cutter in cutters]
+        return [cutter.disconnect_async() for cutter in cutters]
+
+    @abc.abstractmethod
+    def _connect(self):
         """
         Method connecting a channel
         """
 
     @abc.abstractmethod
-    def disconnect(self):
+    def _disconnect(self):
         """
         Method disconnecting a channel
         """
+
     @abc.abstractmethod
     def get_cutter_config(self):
         """
         Returns cutter settings as a dictionary.
         """
+
+
+class PowerOperation(object):
+    """
+    Power change running in a background thread
+    """
+    def __init__(self, function, delay=0):
+        self.error = None
+        self._thread = threading.Thread(target=self._run,
+                                        args=(function, delay))
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _run(self, function, delay):
+        try:
+            if delay > 0:
+                time.sleep(delay)
+            function()
+        except Exception as err:
+            self.error = err
+
+    def done(self):
+        """
+        Returns True if the operation has finished
+        """
+        return not self._thread.is_alive()
+
+    def wait(self, timeout=None):
+        """
+        Wait for the operation to finish
+
+        Args:
+            timeout (float): Maximum time to wait in seconds, None for no limit
+
+        Raises:
+            aft.errors.AFTTimeoutError if the operation didn't finish in time,
+            the error of the operation if it failed
+        """
+        self._thread.join(timeout)
+        if self._thread.is_alive():
+            raise errors.AFTTimeoutError("Power operation didn't finish in " +
+                                         str(timeout) + " seconds")
+        if self.error:
+            raise self.error
+
+
+def set_power_state(cutters, power_on, stagger=0, timeout=None):
+    """
+    Power several cutters on or off concurrently.
+
+    Args:
+        cutters (list(Cutter)): The cutters to change
+        power_on (boolean): True to power on, False to power off
+        stagger (float):
+            Delay between powering on consecutive cutters in seconds, to limit
+            the inrush current. Not used when powering off.
+        timeout (float): Maximum time to wait in seconds, None for no limit
+
+    Raises:
+        aft.errors.AFTTimeoutError if the cutters didn't finish in time,
+        the first error otherwise, after all the operations have finished
+    """
+    operations = []
+    if power_on and stagger > 0:
+        for index, cutter in enumerate(cutters):
+            operations.append(PowerOperation(cutter.connect, index * stagger))
+    else:
+        groups = {}
+        for cutter in cutters:
+            groups.setdefault(type(cutter), []).append(cutter)
+        for cutter_class, group in groups.items():
+            operations += cutter_class._group_power_operations(group, power_on)
+
+    deadline = None if timeout is None else time.time() + timeout
+    error = None
+    for operation in operations:
+        remaining = None if deadline is None else \
+            max(deadline - time.time(), 0)
+        try:
+            operation.wait(remaining)
+        except Exception as err:
+            logger.error("Power " + ("on" if power_on else "off") +
+                         " failed: " + str(err))
+            if error is None:
+                error = err
+
+    if error:
+        raise error
@@ -11,9 +11,6 @@
 # MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
 # See the GNU General Public License for more details.
 
-import socket
-
-
 """
 Tool for handling ETH-RLY16 cutter devices.
 
@@ -64,53 +61,149 @@ dec   hex
 
 """
 
+import time
+import socket
+import threading
+
 
-from aft.cutters.cutter import Cutter
+from aft.cutters.cutter import Cutter, PowerOperation
+from aft.logger import Logger as logger
 
 class EthernetRelay16(Cutter):
     """
-    Wrapper for controlling cutters from Usbrelay.
+    Wrapper for controlling ETH-RLY16 relay boards.
+
+    All cutters on the same board share one pooled TCP connection. Relay
+    states are read back from the board after every change, and the power
+    state of the cutter is read from the board when it isn't known.
+
+    A single cutter is changed with the per-relay on/off commands, which
+    leave the other relays alone, so several processes or hosts can share a
+    board. Powering several cutters of a board together with
+    set_power_state() writes all the relay states with one command instead,
+    which undoes relay changes made by others in between, so it isn't safe
+    while another process uses the same board.
+
+    Attributes:
+        _DEFAULT_PORT (integer):
+            The default TCP port of the board
+        _GET_RELAY_STATES (integer):
+            Command returning the relay states as a bitmask
+        _SET_RELAY_STATES (integer):
+            Command setting all relay states from the following bitmask byte
+        _RELAY_ON (integer):
+            Command turning relay 1 on, relay n is turned on with
+            _RELAY_ON + n - 1
+        _RELAY_OFF (integer):
+            Command turning relay 1 off, relay n is turned off with
+            _RELAY_OFF + n - 1
     """
+    _DEFAULT_PORT = 17494
+    _GET_RELAY_STATES = 0x5B
+    _SET_RELAY_STATES = 0x5C
+    _RELAY_ON = 0x65
+    _RELAY_OFF = 0x6F
 
-    def __init__(self, cutter_relay, cutter_ip, cutter_port):
-        self._cutter_relay = int(cutter_relay)
-        self._cutter_ip = cutter_ip
-        self._cutter_port = cutter_port
+    def __init__(self, config):
+        super(EthernetRelay16, self).__init__()
+        # we use zero based indexing simply because Cleware cutter channels use
+        # zero based indexing. This hopefully makes things less confusing
+        self._cutter_relay = int(config["cutter"])
+        self._cutter_ip = config["ip"]
+        self._cutter_port = int(config.get("port", self._DEFAULT_PORT))
+        self._board = RelayBoardConnection.get(self._cutter_ip,
+                                               self._cutter_port,
+                                               self.DEFAULT_TIMEOUT)
 
-    def connect(self):
+    def _connect(self):
         """
         Connects the relay, powering up any connected device
         """
-        # we use zero based indexing simply because Cleware cutter channels use
-        # zero based indexing. This hopefully makes things less confusing
-        command = 101 + self._cutter_relay
-        self._send_command(command)
+        self._board.command(self._RELAY_ON + self._cutter_relay)
 
-    def disconnect(self):
+    def _disconnect(self):
         """
         Disconnects the relay, powering down any connected device
         """
-        # As above, we use zero based indexing
-        command = 111 + self._cutter_relay
-        self._send_command(command)
-
+        self._board.command(self._RELAY_OFF + self._cutter_relay)
 
-    # TCP/IP negotiations on each operation - this is likely not an issue,
-    # but maybe holding on to a socket instead of opening a new one could
-    # be considered?
-    def _send_command(self, command):
+    def is_connected(self):
         """
-        Send the given command to the relay. Return value is discarded
+        Read the relay state from the board
 
-        Args:
-            command (integer): The command to be sent to the device
         Returns:
-            None
+            True if the relay is powered, False otherwise
+        """
+        return bool(self._board.get_relay_states() & (1 << self._cutter_relay))
 
+    def read_power_state(self):
         """
-        s = socket.socket((socket.AF_INET, socket.SOCK_STREAM))
-        s.send(chr(command))
-        s.close()
+        Returns the relay state read from the board
+        """
+        return self.is_connected()
+
+    @classmethod
+    def _group_power_operations(cls, cutters, power_on):
+        """
+        Change all the relays with one command per board
+        """
+        return [PowerOperation(lambda: cls._set_relays(cutters, power_on))]
+
+    @staticmethod
+    def _set_relays(cutters, power_on):
+        """
+        Power several relays on or off with one command per board. The power
+        locks of the cutters are held during the change, and the relay states
+        are read from the boards, so relays changed outside aft are changed
+        too.
+
+        Args:
+            cutters (list(EthernetRelay16)): The cutters to change
+            power_on (boolean): True to power on, False to power off
+        """
+        # Locks are always taken in the same order to avoid deadlocks
+        cutters = sorted(set(cutters), key=lambda cutter: (
+            cutter._cutter_ip, cutter._cutter_port, cutter._cutter_relay))
+        for cutter in cutters:
+            cutter._power_lock.acquire()
+        try:
+            EthernetRelay16._change_relays(cutters, power_on)
+        finally:
+            for cutter in cutters:
+                cutter._power_lock.release()
+
+    @staticmethod
+    def _change_relays(cutters, power_on):
+        boards = {}
+        for cutter in cutters:
+            boards.setdefault(cutter._board, []).append(cutter)
+
+        changed = []
+        masks = {}
+        for board, board_cutters in boards.items():
+            states = board.get_relay_states()
+            for cutter in board_cutters:
+                cutter.power_state = bool(states & (1 << cutter._cutter_relay))
+                if cutter.power_state == power_on:
+                    logger.info("Power already " +
+                                ("on" if power_on else "off") + ", skipping")
+                    continue
+                changed.append(cutter)
+                masks[board] = masks.get(board, 0) | \
+                    (1 << cutter._cutter_relay)
+
+        timestamp = time.time()
+        # State is unknown until the boards have done their part
+        for cutter in changed:
+            cutter.power_state = None
+        for board, mask in masks.items():
+            if power_on:
+                board.update_relays(on_mask=mask)
+            else:
+                board.update_relays(off_mask=mask)
+
+        for cutter in changed:
+            cutter._record_transition(power_on, timestamp)
 
     def get_cutter_config(self):
         """
@@ -129,5 +222,136 @@ class EthernetRelay16(Cutter):
         return {
             "type": "ethernetrelay16",
             "cutter": self._cutter_relay,
-            "ip": self._cuter_ip,
+            "ip": self._cutter_ip,
             "port": self._cutter_port }
+
+
+class RelayBoardConnection(object):
+    """
+    Pooled TCP connection to one ETH-RLY16 board. Use get() to share the
+    connection between all cutters of the board.
+    """
+    _POOL = {}
+    _POOL_LOCK = threading.Lock()
+
+    @staticmethod
+    def get(ip, port, timeout):
+        """
+        Return the pooled connection for the board, creating it if needed
+        """
+        with RelayBoardConnection._POOL_LOCK:
+            key = (ip, int(port))
+            if key not in RelayBoardConnection._POOL:
+                RelayBoardConnection._POOL[key] = RelayBoardConnection(
+                    ip, port, timeout)
+            return RelayBoardConnection._POOL[key]
+
+    def __init__(self, ip, port, timeout):
+        self.ip = ip
+        self.port = int(port)
+        self.timeout = timeout
+        self._socket = None
+        self._lock = threading.Lock()
+
+    def get_relay_states(self):
+        """
+        Returns the relay states as a bitmask, bit high meaning the
+        corresponding relay is powered
+        """
+        with self._lock:
+            return self._command([EthernetRelay16._GET_RELAY_STATES], 1)[0]
+
+    def command(self, command):
+        """
+        Send a single byte command without a response, e.g. turning one relay
+        on or off
+        """
+        with self._lock:
+            self._command([command], 0)
+
+    def update_relays(self, on_mask=0, off_mask=0):
+        """
+        Power on the relays in on_mask and power off the relays in off_mask in
+        a single set relay states command, leaving other relays as they are.
+        The new state is read back from the board, and only the requested
+        relays are verified.
+
+        The command writes the states of all the relays, so a relay changed
+        by another process between reading and writing the states is changed
+        back. Don't use it on boards shared with other processes.
+
+        Args:
+            on_mask (integer): Bitmask of relays to power on
+            off_mask (integer): Bitmask of relays to power off
+
+        Returns:
+            The relay states after the update as a bitmask
+
+        Raises:
+            socket.error if the board doesn't end up in the requested state
+        """
+        with self._lock:
+            states = self._command([EthernetRelay16._GET_RELAY_STATES], 1)[0]
+            new_states = (states | on_mask) & ~off_mask & 0xFF
+            if new_states != states:
+                self._command([EthernetRelay16._SET_RELAY_STATES,
+                               new_states], 0)
+                states = self._command([EthernetRelay16._GET_RELAY_STATES],
+                                       1)[0]
+
+        changed_mask = on_mask | off_mask
+        if states & changed_mask != new_states & changed_mask:
+            raise socket.error("Relay board " + self.ip + " relay states are " +
+                               format(states, "#010b") + ", expected " +
+                               format(new_states, "#010b"))
+        logger.info("Relay board " + self.ip + " relay states: " +
+                    format(states, "#010b"))
+        return states
+
+    def close(self):
+        """
+        Close the connection. It is reopened on the next command.
+        """
+        with self._lock:
+            self._close()
+
+    def _close(self):
+        if self._socket:
+            self._socket.close()
+            self._socket = None
+
+    def _command(self, command, response_length):
+        """
+        Send command to the board and read the response. The connection is
+        reopened and the command retried once on failure.
+
+        Args:
+            command (list(integer)): Command bytes
+            response_length (integer): Number of response bytes
+
+        Returns:
+            The response as a bytearray
+        """
+        try:
+            return self._send(command, response_length)
+        except (socket.error, socket.timeout) as err:
+            logger.warning("Relay board " + self.ip + " command failed: " +
+                           str(err) + ", reconnecting")
+            self._close()
+            return self._send(command, response_length)
+
+    def _send(self, command, response_length):
+        if self._socket is None:
+            self._socket = socket.create_connection((self.ip, self.port),
+                                                    self.timeout)
+            self._socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+        self._socket.sendall(bytes(bytearray(command)))
+        response = bytearray()
+        while len(response) < response_length:
+            data = self._socket.recv(response_length - len(response))
+            if not data:
+                raise socket.error("Relay board " + self.ip +
+                                   " closed the connection")
+            response += bytearray(data)
+        return response
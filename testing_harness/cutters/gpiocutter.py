@@ -18,15 +18,18 @@ from aft.logger import Logger as logger
 
 class GpioCutter(Cutter):
     """
-    Class for controlling a relay with Beaglebone Black GPIO pin
+    Class for controlling a relay with Beaglebone Black GPIO pin. The pin
+    value is read back after every change to verify the power state.
     """
     def __init__(self, config):
+        super(GpioCutter, self).__init__()
         self._GPIOS_BASE_DIR='/sys/class/gpio'
         self._GPIO_PIN = config["gpio_pin"]
         self._GPIO_CUTTER_ON = int(config["gpio_cutter_on"])
         self._GPIO_CUTTER_OFF = int(config["gpio_cutter_off"])
+        self._gpio_fd = None
 
-    def connect(self):
+    def _connect(self):
         """
         Turns power on
         """
@@ -37,7 +40,7 @@ class GpioCutter(Cutter):
             logger.error("Unable to set GPIO controlled cutter on")
             raise e
 
-    def disconnect(self):
+    def _disconnect(self):
         """
         Turns power off
         """
@@ -54,40 +57,86 @@ class GpioCutter(Cutter):
         """
         return 0
 
+    def read_power_state(self):
+        """
+        Read the GPIO pin value back from sysfs
+
+        Returns:
+            True if the pin is in the cutter on state, False if it is in the
+            off state, None if the value can't be read
+        """
+        try:
+            value = self._read_gpio_pin()
+        except GpioCutterError as e:
+            logger.warning(e)
+            return None
+        if value == self._GPIO_CUTTER_ON:
+            return True
+        if value == self._GPIO_CUTTER_OFF:
+            return False
+        return None
+
     def _set_gpio_pin(self, state):
         """
         Set GPIO pin to state
         """
-        switcher = [
-            (lambda f: f.write('0')),
-            (lambda f: f.write('1'))
-        ]
-
-        def open_virt_file():
-            gpio_abs_path = "{0}/{1}/value".format(
-                self._GPIOS_BASE_DIR,
-                self._GPIO_PIN
-            )
-            if not os.path.isfile(gpio_abs_path):
-                emsg = "GPIO file {0} is not found".format(gpio_abs_path)
-                logger.error(emsg)
-                raise GpioCutterError(emsg)
-            fd = None
-            try:
-                fd = open(gpio_abs_path, 'w')
-            except (OSError, IOError) as e:
-                logger.error(e)
-                emsg = "GPIO file {0} can not be opened".format(gpio_abs_path)
-                logger.error(emsg)
-                raise GpioCutterError("GPIO file can not be loaded")
-            return fd
-
         if state < 0:
             raise GpioCutterError("There is not any negative gpio state")
 
-        fd = open_virt_file()
-        switcher[state](fd)
-        fd.close()
+        fd = self._open_gpio_value()
+        try:
+            os.lseek(fd, 0, os.SEEK_SET)
+            os.write(fd, b"1" if state else b"0")
+        except (OSError, IOError) as e:
+            self._close_gpio_value()
+            raise GpioCutterError("GPIO file {0} can not be written: {1}"
+                                  .format(self._gpio_value_path(), e))
+
+    def _read_gpio_pin(self):
+        """
+        Returns the GPIO pin value as an integer
+        """
+        fd = self._open_gpio_value()
+        try:
+            os.lseek(fd, 0, os.SEEK_SET)
+            return int(os.read(fd, 16).strip())
+        except (OSError, IOError, ValueError) as e:
+            self._close_gpio_value()
+            raise GpioCutterError("GPIO file {0} can not be read: {1}"
+                                  .format(self._gpio_value_path(), e))
+
+    def _gpio_value_path(self):
+        return "{0}/{1}/value".format(self._GPIOS_BASE_DIR, self._GPIO_PIN)
+
+    def _open_gpio_value(self):
+        """
+        Returns the file descriptor of the GPIO value file, which is kept open
+        between writes
+        """
+        if self._gpio_fd is not None:
+            return self._gpio_fd
+
+        gpio_abs_path = self._gpio_value_path()
+        if not os.path.isfile(gpio_abs_path):
+            emsg = "GPIO file {0} is not found".format(gpio_abs_path)
+            logger.error(emsg)
+            raise GpioCutterError(emsg)
+        try:
+            self._gpio_fd = os.open(gpio_abs_path, os.O_RDWR)
+        except (OSError, IOError) as e:
+            logger.error(e)
+            emsg = "GPIO file {0} can not be opened".format(gpio_abs_path)
+            logger.error(emsg)
+            raise GpioCutterError("GPIO file can not be loaded")
+        return self._gpio_fd
+
+    def _close_gpio_value(self):
+        if self._gpio_fd is not None:
+            try:
+                os.close(self._gpio_fd)
+            except OSError:
+                pass
+            self._gpio_fd = None
 
 
 class GpioCutterError(Exception):
@@ -21,12 +21,12 @@ from aft.cutters.cutter import Cutter
 class Mockcutter(Cutter):
 
     def __init__(self, config):
-        pass
+        super(Mockcutter, self).__init__()
 
-    def connect(self):
+    def _connect(self):
         pass
 
-    def disconnect(self):
+    def _disconnect(self):
         pass
 
     def get_cutter_config(self):
@@ -23,6 +23,7 @@ class NetBooterCutter(Cutter):
     Wrapper for controlling a netBooter power cutter
     """
     def __init__(self, config):
+        super(NetBooterCutter, self).__init__()
         from devauto.rps.control import RPSControl
         from devauto.rps.base import RPSError
         self.RPSError = RPSError
@@ -37,7 +38,7 @@ class NetBooterCutter(Cutter):
 
         self.cutter_channel = config["channel"]
 
-    def connect(self):
+    def _connect(self):
         try:
             self.rpscontrol.turn_outlet_on(self.cutter_channel)
         except self.RPSError as e:
@@ -45,7 +46,7 @@ class NetBooterCutter(Cutter):
             logger.error("Unable to turn on outlet " + self.cutter_channel)
             raise e
 
-    def disconnect(self):
+    def _disconnect(self):
         try:
             self.rpscontrol.turn_outlet_off(self.cutter_channel)
         except self.RPSError as e:
@@ -15,38 +15,81 @@
 
 """
 Tool for handling Usbrelay USB Cutter devices.
+
+The relay is controlled over a 9600 baud serial port with 8 byte commands.
 """
 
-try:
-    import subprocess32
-except ImportError:
-    import subprocess as subprocess32
-import os
+import serial
 
 from aft.cutters.cutter import Cutter
+from aft.logger import Logger as logger
 
 
 class Usbrelay(Cutter):
     """
     Wrapper for controlling cutters from Usbrelay.
+
+    The serial port is kept open for the lifetime of the object and reopened
+    once if a command fails.
+
+    Attributes:
+        _BAUDS (integer):
+            Serial port speed of the relay
+        _POWER_ON (bytes):
+            Command turning the relay on
+        _POWER_OFF (bytes):
+            Command turning the relay off
     """
-    cutter_controller = os.path.join(os.path.dirname(__file__), os.path.pardir,
-                                     "tools", "cutter_on_off.py")
+    _BAUDS = 9600
+    _POWER_ON = b"\xFE\x05\x00\x00\xFF\x00\x98\x35"
+    _POWER_OFF = b"\xFE\x05\x00\x00\x00\x00\xD9\xC5"
 
     def __init__(self, config):
+        super(Usbrelay, self).__init__()
         self._cutter_dev_path = config["cutter"]
+        self._serial = None
+
+    def _connect(self):
+        self._send_command(self._POWER_ON)
+
+    def _disconnect(self):
+        self._send_command(self._POWER_OFF)
+
+    def close(self):
+        """
+        Close the serial port. It is reopened on the next command.
+        """
+        if self._serial:
+            try:
+                self._serial.close()
+            except (serial.SerialException, OSError):
+                pass
+            self._serial = None
+
+    def _send_command(self, command):
+        """
+        Write command to the relay, reopening the serial port and retrying
+        once on failure.
+
+        Raises:
+            serial.SerialException if the command can't be written
+        """
+        try:
+            self._write(command)
+        except (serial.SerialException, OSError) as err:
+            logger.warning("Usbrelay " + self._cutter_dev_path +
+                           " command failed: " + str(err) + ", reconnecting")
+            self.close()
+            self._write(command)
 
-    def connect(self):
-        subprocess32.check_call(["python", self.cutter_controller,
-                                 self._cutter_dev_path, "1"],
-                                stdout=open(os.devnull, "w"),
-                                stderr=open(os.devnull, "w"))
-
-    def disconnect(self):
-        subprocess32.check_call(["python", self.cutter_controller,
-                                 self._cutter_dev_path, "0"],
-                                stdout=open(os.devnull, "w"),
-                                stderr=open(os.devnull, "w"))
+    def _write(self, command):
+        if self._serial is None:
+            self._serial = serial.Serial(self._cutter_dev_path, self._BAUDS,
+                                         timeout=self.DEFAULT_TIMEOUT,
+                                         write_timeout=self.DEFAULT_TIMEOUT)
+        self._serial.write(command)
+        # Wait until the command has been transmitted
+        self._serial.flush()
 
     def get_cutter_config(self):
         """
@@ -22,6 +22,7 @@ import aft.cutters.usbrelay
 import aft.cutters.mockcutter
 import aft.cutters.netbootercutter
 import aft.cutters.gpiocutter
+import aft.cutters.ethernetrelay16
 import aft.kb_emulators.arduinokeyboard
 import aft.kb_emulators.km232keyboard
 import aft.kb_emulators.gadgetkeyboard
@@ -34,6 +35,7 @@ _CUTTER_CLASSES = {
     "usbrelay" : aft.cutters.usbrelay.Usbrelay,
     "netbootercutter" : aft.cutters.netbootercutter.NetBooterCutter,
     "gpiocutter"    : aft.cutters.gpiocutter.GpioCutter,
+    "ethernetrelay16" : aft.cutters.ethernetrelay16.EthernetRelay16,
     "mockcutter"    : aft.cutters.mockcutter.Mockcutter
 }
 
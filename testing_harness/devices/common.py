@@ -29,6 +29,7 @@ except ImportError:
 
 from aft.logger import Logger as logger
 import aft.tools.ssh as ssh
+import aft.errors as errors
 
 def wait_for_responsive_ip_for_pc_device(
     leases_file_path,
@@ -199,3 +200,58 @@ def verify_device_mode(ip, mode_name):
             str(err.output) + "'.")
 
         return False
+
+def wait_for_partitions(ip, target_device, partuuids, timeout):
+    """
+    Re-read the partition table of target_device on the device with given ip
+    and wait until the partition device nodes have settled.
+
+    Runs partprobe, sync, udevadm trigger and udevadm settle with a single
+    ssh call. Only target_device's uevents are replayed instead of every
+    device on the system. udev removes and re-creates the
+    /dev/disk/by-partuuid/ links asynchronously, so the old links may still
+    exist right after the trigger; the partitions have settled when the udev
+    event queue is empty and, if partuuids is non-empty, every
+    /dev/disk/by-partuuid/<uuid> link exists.
+
+    Args:
+        ip (str): The device ip address
+        target_device (str): Block device path, e.g. /dev/mmcblk0
+        partuuids (list(str)): Partition UUIDs that are expected to appear
+        timeout (integer): Timeout in seconds
+
+    Returns:
+        Time in seconds it took for the partitions to settle
+
+    Raises:
+        aft.errors.AFTTimeoutError if the partitions didn't settle in time
+    """
+    # udevadm settle exit status followed by the links of the partitions
+    check = " && ".join(
+        ["[ $settled -eq 0 ]"] +
+        ["[ -e /dev/disk/by-partuuid/" + uuid + " ]" for uuid in partuuids])
+
+    script = (
+        "sync; " +
+        "partprobe " + target_device + "; " +
+        "udevadm trigger --action=change --sysname-match=" +
+        os.path.basename(target_device) + "*; " +
+        "udevadm settle --timeout=" + str(timeout) + "; " +
+        "settled=$?; " +
+        # Stop udev from removing and re-creating the by-partuuid links
+        # again while the partitions are being mounted
+        "udevadm control -S; " +
+        "if " + check + "; then echo settled; else echo timeout; fi")
+
+    start = time.time()
+    output = ssh.remote_execute(ip, [script], timeout=timeout + 60)
+    duration = time.time() - start
+
+    if "settled" not in output.split():
+        raise errors.AFTTimeoutError(
+            "Partitions of " + target_device + " didn't settle in " +
+            str(timeout) + " seconds")
+
+    logger.info("Partitions of " + target_device + " settled in " +
+                "{0:.2f}".format(duration) + " seconds")
+    return duration
@@ -18,16 +18,15 @@
 Class representing a DUT.
 """
 
-import threading
 import abc
-import os
+import time
 
 from time import sleep
 from six import with_metaclass
 
-from aft.tools.thread_handler import Thread_handler as thread_handler
 from aft.logger import Logger as logger
 import aft.tools.serialrecorder as serialrecorder
+import aft.tools.serialpublisher as serialpublisher
 import aft.errors as errors
 
 class Device(with_metaclass(abc.ABCMeta, object)):
@@ -70,8 +69,14 @@ class Device(with_metaclass(abc.ABCMeta, object)):
 
     def record_serial(self):
         """
-        Start a serialrecorder.py subprocess and add its killer
-        atexit handles
+        Start recording the serial port of the device with the serial recorder
+        service of the process. The recording stops with the RECORDERS_STOP
+        flag or stop_serial_recording().
+
+        If the device has the serial_publish setting, a Unix socket path or
+        HOST:PORT, the live output is published there, see serialpublisher.py.
+        serial_publish_replay sets how many kilobytes of earlier output new
+        readers receive first.
         """
         if not ("serial_port" in self.parameters
                 and "serial_bauds" in self.parameters):
@@ -79,14 +84,39 @@ class Device(with_metaclass(abc.ABCMeta, object)):
                                                self.name + " doesn't include " +
                                                "serial_port and/or serial_bauds.")
 
-        recorder = threading.Thread(target=serialrecorder.main,
-                                args=(self.parameters["serial_port"],
-                                self.parameters["serial_bauds"],
-                                self.parameters["serial_log_name"]),
-                                name=(str(os.getpid()) + "recorder"))
+        serialrecorder.get_service().add_port(
+            self.parameters["serial_port"],
+            self.parameters["serial_bauds"],
+            self.parameters["serial_log_name"])
+
+        if "serial_publish" in self.parameters:
+            serialpublisher.get_publisher().publish(
+                self.parameters["serial_port"],
+                self.parameters["serial_publish"],
+                int(self.parameters.get("serial_publish_replay", 0)) * 1024)
 
-        recorder.start()
-        thread_handler.add_thread(recorder)
+    def stop_serial_recording(self, timeout=None):
+        """
+        Stop recording the serial port of the device and close its logs. Does
+        nothing if the port isn't being recorded.
+
+        Args:
+            timeout (float): Maximum time to wait for the logs to be closed in
+                             seconds, None for no limit
+        """
+        if "serial_port" not in self.parameters:
+            return
+        if "serial_publish" in self.parameters:
+            serialpublisher.unpublish(self.parameters["serial_port"])
+        serialrecorder.remove_port(self.parameters["serial_port"], timeout)
+
+    def recover(self):
+        """
+        Bring the device back to a testable state after it has crashed, e.g.
+        on a kernel panic, by booting it to test mode again.
+        """
+        logger.info("Recovering the device.")
+        self.boot_internal_test_mode()
 
     def test(self, test_case):
         """
@@ -154,5 +184,24 @@ class Device(with_metaclass(abc.ABCMeta, object)):
         """
         logger.info("Rebooting the device.")
         self.detach()
-        sleep(self._POWER_CYCLE_DELAY)
+
+        # The device must stay off for _POWER_CYCLE_DELAY seconds. The time
+        # since this cutter powered the device off counts towards the delay.
+        # If the device was found off without this cutter powering it off,
+        # e.g. by another process or a manual reset, it may have been off only
+        # a moment, so the full delay is used.
+        off_since = self.channel.last_off_time()
+        if off_since is None:
+            sleep(self._POWER_CYCLE_DELAY)
+        else:
+            remaining = self._POWER_CYCLE_DELAY - (time.time() - off_since)
+            if remaining > 0:
+                sleep(remaining)
         self.attach()
+
+    def get_power_timeline(self):
+        """
+        Returns the power transitions of the device as (timestamp, power_on)
+        tuples
+        """
+        return list(self.channel.power_timeline)
@@ -50,6 +50,8 @@ class PCDevice(Device):
             for SSH key injection.
         _SUPER_ROOT_MOUNT_POINT (str):
             Mount location used when having to mount two layers
+        _PARTITION_SETTLE_TIMEOUT (integer):
+            The timeout for partition device nodes to appear after flashing
     """
     _RETRY_ATTEMPTS = 4
     _BOOT_TIMEOUT = 240
@@ -58,6 +60,7 @@ class PCDevice(Device):
     _IMG_NFS_MOUNT_POINT = "/mnt/img_data_nfs"
     _ROOT_PARTITION_MOUNT_POINT = "/mnt/target_root/"
     _SUPER_ROOT_MOUNT_POINT = "/mnt/super_target_root/"
+    _PARTITION_SETTLE_TIMEOUT = 30
 
     def __init__(self, parameters, channel, kb_emulator):
         """
@@ -257,14 +260,13 @@ class PCDevice(Device):
                            timeout=self._SSH_IMAGE_WRITING_TIMEOUT)
 
         # Flashing the same file as already on the disk causes non-blocking
-        # removal and re-creation of /dev/disk/by-partuuid/ files. This sequence
-        # either delays enough or actually settles it.
+        # removal and re-creation of /dev/disk/by-partuuid/ files, so wait
+        # until the partitions we are going to mount are back.
         logger.info("Partprobing.")
-        ssh.remote_execute(self.dev_ip, ["partprobe", self._target_device])
-        ssh.remote_execute(self.dev_ip, ["sync"])
-        ssh.remote_execute(self.dev_ip, ["udevadm", "trigger"])
-        ssh.remote_execute(self.dev_ip, ["udevadm", "settle"])
-        ssh.remote_execute(self.dev_ip, ["udevadm", "control", "-S"])
+        common.wait_for_partitions(self.dev_ip,
+                                   self._target_device,
+                                   self.get_layout_partuuids(filename),
+                                   self._PARTITION_SETTLE_TIMEOUT)
 
     def _mount_single_layer(self, image_file_name):
         """
@@ -298,12 +300,10 @@ class PCDevice(Device):
                          " doesn't exist. Finding root partition.")
             return self.find_root_partition()
 
-        layout_file = open(layout_file_name, "r")
-        disk_layout = json.load(layout_file)
         rootfs_partition = next(
-            partition for partition in list(disk_layout.values()) \
-            if isinstance(partition, dict) and \
-            partition["name"] == "rootfs")
+            partition for partition in self._get_layout_partitions(
+                                                            layout_file_name)
+            if partition["name"] == "rootfs")
         return os.path.join(
             "/dev",
             "disk",
@@ -313,6 +313,42 @@ class PCDevice(Device):
     def get_layout_file_name(self, image_file_name):
         return image_file_name.split(".")[0] + "-disk-layout.json"
 
+    def get_layout_partuuids(self, image_file_name):
+        """
+        Return the partition UUIDs listed in the disk layout file of the image.
+
+        Args:
+            image_file_name (str): The name of the image file. Disk layout file
+            name is based on this
+
+        Returns:
+            (list(str)): Partition UUIDs, or empty list if the disk layout file
+            doesn't exist
+        """
+        layout_file_name = self.get_layout_file_name(image_file_name)
+        if not os.path.isfile(layout_file_name):
+            return []
+
+        return [partition["uuid"] for partition in
+                self._get_layout_partitions(layout_file_name)
+                if "uuid" in partition]
+
+    def _get_layout_partitions(self, layout_file_name):
+        """
+        Return the partition entries of a disk layout file.
+
+        Args:
+            layout_file_name (str): Path to the disk layout json file
+
+        Returns:
+            (list(dict)): Partition dictionaries
+        """
+        with open(layout_file_name, "r") as layout_file:
+            disk_layout = json.load(layout_file)
+
+        return [partition for partition in list(disk_layout.values())
+                if isinstance(partition, dict)]
+
     def find_root_partition(self):
         '''
         Find _target_device partition that has /home/root
@@ -33,11 +33,14 @@ import aft.devicefactory as devicefactory
 from aft.logger import Logger as logger
 from aft.tester import Tester
 from aft.tools.misc import local_execute, inject_ssh_keys_to_image
+import aft.tools.resultcache as resultcache
 
 class DevicesManager(object):
     """Class handling devices connected to the same host PC"""
 
     __PLATFORM_FILE_NAME = "/etc/aft/devices/platform.cfg"
+    # Maximum time to wait for the serial logs to be closed on release [s]
+    _SERIAL_RECORDING_STOP_TIMEOUT = 5
 
     # Construct the device object of the correct machine type based on the
     # catalog config file.
@@ -209,8 +212,16 @@ class DevicesManager(object):
     def release(self, reserved_device):
         """
         Put the reserved device back to the pool. It will happen anyway when
-        the process dies, but this removes the stale lockfile.
+        the process dies, but this removes the stale lockfile. The serial
+        recording and the connections of the keyboard emulator of the device
+        are closed.
         """
+        if reserved_device:
+            reserved_device.stop_serial_recording(
+                self._SERIAL_RECORDING_STOP_TIMEOUT)
+        if reserved_device and reserved_device.kb_emulator:
+            reserved_device.kb_emulator.close()
+
         for i in self._lockfiles:
             if i[0] == "daft_dut_lock":
                 i[1].close()
@@ -253,6 +264,8 @@ class DevicesManager(object):
         if args.noflash:
             return device, tester
 
+        # The contents of the device are unknown until flashing succeeds
+        resultcache.record_flashed_image(device.name, None)
         flash_attempt = 0
         flash_retries = args.flash_retries
         while flash_attempt < flash_retries:
@@ -262,7 +275,10 @@ class DevicesManager(object):
                     str(flash_attempt) + " of " + str(flash_retries) + ".")
                 device.write_image(args.file_name)
                 print("Flashing successful.")
-                return device, tester
+                # Logs a warning instead of raising, so it never fails the
+                # flash
+                resultcache.record_flashed_image(device.name, args.file_name)
+                break
 
             except KeyboardInterrupt:
                 raise
@@ -284,6 +300,8 @@ class DevicesManager(object):
                     print("Flashing failed, trying again " +
                         str(flash_retries - flash_attempt) + " more times")
 
+        return device, tester
+
     def check_libcomposite_service_running(self):
         """
         Check if libcomposite.service is running. Return 1 if running, else 0
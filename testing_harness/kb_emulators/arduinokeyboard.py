@@ -11,7 +11,16 @@
 # MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
 # See the GNU General Public License for more details.
 
-from multiprocessing import Process, Queue
+import os
+import tty
+import time
+import errno
+import fcntl
+import select
+import threading
+from multiprocessing import Process, Pipe
+
+import serial
 
 from aft.kb_emulators.kb_emulator import KeyboardEmulator
 import aft.errors as errors
@@ -20,8 +29,28 @@ from aft.logger import Logger as logger
 class ArduinoKeyboard(KeyboardEmulator):
     """
     Class for Arduino keyboard emulator
+
+    PEM playback is run in a long-lived session process owned by the emulator
+    object, so PEM is imported and the process started only once instead of
+    for every keystroke file. The session is health-checked before each
+    playback and restarted only if it has died or stopped responding.
+
+    The session keeps the serial port of the emulator open for its whole
+    life. PEM plays each keystroke file to a pseudo terminal, and the session
+    forwards the bytes between it and the emulator, so the emulator port isn't
+    opened and closed, resetting an Arduino, for every file. The port is
+    reopened only when writing to it fails.
+
+    Attributes:
+        _PLAYBACK_TIMEOUT (integer):
+            Timeout for playing one keystroke file in seconds
+        _HEALTH_CHECK_TIMEOUT (integer):
+            Timeout for the session to answer a health check in seconds
     """
     _INTERFACE = "serialconnection"
+    _PLAYBACK_TIMEOUT = 60
+    _HEALTH_CHECK_TIMEOUT = 5
+    _DEFAULT_BAUDS = 115200
 
     def __init__(self, config):
         super(ArduinoKeyboard, self).__init__()
@@ -30,6 +59,9 @@ class ArduinoKeyboard(KeyboardEmulator):
 
         self.emulator_path = config["pem_port"]
         self.interface = config["pem_interface"]
+        self.bauds = int(config.get("pem_bauds", self._DEFAULT_BAUDS))
+        self._session = None
+        self._connection = None
 
     def send_keystrokes(self, _file):
         """
@@ -42,36 +74,278 @@ class ArduinoKeyboard(KeyboardEmulator):
         Raises:
             aft.errors.AFTDeviceError if PEM connection times out
         """
+        if not self._session_is_healthy():
+            self._start_session()
+
+        self._connection.send(_file)
+        if not self._connection.poll(self._PLAYBACK_TIMEOUT):
+            self._stop_session()
+            raise errors.AFTDeviceError("Failed to connect to Arduino " +
+                                        "keyboard emulator - check the " +
+                                        "connections, AFT settings and " +
+                                        "emulator hardware")
+
+        status, error = self._connection.recv()
+        if status == "error":
+            self._stop_session()
+            raise error
+
+    def close(self):
+        """
+        Stop the PEM session
+        """
+        self._stop_session()
+
+    def _start_session(self):
+        """
+        Start a new PEM session process
+
+        Raises:
+            The PEM import error if PEM can't be imported
+        """
+        self._stop_session()
+        logger.info("Starting Arduino keyboard emulator session for " +
+                    self.emulator_path)
+        self._connection, child_connection = Pipe()
+        self._session = Process(target=_pem_session,
+                                args=(self.interface, self.emulator_path,
+                                      self.bauds, child_connection))
+        # ensure python process is closed in case main process dies but
+        # the session is still waiting for playback
+        self._session.daemon = True
+        self._session.start()
+
+        if not self._session_is_healthy():
+            self._stop_session()
+            raise errors.AFTDeviceError("Arduino keyboard emulator session " +
+                                        "failed to start")
+
+    def _stop_session(self):
+        """
+        Stop the PEM session process, if there is one
+        """
+        if self._session is None:
+            return
+        if self._session.is_alive():
+            try:
+                self._connection.send(None)
+            except (IOError, OSError):
+                pass
+            self._session.join(1)
+            if self._session.is_alive():
+                self._session.terminate()
+        self._connection.close()
+        self._session = None
+        self._connection = None
+
+    def _session_is_healthy(self):
+        """
+        Check that the PEM session process is alive and responding
+
+        Returns:
+            True if the session is healthy, False otherwise
+
+        Raises:
+            The PEM import error if the session failed to import PEM
+        """
+        if self._session is None or not self._session.is_alive():
+            return False
+
+        try:
+            self._connection.send("ping")
+            if not self._connection.poll(self._HEALTH_CHECK_TIMEOUT):
+                return False
+            status, error = self._connection.recv()
+        except (IOError, OSError, EOFError):
+            return False
+
+        if status == "error":
+            self._stop_session()
+            raise error
+        return status == "pong"
+
+
+class _SerialBridge(object):
+    """
+    Keeps a serial port open and forwards the bytes written to a pseudo
+    terminal to it, and the bytes read from it back to the pseudo terminal.
+
+    Attributes:
+        path (str): Path of the pseudo terminal to give PEM as its port
+        error (Exception): Set if forwarding failed even after reopening the
+                           serial port
+    """
+    _READ_SIZE = 4096
+    _FLUSH_TIMEOUT = 10
+
+    def __init__(self, port, bauds):
+        self._port = port
+        self._bauds = bauds
+        self._serial = None
+        self.error = None
+        self._master, self._slave = os.openpty()
+        # Keeping the slave open keeps the master open between playbacks
+        tty.setraw(self._slave)
+        fcntl.fcntl(self._master, fcntl.F_SETFL,
+                    fcntl.fcntl(self._master, fcntl.F_GETFL) | os.O_NONBLOCK)
+        self.path = os.ttyname(self._slave)
+        self._lock = threading.Lock()
+        self._running = True
+        self._open()
+        self._thread = threading.Thread(target=self._forward)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _open(self):
+        self._close_serial()
+        self._serial = serial.Serial(self._port, self._bauds, timeout=0)
+
+    def _close_serial(self):
+        if self._serial is not None:
+            try:
+                self._serial.close()
+            except (IOError, OSError, serial.SerialException):
+                pass
+            self._serial = None
+
+    def _forward(self):
+        while self._running:
+            poller = select.poll()
+            poller.register(self._master, select.POLLIN)
+            if self._serial is not None:
+                poller.register(self._serial.fileno(), select.POLLIN)
+            try:
+                events = poller.poll(100)
+            except (select.error, IOError, OSError):
+                continue
+            with self._lock:
+                for fd, _ in events:
+                    if fd == self._master:
+                        self._to_serial()
+                    else:
+                        self._from_serial()
+
+    def _to_serial(self):
+        """
+        Write the bytes PEM has written to the serial port, reopening the
+        port once if writing fails
+        """
+        try:
+            data = os.read(self._master, self._READ_SIZE)
+        except OSError:
+            return
+        try:
+            self._serial.write(data)
+        except (IOError, OSError, AttributeError, serial.SerialException):
+            try:
+                self._open()
+                self._serial.write(data)
+            except (IOError, OSError, serial.SerialException) as err:
+                self._close_serial()
+                self.error = err
+
+    def _from_serial(self):
+        """
+        Pass the bytes from the emulator to PEM. Dropped if PEM isn't reading.
+        """
+        try:
+            data = self._serial.read(self._serial.in_waiting or 1)
+            if data:
+                os.write(self._master, data)
+        except OSError as err:
+            if err.errno != errno.EAGAIN:
+                self._close_serial()
+        except (IOError, serial.SerialException):
+            self._close_serial()
+
+    def flush(self):
+        """
+        Wait until everything PEM wrote has been written to the serial port
+
+        Returns:
+            The forwarding error since the previous flush, or None
+        """
+        deadline = time.time() + self._FLUSH_TIMEOUT
+        while time.time() < deadline:
+            with self._lock:
+                if not select.select([self._master], [], [], 0)[0]:
+                    if self._serial is not None:
+                        try:
+                            self._serial.flush()
+                        except (IOError, OSError, serial.SerialException):
+                            pass
+                    break
+            time.sleep(0.01)
+        error = self.error
+        self.error = None
+        return error
+
+    def close(self):
+        self._running = False
+        self._thread.join(1)
+        self._close_serial()
+        os.close(self._master)
+        os.close(self._slave)
+
+
+def _pem_session(interface, port, bauds, connection):
+    """
+    PEM session process main loop. Plays keystroke files received from
+    connection until None is received.
+
+    Args:
+        interface (str): PEM interface
+        port (str): PEM port
+        bauds (integer): Baud rate of the PEM port
+        connection (multiprocessing.Connection): Connection to the emulator
+    """
+    def reply(status, error=None):
+        try:
+            connection.send((status, error))
+        except Exception:
+            # Error couldn't be pickled
+            connection.send((status, errors.AFTDeviceError(str(error))))
+
+    try:
         from pem.main import main as pem_main
+        bridge = _SerialBridge(port, bauds)
+    except Exception as err:
+        reply("error", err)
+        return
+
+    try:
+        while True:
+            try:
+                request = connection.recv()
+            except EOFError:
+                return
+
+            if request is None:
+                return
+
+            if request == "ping":
+                reply("pong")
+                continue
 
-        def call_pem(exceptions):
             try:
                 pem_main(
                 [
                     "pem",
-                    "--interface", self.interface,
-                    "--port", self.emulator_path,
-                    "--playback", _file
+                    "--interface", interface,
+                    "--port", bridge.path,
+                    "--playback", request
                 ])
             except Exception as err:
-                exceptions.put(err)
-
-        exception_queue = Queue()
-        process = Process(target=call_pem, args=(exception_queue,))
-        # ensure python process is closed in case main process dies but
-        # the subprocess is still waiting for timeout
-        process.daemon = True
-        process.start()
-        process.join(60)
-
-        if not exception_queue.empty():
-            raise exception_queue.get()
-
-        if process.is_alive():
-            process.terminate()
-        else:
-            return
+                bridge.flush()
+                reply("error", err)
+                continue
 
-        raise errors.AFTDeviceError("Failed to connect to Arduino keyboard " +
-                                    "emulator - check the connections, " +
-                                    "AFT settings and emulator hardware")
+            error = bridge.flush()
+            if error is not None:
+                reply("error", errors.AFTDeviceError(
+                    "Writing to Arduino keyboard emulator " + port +
+                    " failed: " + str(error)))
+            else:
+                reply("done")
+    finally:
+        bridge.close()
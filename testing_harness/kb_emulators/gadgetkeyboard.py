@@ -12,11 +12,20 @@
 # See the GNU General Public License for more details.
 
 from time import sleep
-import os.path
-from multiprocessing import Process
+import os
+import time
+import errno
+import select
+import re
+import json
+import hashlib
+import binascii
 
 from aft.logger import Logger as logger
+import aft.config as config
+import aft.errors as errors
 from aft.kb_emulators.kb_emulator import KeyboardEmulator
+from aft.tools.serialwaiter import SerialWaiter
 
 class GadgetKeyboard(KeyboardEmulator):
     '''
@@ -75,14 +84,52 @@ class GadgetKeyboard(KeyboardEmulator):
     keys_with_shift = ['!', '@', '#', '$', '%', '^', '&', '*', '(', ')', '_',
                        '+', '{', '}', '|', ':', '"', '~', '<', '>', '?']
 
+    # Compiled keystroke program instructions
+    WRITE = "w" # Write a HID report, argument is the 8 byte report
+    DELAY = "d" # Sleep, argument is the delay in seconds
+    # Wait for serial output, argument is [pattern, timeout]
+    WAIT = "s"
+    # Write reports until serial output matches, argument is
+    # [reports, interval, pattern, timeout]
+    REPEAT = "r"
+
+    # Bump when the compiled program format changes to invalidate the cache
+    PROGRAM_VERSION = 3
+
+    # Default timeout for WAIT_FOR and REPEAT directives in seconds
+    DEFAULT_WAIT_TIMEOUT = 60
+
+    # Serial output pattern in WAIT_FOR and REPEAT directives
+    _PATTERN = r'"((?:[^"\\]|\\.)*)"'
+    _TIMEOUT = r'(?:\s+TIMEOUT\s+(\S+))?\s*(?:#.*)?$'
+    _WAIT_FOR_SYNTAX = re.compile(r'^WAIT_FOR\s+' + _PATTERN + _TIMEOUT)
+    _REPEAT_SYNTAX = re.compile(r'^REPEAT\s+(.+?)\s+EVERY\s+(\S+)\s+UNTIL\s+' +
+                                _PATTERN + _TIMEOUT)
+
+    # Number of normal key slots in a HID keyboard report
+    ROLLOVER_KEYS = 6
+
 
     def __init__(self, config):
         super(GadgetKeyboard, self).__init__()
         self.emulator = config["pem_port"] # Initialize path to HID keyboard emulator
+        # Long-lived HID device writer, optionally limited to a maximum
+        # number of reports per second for slow DUT firmwares
+        self.writer = HidWriter(self.emulator,
+                                float(config.get("kb_max_report_rate", 0)))
+        # Default for sending text with 6-key rollover reports
+        self.burst_mode = config.get("kb_burst_mode", "false").lower() in \
+            ("1", "true", "yes", "on")
+        self.burst = self.burst_mode # Burst state of the file being parsed
+        # Serial port for WAIT_FOR and REPEAT directives
+        self.serial_port = config.get("serial_port")
+        self.serial_bauds = config.get("serial_bauds", 115200)
         self.filepath = "" # Initialize filepath for send_keystrokes_from_file()
         self.delay_between_keys = 0 # Delay (seconds) between keystrokes
         self.modifier = 0 # On default don't use modifier key
         self.line_number = 0 # Line number we are parsing from filepath
+        self.program = [] # Compiled program of the file being parsed
+        self.compiled = {} # Compiled programs by file path
         logger.set_process_prefix()
 
     def send_keystrokes(self, filepath):
@@ -114,20 +161,25 @@ class GadgetKeyboard(KeyboardEmulator):
             # Mix everything, but have a separate line for 'DELAY='
             DELAY=0.2
             <F2> "Hello world!" <ENTER> <SHIFT_L> "uppercase" <SHIFT_L>
-
+            # Send text with 6-key rollover reports by using 'BURST', the
+            # delay is then used only after each "" text
+            BURST = 1
+            "console=ttyS0,115200 root=/dev/mmcblk0p2"
+            BURST = 0
+            # Wait until the DUT serial output matches before continuing.
+            # "/.../" is a regular expression, otherwise the text is matched
+            # as is. TIMEOUT is in seconds and optional, on default 60.
+            WAIT_FOR "/Boot (Menu|Options)/" TIMEOUT 30
+            # Send keys every EVERY seconds until the serial output matches
+            REPEAT <F7> EVERY 0.2 UNTIL "Boot Manager" TIMEOUT 30
+
+        The file is compiled to a program of HID reports and delays on the
+        first use and the program is cached, so syntax errors are raised
+        before any keys are sent.
         '''
-
-        self.delay_between_keys = 0
-        self.modifier = 0
         self.filepath = filepath
-
-        with open(filepath, "r") as f:
-            self.line_number = 1
-            for line in f:
-                line = line.strip()
-                if line:
-                    self.parse_line(line)
-                self.line_number += 1
+        program = self.compile_keystrokes(filepath)
+        self.play(program, filepath)
 
     def send_keystrokes_from_arg(self, lines):
         '''
@@ -144,16 +196,240 @@ class GadgetKeyboard(KeyboardEmulator):
 
         '''
 
+        self.filepath = "arg"
+        program = self.compile_lines(lines.split("\n"))
+        self.play(program, "arg")
+
+    def close(self):
+        '''
+        Close the HID device file
+        '''
+        self.writer.close()
+
+    def compile_keystrokes(self, filepath):
+        '''
+        Compile a keystroke file to a program of HID reports and delays.
+
+        Compiled programs are cached in memory and on disk in
+        config.KEYSTROKE_CACHE_FOLDER. A cached program is used if the file
+        modification time and size are unchanged, or if the file content hash
+        matches.
+
+        Args:
+            filepath: Path to the text file that contains keystrokes to send.
+
+        Returns:
+            Compiled program as a list of (instruction, argument) tuples
+
+        Raises:
+            LineSyntaxError or TranslateError if the file has errors
+        '''
+        stat = os.stat(filepath)
+        entry = self.compiled.get((filepath, self.burst_mode))
+        if entry is None:
+            entry = self._load_cached_program(filepath)
+
+        if entry and entry["mtime"] == stat.st_mtime and \
+           entry["size"] == stat.st_size:
+            self.compiled[(filepath, self.burst_mode)] = entry
+            return entry["program"]
+
+        with open(filepath, "rb") as f:
+            content = f.read()
+        digest = hashlib.sha1(content).hexdigest()
+
+        if not entry or entry["sha1"] != digest:
+            self.filepath = filepath
+            lines = [line.strip() for line in
+                     content.decode("utf-8").splitlines()]
+            entry = {"sha1": digest, "program": self.compile_lines(lines)}
+            logger.info("Compiled " + filepath + " to " +
+                        str(len(entry["program"])) + " instructions",
+                        "kb_emulator.log")
+
+        entry["mtime"] = stat.st_mtime
+        entry["size"] = stat.st_size
+        self.compiled[(filepath, self.burst_mode)] = entry
+        self._store_cached_program(filepath, entry)
+        return entry["program"]
+
+    def compile_lines(self, lines):
+        '''
+        Compile keystroke lines to a program of HID reports and delays.
+
+        Args:
+            lines: List of lines with the syntax explained in send_keystrokes
+
+        Returns:
+            Compiled program as a list of (instruction, argument) tuples
+        '''
         self.delay_between_keys = 0
         self.modifier = 0
-        self.filepath = "arg"
+        self.burst = self.burst_mode
+        self.program = []
 
-        lines = lines.split("\n")
         self.line_number = 1
         for line in lines:
-            self.parse_line(line)
+            if line:
+                self.parse_line(line)
             self.line_number += 1
 
+        return self.program
+
+    def play(self, program, name):
+        '''
+        Play a compiled keystroke program.
+
+        Args:
+            program: Compiled program as returned by compile_keystrokes
+            name: Name of the program for logging
+
+        Raises:
+            aft.errors.AFTConfigurationError if the program waits for serial
+            output but serial_port isn't configured
+        '''
+        logger.info("Playing " + str(len(program)) + " instructions from " +
+                    str(name), "kb_emulator.log")
+        waiter = None
+        if any(instruction in (self.WAIT, self.REPEAT)
+               for instruction, _ in program):
+            # Checked here instead of when compiling, as programs loaded
+            # from the cache aren't compiled
+            if not self.serial_port:
+                raise errors.AFTConfigurationError(
+                    "Keystrokes " + str(name) + " wait for serial " +
+                    "output but serial_port isn't configured")
+            waiter = SerialWaiter(self.serial_port, self.serial_bauds)
+            waiter.start()
+
+        write = self.writer.write
+        self.writer.reset_statistics()
+        try:
+            for instruction, argument in program:
+                if instruction == self.WRITE:
+                    write(argument)
+                elif instruction == self.DELAY:
+                    sleep(argument)
+                elif instruction == self.WAIT:
+                    self._wait(waiter, *argument)
+                elif instruction == self.REPEAT:
+                    self._repeat(waiter, *argument)
+        finally:
+            if waiter:
+                waiter.stop()
+        self.writer.log_statistics(name)
+
+    def _wait(self, waiter, pattern, timeout):
+        '''
+        Wait until the serial output matches pattern.
+
+        Raises:
+            aft.errors.AFTTimeoutError if pattern wasn't found in time
+        '''
+        start = time.time()
+        if not waiter.wait_for(pattern, timeout):
+            raise errors.AFTTimeoutError("Didn't find '" + pattern +
+                                         "' in serial output in " +
+                                         str(timeout) + " seconds")
+        logger.info("Waited " + "{0:.2f}".format(time.time() - start) +
+                    " s for '" + pattern + "'", "kb_emulator.log")
+
+    def _repeat(self, waiter, reports, interval, pattern, timeout):
+        '''
+        Write reports every interval seconds until the serial output matches
+        pattern.
+
+        Raises:
+            aft.errors.AFTTimeoutError if pattern wasn't found in time
+        '''
+        start = time.time()
+        deadline = start + timeout
+        repeats = 0
+        while True:
+            for report in reports:
+                self.writer.write(report)
+            repeats += 1
+
+            next_repeat = min(time.time() + interval, deadline)
+            if waiter.wait_for(pattern, max(next_repeat - time.time(), 0)):
+                break
+            if time.time() >= deadline:
+                raise errors.AFTTimeoutError("Didn't find '" + pattern +
+                                             "' in serial output in " +
+                                             str(timeout) + " seconds")
+
+        logger.info("Repeated keys " + str(repeats) + " times in " +
+                    "{0:.2f}".format(time.time() - start) + " s until '" +
+                    pattern + "'", "kb_emulator.log")
+
+    def _cache_file_name(self, filepath):
+        '''
+        Return the on-disk cache file name for a keystroke file
+        '''
+        key = hashlib.sha1((os.path.abspath(filepath) + "\0burst=" +
+                            str(int(self.burst_mode))).encode("utf-8"))
+        return os.path.join(config.KEYSTROKE_CACHE_FOLDER,
+                            key.hexdigest() + ".json")
+
+    def _load_cached_program(self, filepath):
+        '''
+        Load a compiled program from the on-disk cache.
+
+        Returns:
+            Cache entry dictionary or None if there is no valid cache entry
+        '''
+        try:
+            with open(self._cache_file_name(filepath), "r") as cache_file:
+                cached = json.load(cache_file)
+        except (IOError, OSError, ValueError):
+            return None
+
+        if cached.get("version") != self.PROGRAM_VERSION:
+            return None
+
+        program = []
+        for instruction, argument in cached["program"]:
+            if instruction == self.WRITE:
+                argument = binascii.unhexlify(argument)
+            elif instruction == self.REPEAT:
+                argument = [[binascii.unhexlify(report)
+                             for report in argument[0]]] + argument[1:]
+            program.append((instruction, argument))
+
+        return {"mtime": cached["mtime"], "size": cached["size"],
+                "sha1": cached["sha1"], "program": program}
+
+    def _store_cached_program(self, filepath, entry):
+        '''
+        Store a compiled program to the on-disk cache. Failing to store is not
+        an error, the program is just compiled again next time.
+        '''
+        program = []
+        for instruction, argument in entry["program"]:
+            if instruction == self.WRITE:
+                argument = binascii.hexlify(argument).decode("ascii")
+            elif instruction == self.REPEAT:
+                argument = [[binascii.hexlify(report).decode("ascii")
+                             for report in argument[0]]] + list(argument[1:])
+            program.append((instruction, argument))
+
+        cache_file_name = self._cache_file_name(filepath)
+        temp_file_name = cache_file_name + "." + str(os.getpid())
+        try:
+            if not os.path.isdir(config.KEYSTROKE_CACHE_FOLDER):
+                os.makedirs(config.KEYSTROKE_CACHE_FOLDER)
+            with open(temp_file_name, "w") as cache_file:
+                json.dump({"version": self.PROGRAM_VERSION,
+                           "path": os.path.abspath(filepath),
+                           "mtime": entry["mtime"],
+                           "size": entry["size"],
+                           "sha1": entry["sha1"],
+                           "program": program}, cache_file)
+            os.rename(temp_file_name, cache_file_name)
+        except (IOError, OSError) as err:
+            logger.warning("Couldn't cache compiled keystrokes of " +
+                           filepath + ": " + str(err), "kb_emulator.log")
+
     def parse_line(self, line):
         '''
         Parse a text file line.
@@ -169,6 +445,40 @@ class GadgetKeyboard(KeyboardEmulator):
                 raise LineSyntaxError(self.filepath, self.line_number,
                             "'" + line[6:].strip() + "' not a number")
 
+        # If line starts with 'BURST' toggle sending text in bursts
+        elif line[0:5] == "BURST":
+            try:
+                self.burst = bool(int(line.split('=')[1].strip()))
+            except (ValueError, IndexError):
+                raise LineSyntaxError(self.filepath, self.line_number,
+                            "'" + line[6:].strip() + "' not 0 or 1")
+
+        # If line starts with 'WAIT_FOR' wait for serial output
+        elif line[0:8] == "WAIT_FOR":
+            match = self._WAIT_FOR_SYNTAX.match(line)
+            if not match:
+                raise LineSyntaxError(self.filepath, self.line_number,
+                            "Expected WAIT_FOR \"pattern\" [TIMEOUT seconds]")
+            pattern = self.parse_pattern(match.group(1))
+            timeout = self.parse_number(match.group(2),
+                                        self.DEFAULT_WAIT_TIMEOUT)
+            self.program.append((self.WAIT, [pattern, timeout]))
+
+        # If line starts with 'REPEAT' send keys until serial output matches
+        elif line[0:6] == "REPEAT":
+            match = self._REPEAT_SYNTAX.match(line)
+            if not match:
+                raise LineSyntaxError(self.filepath, self.line_number,
+                            "Expected REPEAT keys EVERY seconds UNTIL " +
+                            "\"pattern\" [TIMEOUT seconds]")
+            reports = self.parse_repeated_keys(match.group(1))
+            interval = self.parse_number(match.group(2))
+            pattern = self.parse_pattern(match.group(3))
+            timeout = self.parse_number(match.group(4),
+                                        self.DEFAULT_WAIT_TIMEOUT)
+            self.program.append((self.REPEAT,
+                                 [reports, interval, pattern, timeout]))
+
         else:
             # Parse lines keys one at a time
             i = 0
@@ -198,6 +508,69 @@ class GadgetKeyboard(KeyboardEmulator):
 
                 i += 1
 
+    def parse_pattern(self, text):
+        '''
+        Parse a serial output pattern of WAIT_FOR and REPEAT directives.
+
+        Args:
+            text: Text between the quotes, "/.../" is a regular expression
+
+        Returns:
+            Regular expression as a string
+        '''
+        text = re.sub(r'\\(.)', r'\1', text)
+        if len(text) > 1 and text[0] == "/" and text[-1] == "/":
+            pattern = text[1:-1]
+        else:
+            pattern = re.escape(text)
+
+        try:
+            re.compile(pattern)
+        except re.error as err:
+            raise LineSyntaxError(self.filepath, self.line_number,
+                                  "Bad pattern '" + text + "': " + str(err))
+        return pattern
+
+    def parse_number(self, text, default=None):
+        '''
+        Parse a number of seconds of WAIT_FOR and REPEAT directives.
+
+        Args:
+            text: Number as text or None
+            default: Value to return if text is None
+        '''
+        if text is None:
+            return default
+        try:
+            return float(text)
+        except ValueError:
+            raise LineSyntaxError(self.filepath, self.line_number,
+                                  "'" + text + "' not a number")
+
+    def parse_repeated_keys(self, keys):
+        '''
+        Parse the keys of a REPEAT directive.
+
+        Args:
+            keys: Keys with the normal syntax, e.g. '<F7>' or '"y" <ENTER>'
+
+        Returns:
+            List of HID reports that send the keys
+        '''
+        program = self.program
+        self.program = []
+        try:
+            self.parse_line(keys)
+            reports = [argument for instruction, argument in self.program
+                       if instruction == self.WRITE]
+        finally:
+            self.program = program
+
+        if not reports:
+            raise LineSyntaxError(self.filepath, self.line_number,
+                                  "No keys to repeat")
+        return reports
+
     def parse_special(self, line, i):
         '''
         Parse a special key that starts with '<' and ends with '>'.
@@ -228,10 +601,9 @@ class GadgetKeyboard(KeyboardEmulator):
             else:
                 self.modifier = self.modifier_codes[special]
 
-        # If special key is a normal key, send it
+        # If special key is a normal key, compile it
         else:
-            self.send_a_key(special)
-            sleep(self.delay_between_keys)
+            self.compile_key(special)
 
         return i
 
@@ -247,8 +619,9 @@ class GadgetKeyboard(KeyboardEmulator):
             i: Iterator for the line that tells where the ending " is.
         '''
         i += 1
+        keys = []
         try:
-            # Send keys until " is found.
+            # Collect keys until " is found.
             while line[i] != "\"":
                 key = line[i]
                 # Allow sending ", by using '\'
@@ -256,46 +629,80 @@ class GadgetKeyboard(KeyboardEmulator):
                     i += 1
                     key = line[i]
 
-                self.send_a_key(key)
-                sleep(self.delay_between_keys)
+                keys.append(key)
                 i += 1
 
         except IndexError:
             raise LineSyntaxError(self.filepath, self.line_number,
                                 "Didn't find closing \"")
 
+        if self.burst:
+            self.compile_burst(keys)
+        else:
+            for key in keys:
+                self.compile_key(key)
+
         return i
 
-    def send_a_key(self, key, timeout=20):
+    def compile_key(self, key):
         '''
-        HID keyboard message length is 8 bytes and format is:
+        Append the reports of a key and the delay after it to the program.
 
-            [modifier, reserved, Key1, Key2, Key3, Key4, Key6, Key7]
+        Args:
+            key: A key to compile, for example: "a", "z", "3", "F2", "ENTER"
+        '''
+        self.program.append((self.WRITE, self.key_report(key)))
+        self.program.append((self.WRITE, bytes(HidWriter.EMPTY_REPORT)))
+        if self.delay_between_keys:
+            self.program.append((self.DELAY, self.delay_between_keys))
 
-        So first byte is for modifier key and all bytes after third one are for
-        normal keys. After sending a key stroke, empty message with zeroes has
-        to be sent to stop the key being pressed. Messages are sent by writing
-        to the emulated HID usb port in /dev/. US HID keyboard hex codes
-        are used for translating keys.
+    def compile_burst(self, keys):
+        '''
+        Append the reports of keys packed into 6-key rollover reports to the
+        program, followed by the delay.
+
+        Every report adds exactly one newly pressed key while the earlier keys
+        of the group stay held, so the host sees the key presses in order.
+        A group is released with a single empty report when it is full, when
+        the next key is already held (a key has to be released before it can
+        be pressed again) or when the next key needs a different modifier.
 
         Args:
-            key: A key to send, for example: "a", "z", "3", "F2", "ENTER"
-            timeout: how long sending a key will be tried until quitting [s]
+            keys: List of keys to compile, for example: ["l", "s", "ENTER"]
         '''
-        def writer(path, message, empty):
-            while True:
-                try:
-                    with open(path, "w") as emulator:
-                        emulator.write(message.decode()) # Send the key
-                        emulator.write(empty) # Stop the key being pressed
-                except IOError:
-                    sleep(1)
-                else:
-                    return 0
+        held = [] # Key codes held down in the current group
+        group_modifier = None
+
+        for key in keys:
+            hex_key, _modifier = self.key_to_hex(key)
+            modifier = _modifier if _modifier else self.modifier
+
+            if held and (len(held) == self.ROLLOVER_KEYS or
+                         hex_key in held or modifier != group_modifier):
+                self.program.append((self.WRITE,
+                                     bytes(HidWriter.EMPTY_REPORT)))
+                held = []
+
+            held.append(hex_key)
+            group_modifier = modifier
+            usb_message = bytearray(8)
+            usb_message[0] = modifier
+            usb_message[2:2 + len(held)] = bytearray(held)
+            self.program.append((self.WRITE, bytes(usb_message)))
+
+        if held:
+            self.program.append((self.WRITE, bytes(HidWriter.EMPTY_REPORT)))
+        if self.delay_between_keys:
+            self.program.append((self.DELAY, self.delay_between_keys))
+
+    def key_report(self, key):
+        '''
+        Returns the 8 byte HID report which presses the given key.
 
-        # Empty message which will be sent to stop any keys being pressed
-        empty = "\x00\x00\x00\x00\x00\x00\x00\x00"
-        usb_message = bytearray(empty.encode()) # Initialize usb message
+        Args:
+            key: A key to translate, for example: "a", "z", "3", "F2", "ENTER"
+        '''
+        usb_message = bytearray(8) # Initialize usb message with zeroes
         hex_key, _modifier = self.key_to_hex(key) # Translate key to hex code
 
         # Override self.modifier if the key needs a specific one
@@ -306,20 +713,33 @@ class GadgetKeyboard(KeyboardEmulator):
 
         usb_message[2] = hex_key
         usb_message[0] = modifier
+        return bytes(usb_message)
+
+    def send_a_key(self, key, timeout=20):
+        '''
+        HID keyboard message length is 8 bytes and format is:
+
+            [modifier, reserved, Key1, Key2, Key3, Key4, Key6, Key7]
+
+        So first byte is for modifier key and all bytes after third one are for
+        normal keys. After sending a key stroke, empty message with zeroes has
+        to be sent to stop the key being pressed. Messages are sent by writing
+        to the emulated HID usb port in /dev/. US HID keyboard hex codes
+        are used for translating keys.
 
-        # Do the writing in a subprocess as it hangs in some rare cases
-        writer = Process(target=writer, args=(self.emulator, usb_message, empty))
-        writer.start()
-        writer.join(20)
-        if writer.is_alive():
-            writer.terminate()
-            msg = "Keyboard emulator couldn't connect to host or it froze"
-            logger.error(msg, "kb_emulator.log")
-            raise TimeoutError(msg)
+        Args:
+            key: A key to send, for example: "a", "z", "3", "F2", "ENTER"
+            timeout: how long sending a key will be tried until quitting [s]
+        '''
+        usb_message = self.key_report(key)
+        self.writer.write(usb_message, timeout) # Send the key
+        # Stop the key being pressed
+        self.writer.write(HidWriter.EMPTY_REPORT, timeout)
 
         logger.info("Sent key: " + key.ljust(5) + "  hex code: " +
-                    format(hex_key, '#04x') + "  modifier: " +
-                    format(modifier, '#04x'), "kb_emulator.log")
+                    format(bytearray(usb_message)[2], '#04x') +
+                    "  modifier: " + format(bytearray(usb_message)[0], '#04x'),
+                    "kb_emulator.log")
         return 0
 
     def key_to_hex(self, key):
@@ -333,7 +753,7 @@ class GadgetKeyboard(KeyboardEmulator):
         modifier_key = 0 # Initialize modifier_key as 0
 
         # Check if the key is in key_codes
-        if key in list(self.key_codes.keys()):
+        if key in self.key_codes:
             hex_key = self.key_codes[key]
 
             # Check if the key needs SHIFT modifier
@@ -361,6 +781,159 @@ class GadgetKeyboard(KeyboardEmulator):
         return hex_key, modifier_key
 
 
+class HidWriter(object):
+    '''
+    Long-lived writer for the emulated HID keyboard device. The device file is
+    kept open between reports and poll() is used to wait for it to become
+    writable, so a report costs one write() instead of a forked process.
+
+    Writing to the gadget device can hang in some rare cases, for example when
+    the USB host isn't reading the reports, so the device is opened
+    non-blocking and a watchdog timeout is enforced on every report.
+    '''
+
+    # Report which releases all keys
+    EMPTY_REPORT = bytearray(8)
+    _EMPTY_BYTES = bytes(EMPTY_REPORT)
+
+    # errnos after which the device file is reopened, e.g. host disconnected
+    _REOPEN_ERRNOS = (errno.ESHUTDOWN, errno.EPIPE, errno.EIO, errno.ENODEV,
+                      errno.ENXIO, errno.ENOENT, errno.EBADF)
+
+    _REOPEN_DELAY = 1
+
+    def __init__(self, path, max_report_rate=0):
+        '''
+        Args:
+            path: Path to the HID device file, e.g. /dev/hidg0
+            max_report_rate: Maximum number of reports written per second,
+                             0 for no limit
+        '''
+        self.path = path
+        self._fd = None
+        self._poller = None
+        self._min_interval = 1.0 / max_report_rate if max_report_rate else 0
+        self._last_write = 0.0
+        self.last_write_start = 0.0
+        self.reports_written = 0
+        self.keys_pressed = 0
+        self.write_time = 0.0
+        self.max_write_time = 0.0
+        self.start_time = time.time()
+
+    def open(self):
+        '''
+        Open the HID device file if it isn't open already
+        '''
+        if self._fd is not None:
+            return
+        self._fd = os.open(self.path, os.O_WRONLY | os.O_NONBLOCK)
+        self._poller = select.poll()
+        self._poller.register(self._fd, select.POLLOUT)
+
+    def close(self):
+        '''
+        Close the HID device file
+        '''
+        if self._fd is None:
+            return
+        try:
+            os.close(self._fd)
+        except OSError:
+            pass
+        self._fd = None
+        self._poller = None
+
+    def write(self, report, timeout=20):
+        '''
+        Write a single report to the HID device.
+
+        Args:
+            report: 8 byte HID keyboard report as a bytearray
+            timeout: how long writing will be tried until quitting [s]
+
+        Raises:
+            TimeoutError if the report couldn't be written in time
+        '''
+        if self._min_interval:
+            wait = self._last_write + self._min_interval - time.time()
+            if wait > 0:
+                sleep(wait)
+
+        start = time.time()
+        self.last_write_start = start
+        deadline = start + timeout
+        report = bytes(report)
+
+        while True:
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                self.close()
+                msg = "Keyboard emulator couldn't connect to host or it froze"
+                logger.error(msg, "kb_emulator.log")
+                raise TimeoutError(msg)
+
+            try:
+                self.open()
+                if not self._poller.poll(int(remaining * 1000)):
+                    continue
+                written = os.write(self._fd, report)
+            except (OSError, IOError) as err:
+                if err.errno in (errno.EAGAIN, errno.EINTR):
+                    continue
+                if err.errno not in self._REOPEN_ERRNOS:
+                    raise
+                logger.debug("HID write failed: " + str(err) + ", reopening",
+                             "kb_emulator.log")
+                self.close()
+                sleep(min(self._REOPEN_DELAY, max(remaining, 0)))
+                continue
+
+            if written == len(report):
+                break
+
+        self._last_write = time.time()
+        write_time = self._last_write - start
+        self.reports_written += 1
+        # Every report other than the release report presses a new key
+        if report != self._EMPTY_BYTES:
+            self.keys_pressed += 1
+        self.write_time += write_time
+        self.max_write_time = max(self.max_write_time, write_time)
+
+    def reset_statistics(self):
+        '''
+        Reset the key rate metrics
+        '''
+        self.reports_written = 0
+        self.keys_pressed = 0
+        self.write_time = 0.0
+        self.max_write_time = 0.0
+        self.start_time = time.time()
+
+    def log_statistics(self, name):
+        '''
+        Log the key rate metrics since the last reset_statistics() call to
+        kb_emulator.log
+
+        Args:
+            name: Name of the sent keystroke sequence
+        '''
+        duration = time.time() - self.start_time
+        keys = self.keys_pressed
+        reports = max(self.reports_written, 1)
+        logger.info("Sent " + str(keys) + " keys in " +
+                    str(self.reports_written) + " reports from " +
+                    str(name) + " in " +
+                    "{0:.3f}".format(duration) + " s (" +
+                    "{0:.1f}".format(keys / max(duration, 1e-6)) +
+                    " keys/s), average report write " +
+                    "{0:.3f}".format(self.write_time / reports * 1000) +
+                    " ms, maximum " +
+                    "{0:.3f}".format(self.max_write_time * 1000) + " ms",
+                    "kb_emulator.log")
+
+
 class TimeoutError(Exception):
     '''
     Error caused by not connecting to host device
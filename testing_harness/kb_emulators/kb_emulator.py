@@ -28,3 +28,8 @@ class KeyboardEmulator(with_metaclass(abc.ABCMeta, object)):
         """
         Method to send keystrokes
         """
+
+    def close(self):
+        """
+        Method to release any connection held by the emulator
+        """
@@ -13,25 +13,70 @@
 
 from aft.kb_emulators.kb_emulator import KeyboardEmulator
 import aft.errors as errors
+from aft.logger import Logger as logger
 
 class KM232Keyboard(KeyboardEmulator):
     """
     Keyboard emulator class for Hagstrom Electronics USB-KM232 cable
+
+    The opened KBEMUControl connection is kept and reused for as long as the
+    same keystroke file is played and the playback succeeds. It is reopened
+    only for a different file or after a failure. The connection is closed
+    when the device is released.
     """
 
     def __init__(self, config):
         from devauto.kbemu import control as kbemucontrol
         self.kbemucontrol = kbemucontrol
+        self._kbemu = None
+        self._kbemu_file = None
 
     def send_keystrokes(self, _file):
         """
         Method to send keystrokes from a file
         """
+        if self._kbemu is None or self._kbemu_file != _file:
+            # Opening is retried once, as no keys have been sent yet
+            try:
+                self._open(_file)
+            except:
+                logger.warning("Opening KM232 keyboard emulator failed, " +
+                               "retrying")
+                try:
+                    self._open(_file)
+                except:
+                    self.close()
+                    raise errors.AFTDeviceError(
+                        "KM232 Keyboard emulator failed.")
 
+        # The sequence isn't replayed on failure, as part of it may already
+        # have been typed
         try:
-            kbemu = self.kbemucontrol.KBEMUControl(_file, kbemu_model ='usbkm232')
-            kbemu.open()
-            kbemu.perform('seq')
-
+            self._kbemu.perform('seq')
         except:
+            self.close()
             raise errors.AFTDeviceError("KM232 Keyboard emulator failed.")
+
+    def close(self):
+        """
+        Close the keyboard emulator connection
+        """
+        if self._kbemu is not None:
+            close = getattr(self._kbemu, "close", None)
+            if close:
+                try:
+                    close()
+                except:
+                    pass
+        self._kbemu = None
+        self._kbemu_file = None
+
+    def _open(self, _file):
+        """
+        Open a new keyboard emulator connection for the keystroke file
+        """
+        self.close()
+        kbemu = self.kbemucontrol.KBEMUControl(_file, kbemu_model ='usbkm232')
+        kbemu.open()
+        self._kbemu = kbemu
+        self._kbemu_file = _file
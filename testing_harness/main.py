@@ -21,12 +21,14 @@ Main entry point for aft.
 import sys
 import argparse
 import logging
+import datetime
 
 import aft.config as config
 from aft.logger import Logger as logger
 from aft.tools.thread_handler import Thread_handler as thread_handler
 from aft.devicesmanager import DevicesManager
 from aft.tools.misc import local_execute
+import aft.tools.resultcache as resultcache
 
 def main(argv=None):
     """
@@ -57,7 +59,11 @@ def main(argv=None):
                 device.boot_internal_test_mode()
 
             print("Testing " + str(device.name) + ".")
-            tester.execute()
+            result_cache = None
+            if args.reuse_results:
+                result_cache = resultcache.open_cache(
+                    _tested_image(args, device), device.model)
+            tester.execute(result_cache)
 
             if not args.nopoweroff:
                 device.detach()
@@ -72,6 +78,7 @@ def main(argv=None):
             elif args.boot == "service_mode":
                 device.boot_usb_service_mode()
 
+        _log_power_timeline(device)
         device_manager.release(device)
 
         if "backup_argv" in locals():
@@ -93,6 +100,25 @@ def main(argv=None):
         for thread in thread_handler.get_threads():
             thread.join(5)
 
+def _log_power_timeline(device):
+    """
+    Log the power transitions made during the run
+    """
+    transitions = [("on" if power_on else "off") + " at " +
+                   datetime.datetime.fromtimestamp(timestamp).isoformat()
+                   for timestamp, power_on in device.get_power_timeline()]
+    logger.info("Power timeline of " + str(device.name) + ": " +
+                (", ".join(transitions) or "no transitions"))
+
+def _tested_image(args, device):
+    """
+    Returns the image being tested: the given image unless flashing was
+    skipped, in which case the image last flashed to the device, if known
+    """
+    if args.emulateusb or not args.noflash:
+        return args.file_name
+    return resultcache.flashed_image(device.name)
+
 def parse_args():
     """
     Argument parsing
@@ -159,6 +185,14 @@ def parse_args():
         choices=["test_mode", "service_mode"],
         help="Boot device to specific mode")
 
+    parser.add_argument(
+        "--reuse-results",
+        action="store_true",
+        default=False,
+        help="Don't run test cases that already passed on the same image, " +
+             "device model and test case definition, report the cached " +
+             "results instead")
+
     parser.add_argument(
         "--catalog",
         action="store",
@@ -16,8 +16,11 @@
 Class representing a Test Case.
 """
 
+import os
+import re
 import datetime
 import abc
+from xml.sax.saxutils import escape, quoteattr
 from six import with_metaclass
 
 from aft.logger import Logger as logger
@@ -25,7 +28,13 @@ from aft.logger import Logger as logger
 class TestCase(with_metaclass(abc.ABCMeta, object)):
     """
     Class providing the foundations for a Test Case.
+
+    Attributes:
+        _MAX_XUNIT_OUTPUT (integer):
+            Longer test output is written to an attachment file and only its
+            end is included in the results [characters]
     """
+    _MAX_XUNIT_OUTPUT = 65536
     def __init__(self, config):
         self.name = config["name"]
         self.test_case = config["test_case"]
@@ -34,7 +43,18 @@ class TestCase(with_metaclass(abc.ABCMeta, object)):
         # if test was succesful or False if test failed
         self.result = None
         self.duration = None
+        self.start_time = None
+        self.end_time = None
         self.xunit_section = ""
+        # Set when the test case is aborted, e.g. on a kernel panic
+        self.abort_reason = None
+        self.abort_context = []
+        # Set when the test case raised an error
+        self.error = None
+        # Serial output attached to the results
+        self.annotations = []
+        # Set when a cached result of an earlier run is reported
+        self.cached = False
 
     @abc.abstractmethod
     def run(self, device):
@@ -43,6 +63,49 @@ class TestCase(with_metaclass(abc.ABCMeta, object)):
         Returns True if test case was succesful, False otherwise.
         """
 
+    def abort(self, reason, context=None):
+        """
+        Abort the running test case and mark it failed. Called from other
+        threads, e.g. by serial triggers.
+
+        Args:
+            reason (str): Failure message
+            context (list(str)): Output lines explaining the failure
+        """
+        if self.abort_reason is not None:
+            return
+        logger.error("Aborting test case " + self.name + ": " + reason)
+        self.abort_context = context or []
+        self.abort_reason = reason
+        self._abort()
+
+    def _abort(self):
+        """
+        Stop the running test. Test cases that can be interrupted overload
+        this, the others run to completion and are marked failed afterwards.
+        """
+        pass
+
+    def annotate(self, message, context=None):
+        """
+        Attach output lines to the test results
+        """
+        self.annotations.append((message, context or []))
+
+    def reuse_result(self, xunit_section):
+        """
+        Report the passed result of an earlier run instead of running the
+        test case. The result is marked cached in the results.
+
+        Args:
+            xunit_section (str): The testcase element of the earlier run
+        """
+        logger.info("Reusing the cached result of test case " + self.name)
+        self.result = True
+        self.cached = True
+        self.xunit_section = xunit_section.replace("<testcase ",
+                                                   '<testcase cached="1" ', 1)
+
     def _prepare(self):
         """
         Preliminary setup, performed before test case execution.
@@ -56,28 +119,124 @@ class TestCase(with_metaclass(abc.ABCMeta, object)):
         Can be overloaded by subclasses reporting more information.
         """
         xml = []
-        xml.append('<testcase name="{0}" '
-                   'passed="{1}" '
-                   'duration="{2}">'.
-                   format(self.name,
-                          '1' if self.result else '0',
-                          self.duration))
+        xml.append(self._xunit_testcase_tag())
 
         if not self.result:
             logger.info("Failed test case " + self.name + ".")
+        xml.append(self._xunit_failure_and_annotations())
         xml.append('</testcase>\n')
         self.xunit_section = "".join(xml)
 
+    def _xunit_testcase_tag(self):
+        """
+        Returns the opening testcase element with the result, duration and
+        start and end times of the test case
+        """
+        return ('<testcase name="{0}" '
+                'passed="{1}" '
+                'duration="{2}" '
+                'start="{3}" '
+                'end="{4}">'.
+                format(self.name,
+                       '1' if self.result else '0',
+                       self.duration,
+                       self.start_time.isoformat() if self.start_time else "",
+                       self.end_time.isoformat() if self.end_time else ""))
+
+    def _xunit_failure_and_annotations(self):
+        """
+        Returns the failure element of an aborted test case and the
+        annotations as a system-err element
+        """
+        xml = []
+        if self.error is not None:
+            xml.append('\n<error message={0}/>'.format(
+                quoteattr(_xml_text(self.error))))
+        if self.abort_reason is not None:
+            xml.append('\n<failure message={0}>{1}</failure>'.format(
+                quoteattr(_xml_text(self.abort_reason)),
+                escape(_xml_text("\n".join(self.abort_context)))))
+        if self.annotations:
+            text = "\n\n".join(message + "\n" + "\n".join(context)
+                               for message, context in self.annotations)
+            xml.append('\n<system-err>{0}</system-err>'.format(
+                escape(_xml_text(text))))
+        return "".join(xml)
+
+    def _xunit_system_out(self, output, output_size=None):
+        """
+        Returns output as a system-out element. Output longer than
+        _MAX_XUNIT_OUTPUT is written to an attachment file next to the results
+        and only its end is included.
+
+        Args:
+            output (str): The output
+            output_size (integer): Size of the whole output, if output is only
+                                   its end and the whole output has already
+                                   been written to the attachment file
+        """
+        output = output or ""
+        if output_size is None:
+            output_size = len(output)
+            if output_size > self._MAX_XUNIT_OUTPUT:
+                with open(self.get_attachment_location(), "w") as attachment:
+                    attachment.write(output)
+        if output_size > self._MAX_XUNIT_OUTPUT:
+            output = ("[Showing the last " + str(self._MAX_XUNIT_OUTPUT) +
+                      " characters, the whole output is in " +
+                      os.path.basename(self.get_attachment_location()) +
+                      "]\n" + output[-self._MAX_XUNIT_OUTPUT:])
+        # "]]>" would end the CDATA section
+        output = _xml_text(output).replace("]]>", "]]]]><![CDATA[>")
+        return '\n<system-out><![CDATA[{0}]]></system-out>'.format(output)
+
+    def get_attachment_location(self):
+        """
+        Returns the path of the file the whole output of the test case is
+        written to if it is too long for the results
+        """
+        return os.path.join(os.getcwd(), "results_" +
+                            re.sub(r"[^\w.-]", "_", self.name) + ".log")
+
     def execute(self, device):
         """
         Prepare and executes the test case, storing the results.
         """
         start_time = datetime.datetime.now()
+        self.start_time = start_time
         logger.info("Test case start time: " + str(start_time))
         self._prepare()
         # Test cases are run using the Visitor pattern to allow last-minute
         # preparation of the device for the test.
-        self.result = device.test(self)
-        self.duration = datetime.datetime.now() - start_time
+        try:
+            self.result = device.test(self)
+        except Exception as err:
+            # An aborted test may fail in any way, the abort reason is
+            # reported instead
+            if self.abort_reason is None:
+                self.error = type(err).__name__ + ": " + str(err)
+                self.result = False
+                self._finish(start_time)
+                raise
+            logger.info("Aborted test case raised: " + str(err))
+        if self.abort_reason is not None:
+            self.result = False
+        self._finish(start_time)
+
+    def _finish(self, start_time):
+        """
+        Store the end time and duration, and build the results
+        """
+        self.end_time = datetime.datetime.now()
+        self.duration = self.end_time - start_time
         logger.info("Test Duration: " + str(self.duration))
         self._build_xunit_section()
+
+# Characters not allowed in XML, serial output is full of them
+_XML_INVALID = re.compile(u"[\x00-\x08\x0b\x0c\x0e-\x1f]")
+
+def _xml_text(text):
+    """
+    Remove characters not allowed in XML from text
+    """
+    return _XML_INVALID.sub("", text)
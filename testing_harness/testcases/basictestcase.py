@@ -22,16 +22,31 @@ import re
 
 from aft.logger import Logger as logger
 from aft.testcase import TestCase
+from aft.tools.outputcapture import OutputCapture
 import aft.errors as errors
 
 class BasicTestCase(TestCase):
     """
     Simple Test Case executor.
+
+    Attributes:
+        _COUNTED (list(str)):
+            Strings counted in the output of local commands, see
+            output_counts
+        _READ_SIZE (integer):
+            Maximum number of characters read from a local command at a time
     """
+    _COUNTED = ()
+    _READ_SIZE = 65536
 
     def __init__(self, config):
         super(BasicTestCase, self).__init__(config)
         self.output = None
+        # Number of characters the local command wrote, when only the end of
+        # its output is kept in self.output
+        self.output_size = None
+        self.output_counts = {}
+        self._process = None
         self.parameters = config["parameters"]
         self.pass_regex = config["pass_regex"]
 
@@ -41,21 +56,60 @@ class BasicTestCase(TestCase):
     def run_local_command(self, timeout=1800):
         """
         Executes a command locally, on the test harness.
+
+        The output is streamed to get_attachment_location() while the _COUNTED
+        strings are counted in it to output_counts. Only the end of the output
+        is kept in self.output, so verbose commands don't use up the memory.
         """
         command = "timeout " + str(timeout) + " " + self.parameters
-        process = subprocess32.Popen(command.split(),
-                                     universal_newlines=True,
-                                     stderr=subprocess32.STDOUT,
-                                     stdout=subprocess32.PIPE)
-        self.output = process.communicate()[0]
+        capture = OutputCapture(self.get_attachment_location(), self._COUNTED,
+                                self._MAX_XUNIT_OUTPUT)
+        try:
+            process = subprocess32.Popen(command.split(),
+                                         universal_newlines=True,
+                                         stderr=subprocess32.STDOUT,
+                                         stdout=subprocess32.PIPE)
+            self._process = process
+            # The test case may have been aborted while starting the process
+            if self.abort_reason is not None:
+                self._abort()
+            try:
+                for text in iter(lambda: process.stdout.readline(
+                        self._READ_SIZE), ""):
+                    capture.write(text)
+                process.stdout.close()
+                process.wait()
+            finally:
+                self._process = None
+        finally:
+            capture.close()
+        self.output = capture.tail()
+        self.output_size = capture.size
+        self.output_counts = capture.counts
         logger.debug("Output return code in basictestcase.run_local_command():" + str(process.returncode))
-        logger.debug("And output: " + self.output)
+        logger.debug("Output (" + str(capture.size) + " characters) saved to " +
+                     capture.path)
+
 
+        if self.abort_reason is not None:
+            return False
 
         if process.returncode == 124 or process.returncode == 128 + 9:
             raise errors.AFTTimeoutError("Test cases failed to complete in " + str(timeout) + " seconds")
         return True
 
+    def _abort(self):
+        """
+        Terminate the running local command. timeout passes the signal on to
+        the command.
+        """
+        process = self._process
+        if process is not None and process.poll() is None:
+            try:
+                process.terminate()
+            except OSError:
+                pass
+
     def run_remote_command(self, device):
         """
         Executes a command remotely, on the device.
@@ -15,7 +15,6 @@
 """
 QA Test Case class.
 """
-import re
 
 from aft.logger import Logger as logger
 from aft.testcases.basictestcase import BasicTestCase
@@ -24,6 +23,7 @@ class QATestCase(BasicTestCase):
     """
     QA testcase executor.
     """
+    _COUNTED = ("FAILED",)
 
     def run(self, device):
         # Append --target-ip parameter
@@ -37,27 +37,19 @@ class QATestCase(BasicTestCase):
         """
         Test if there are FAILED test cases in the QA-test case output
         """
-        logger.info(self.output)
-        failed_matches = re.findall("FAILED", self.output)
-        result = True
-        if len(failed_matches) > 0:
-            result = False
-        return result
+        logger.info("Found " + str(self.output_counts["FAILED"]) +
+                    " FAILED in the output of " + self.name + ", see " +
+                    self.get_attachment_location())
+        return self.output_counts["FAILED"] == 0
 
     def _build_xunit_section(self):
         """
         Generates the section of report specific to a QA testcase.
         """
         xml = []
-        xml.append('<testcase name="{0}" '
-                   'passed="{1}" '
-                   'duration="{2}">'.
-                   format(self.name,
-                          '1' if self.result else '0',
-                          self.duration))
-
-        xml.append('\n<system-out>')
-        xml.append('<![CDATA[{0}]]>'.format(self.output))
-        xml.append('</system-out>')
+        xml.append(self._xunit_testcase_tag())
+
+        xml.append(self._xunit_system_out(self.output, self.output_size))
+        xml.append(self._xunit_failure_and_annotations())
         xml.append('</testcase>\n')
         self.xunit_section = "".join(xml)
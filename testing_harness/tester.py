@@ -17,19 +17,43 @@ Class implementing a Tester interface.
 """
 
 import os
+import sys
 import time
+import threading
 try:
     import ConfigParser
 except ImportError:
     import configparser as ConfigParser
 
+from six import reraise
+
+import aft.config as config
 from aft.logger import Logger as logger
 import aft.errors as errors
 import aft.testcasefactory
+from aft.tools.serialtriggers import SerialMonitor, DEFAULT_TRIGGERS, \
+    ABORT, ANNOTATE, OFF, trigger_actions
+from aft.tools.xunitwriter import XunitWriter
+
+# Resource of test cases using the whole device exclusively
+_ALL_RESOURCES = "*"
+# Returned by Tester._wait_for_work when the device has to be recovered
+_RECOVER = "recover"
 
 class Tester(object):
     """
     Class representing a Tester interface.
+
+    Test cases are run concurrently, up to config.MAX_PARALLEL_TEST_CASES at
+    a time, when their test plan sections allow it:
+        exclusive = <resources>: Resources the test case uses alone, e.g.
+                                 dut-reboot. * means the whole device.
+        group = <resources>: Resources the test case shares with the other
+                             test cases of the group, e.g. network.
+
+    Test cases without either setting use the whole device. Test cases using
+    the same resource, at least one of them exclusively, are run one at a
+    time in test plan order.
     """
 
     def __init__(self, device):
@@ -38,6 +62,15 @@ class Tester(object):
         self._results = []
         self._start_time = None
         self._end_time = None
+        # The test cases being executed, aborted by serial triggers
+        self._running = []
+        self._condition = threading.Condition()
+        # sys.exc_info() of the first test case that raised
+        self._failure = None
+        self._needs_recovery = False
+        self._monitor = None
+        self._writer = None
+        self._result_cache = None
 
         test_plan_name = device.test_plan
         test_plan_file = os.path.join("/etc/aft/test_plan/", device.test_plan + ".cfg")
@@ -55,62 +88,257 @@ class Tester(object):
             test_case = aft.testcasefactory.build_test_case(test_case_config)
             self.test_cases.append(test_case)
 
+        # Actions of the built-in serial triggers, by test case name
+        actions = trigger_actions(config.SERIAL_TRIGGERS)
+        self._trigger_actions = dict(
+            (test_case.name, trigger_actions(
+                test_case.config.get("serial_triggers", ""), actions))
+            for test_case in self.test_cases)
+        self._default_trigger_actions = actions
+
         logger.info("Built test plan with " + str(len(self.test_cases)) + " test cases.")
 
 
-    def execute(self):
+    def execute(self, result_cache=None):
         """
-        Execute the test plan.
+        Execute the test plan. The results of each test case are saved as
+        soon as it has finished, so the results file is usable even if the
+        test plan is interrupted.
+
+        Args:
+            result_cache (aft.tools.resultcache.ResultCache):
+                Cache of passed results of the tested image. Test cases with
+                a cached result aren't run, and new passed results are
+                cached.
         """
+        self._result_cache = result_cache
         logger.info("Executing the test plan")
         self._start_time = time.time()
         logger.info("Test plan start time: " + str(self._start_time))
 
-        for index, test_case in enumerate(self.test_cases, 1):
-            logger.info("Executing test case " + str(index) + " of " + str(self.test_cases))
-            test_case.execute(self._device)
-            self._results.append(test_case.result)
+        results_filename = self.get_results_location()
+        self._writer = XunitWriter(
+            results_filename,
+            "aft.{0}.{1}".format(time.strftime("%Y%m%d%H%M%S",
+                                               time.localtime(self._start_time)),
+                                 os.getpid()),
+            self._start_time)
+        self._start_serial_monitor()
+        try:
+            self._run_test_cases()
+        finally:
+            if self._monitor:
+                self._monitor.stop()
+            self._end_time = time.time()
+            self._writer.close(self._end_time)
+            logger.info("Results saved to " + str(results_filename) + ".")
+        self._results = [test_case.result for test_case in self.test_cases]
 
-        self._end_time = time.time()
         logger.info("Test plan end time: " + str(self._end_time))
-        self._save_test_results()
-
-    def _results_to_xunit(self):
-        """
-        Return test results formatted in xunit XML
-        """
-        xml = [('<?xml version="1.0" encoding="utf-8"?>\n'
-                '<testsuite errors="0" failures="{0}" '
-                .format(len([test_case for test_case in self.test_cases
-                             if not test_case.result])) +
-                'name="aft.{0}.{1}" skips="0" '
-                .format(time.strftime("%Y%m%d%H%M%S",
-                                      time.localtime(self._start_time)),
-                        os.getpid()) +
-                'tests="{0}" time="{1}">\n'
-                .format(len(self._results),
-                        self._end_time - self._start_time))]
-        for test_case in self.test_cases:
-            xml.append(test_case.xunit_section)
-        xml.append('</testsuite>\n')
-        return "".join(xml)
 
-    def get_results_location(self):
+    def _run_test_cases(self):
         """
-        Returns the file path of the results xml-file.
+        Run the test cases in threads as their resources allow. If a test case
+        raises, the running ones are finished and the exception is re-raised.
         """
-        return os.path.join(os.getcwd(), "results.xml")
+        limit = max(1, int(config.MAX_PARALLEL_TEST_CASES))
+        waiting = [test_case for test_case in self.test_cases
+                   if not self._reuse_result(test_case)]
+        threads = []
+        while True:
+            work = self._wait_for_work(waiting, limit)
+            if work is None:
+                break
+            if work == _RECOVER:
+                self._recover_device()
+                continue
+
+            logger.info("Executing test case " +
+                        str(self.test_cases.index(work) + 1) + " of " +
+                        str(len(self.test_cases)) + ": " + work.name)
+            thread = threading.Thread(target=self._execute_test_case,
+                                      args=(work,),
+                                      name=str(os.getpid()) + work.name)
+            # Don't keep aft running on keyboard interrupt
+            thread.daemon = True
+            thread.start()
+            threads.append(thread)
+
+        for thread in threads:
+            thread.join()
+        if self._failure is not None:
+            reraise(*self._failure)
 
-    def _save_test_results(self):
+    def _reuse_result(self, test_case):
         """
-        Store the test results.
+        Report the cached result of a test case, if there is one
+
+        Returns:
+            True if the cached result was reported
         """
-        logger.info("Storing the test results.")
-        xunit_results = self._results_to_xunit()
-        results_filename = self.get_results_location()
-        with open(results_filename, "w") as results_file:
-            results_file.write(xunit_results)
-        logger.info("Results saved to " + str(results_filename) + ".")
+        if self._result_cache is None:
+            return False
+        xunit_section = self._result_cache.get(test_case)
+        if xunit_section is None:
+            return False
+        test_case.reuse_result(xunit_section)
+        with self._condition:
+            self._writer.add(self.test_cases.index(test_case),
+                             test_case.xunit_section, test_case.result)
+        return True
+
+    def _wait_for_work(self, waiting, limit):
+        """
+        Wait until a waiting test case can be started or the device has to be
+        recovered. Recovery waits for the running test cases to finish.
+
+        Args:
+            waiting (list): Test cases not started yet. The returned test
+                            case is removed from the list.
+            limit (integer): Maximum number of test cases running at a time
+
+        Returns:
+            The test case to start, _RECOVER, or None when all test cases
+            have finished
+        """
+        with self._condition:
+            while True:
+                if self._failure is not None:
+                    del waiting[:]
+                if not self._running and not waiting:
+                    return None
+                if self._needs_recovery:
+                    if not self._running:
+                        return _RECOVER
+                elif len(self._running) < limit:
+                    test_case = self._next_test_case(waiting)
+                    if test_case is not None:
+                        waiting.remove(test_case)
+                        self._running.append(test_case)
+                        return test_case
+                # Time out to stay responsive to keyboard interrupts
+                self._condition.wait(1)
+
+    def _next_test_case(self, waiting):
+        """
+        Returns the first waiting test case that doesn't conflict with the
+        running ones, or with the test cases before it in the test plan
+        """
+        for position, test_case in enumerate(waiting):
+            if not any(_conflicts(test_case, other) for other in
+                       self._running + waiting[:position]):
+                return test_case
+        return None
+
+    def _execute_test_case(self, test_case):
+        """
+        Execute a test case with its own serial triggers
+        """
+        triggers = []
+        if self._monitor and "serial_abort_regex" in test_case.config:
+            triggers.append(self._monitor.add_trigger(
+                test_case.config["serial_abort_regex"],
+                lambda match: self._abort_test_cases(match, [test_case]),
+                name="serial_abort_regex of " + test_case.name))
+
+        try:
+            test_case.execute(self._device)
+            if self._result_cache is not None:
+                self._result_cache.put(test_case)
+        except:
+            logger.error("Test case " + test_case.name + " raised: " +
+                         str(sys.exc_info()[1]))
+            with self._condition:
+                if self._failure is None:
+                    self._failure = sys.exc_info()
+        finally:
+            for trigger in triggers:
+                self._monitor.remove_trigger(trigger)
+            with self._condition:
+                self._running.remove(test_case)
+                if test_case.xunit_section:
+                    self._writer.add(self.test_cases.index(test_case),
+                                     test_case.xunit_section,
+                                     test_case.result)
+                self._condition.notify_all()
+
+    def _start_serial_monitor(self):
+        """
+        Start matching the built-in serial triggers, if the serial output of
+        the device is being recorded
+        """
+        port = self._device.parameters.get("serial_port")
+        if not port:
+            return
+        monitor = SerialMonitor(port)
+        if not monitor.start():
+            logger.info("Serial output of " + str(port) + " isn't recorded, " +
+                        "serial triggers disabled.")
+            return
+        for name, pattern, _ in DEFAULT_TRIGGERS:
+            if all(actions[name] == OFF for actions in
+                   [self._default_trigger_actions] +
+                   list(self._trigger_actions.values())):
+                continue
+            monitor.add_trigger(pattern, self._built_in_trigger, name=name)
+        self._monitor = monitor
+
+    def _built_in_trigger(self, match):
+        """
+        Built-in serial trigger callback aborting or annotating each running
+        test case as its serial_triggers setting says
+        """
+        name = match.trigger.name
+        with self._condition:
+            running = list(self._running)
+        if not running:
+            if self._default_trigger_actions[name] == ABORT:
+                self._abort_test_cases(match)
+            return
+
+        aborted = []
+        for test_case in running:
+            action = self._trigger_actions[test_case.name][name]
+            if action == ABORT:
+                aborted.append(test_case)
+            elif action == ANNOTATE:
+                test_case.annotate(str(match), match.context)
+        if aborted:
+            self._abort_test_cases(match, aborted)
+
+    def _abort_test_cases(self, match, test_cases=None):
+        """
+        Serial trigger callback aborting test cases, on default all running
+        ones. The device is recovered before the next test case is started.
+        """
+        with self._condition:
+            self._needs_recovery = True
+            if test_cases is None:
+                test_cases = list(self._running)
+        if not test_cases:
+            logger.warning(str(match) + ", no test case running.")
+        for test_case in test_cases:
+            test_case.abort(str(match), match.context)
+
+    def _recover_device(self):
+        """
+        Recover the device after a serial trigger aborted a test. If recovery
+        fails, the remaining test cases are run anyway and fail on their own.
+        """
+        with self._condition:
+            self._needs_recovery = False
+        try:
+            self._device.recover()
+        except KeyboardInterrupt:
+            raise
+        except Exception as err:
+            logger.error("Recovering the device failed: " + str(err))
+
+    def get_results_location(self):
+        """
+        Returns the file path of the results xml-file.
+        """
+        return os.path.join(os.getcwd(), "results.xml")
 
     def get_results(self):
         return self._results
@@ -120,3 +348,28 @@ class Tester(object):
         for test_case in self.test_cases:
             arr.append(test_case.xunit_section)
         return "".join(arr)
+
+
+def _resources(test_case):
+    """
+    Returns the exclusive and shared resources of a test case as sets
+    """
+    exclusive = set(_split(test_case.config.get("exclusive", "")))
+    shared = set(_split(test_case.config.get("group", "")))
+    if not exclusive and not shared:
+        exclusive.add(_ALL_RESOURCES)
+    return exclusive, shared
+
+def _split(value):
+    return [item.strip() for item in value.split(",") if item.strip()]
+
+def _conflicts(first, second):
+    """
+    Returns True if two test cases can't run at the same time
+    """
+    first_exclusive, first_shared = _resources(first)
+    second_exclusive, second_shared = _resources(second)
+    if _ALL_RESOURCES in first_exclusive or _ALL_RESOURCES in second_exclusive:
+        return True
+    return bool(first_exclusive & (second_exclusive | second_shared) or
+                second_exclusive & first_shared)
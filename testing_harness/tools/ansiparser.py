@@ -13,7 +13,8 @@
 
 """
 Parser for a minimal subset of ansi control codes.
-Used to parse the files created by serial recorder
+Used by the serial recorder to parse the output while it is being recorded,
+parse_file() parses a recorded file afterwards.
 """
 # Note: Galileo in general seems to love to absolutely mangle the control codes
 # to the point where even bash has trouble parsing them correctly. The approach
@@ -23,8 +24,35 @@ Used to parse the files created by serial recorder
 
 from __future__ import print_function
 import os
+import re
 import sys
 
+_READ_SIZE = 65536
+
+# Characters ending a control code: letters, as str.isalpha() sees the
+# ISO-8859-1 decoded input, and '['
+_CODE_ENDS = "".join("\\x{0:02x}".format(char) for char in range(256)
+                     if chr(char).isalpha() or chr(char) == "[")
+_TOKEN = re.compile((
+    "([^\\n\\x1b]+)|" # text
+    "(\\n+)|" # newlines
+    "\\x1b\\[([^" + _CODE_ENDS + "]*)([" + _CODE_ENDS + "])|" # control code
+    "(\\x1b)(?=[^\\[])" # <ESC> without '[' is ignored
+    ).encode("ascii"))
+_TEXT = 1
+_NEWLINES = 2
+_CODE = 3
+_CODE_END = 4
+
+_NULL_TO_SPACE = bytes(bytearray([ord(" ")] + list(range(1, 256))))
+
+if sys.version_info[0] == 2:
+    def _decode(data):
+        return bytes(data)
+else:
+    def _decode(data):
+        return bytes(data).decode("ISO-8859-1")
+
 class Token(object):
     """Class that stores the constants for code tokens"""
     CLEAR_SCREEN = 1
@@ -72,170 +100,262 @@ def do_parse(input_file, output_file):
 
     Note: input_file and output_file must not be the same file
     """
-    # width\height arbitrarily set to be large enough so it works
-    # (no out of bounds array accesses)
-    width = 300
-    height = 32
-
-    # current row\column position; defines where next characters will be written
-    row = 0
-    column = 0
-
-    # avoids printing extra empty lines
-    last_row_with_characters = 0
-
-    screen_buffer = create_screen_buffer(height, width)
+    parser = StreamParser(output_file)
+    while True:
+        data = input_file.read(_READ_SIZE)
+        if not data:
+            break
+        parser.feed(data)
+    parser.finish()
 
-    escape_char_code = 27
+class StreamParser(object):
+    """
+    Incremental parser. Feed it the recorded bytes as they arrive and it
+    writes the parsed text to the output file whenever a screen is complete,
+    as do_parse() would for the whole file.
 
-    # use for heuristic write & clear screen
-    control_codes_after_top_left_move = False
+    Input is split to tokens with a regular expression, so runs of plain text
+    are copied to the screen at once. The screen is a bytearray per row, with
+    a high-water mark of the columns written to each row.
 
-    while True:
-        char = input_file.read(1)
-        if sys.version_info[0] == 3:
-            char = char.decode("ISO-8859-1")
-        if not char:
-            break
-        elif char == '\n':
-            row += 1
-            last_row_with_characters += max(last_row_with_characters, row)
-            column = 0
-        elif ord(char) == escape_char_code:
-            ret = parse_token(input_file)
-            if ret != None:
-                if ret[0] == Token.CLEAR_SCREEN:
-                    control_codes_after_top_left_move = True
-                    write_and_clear_buffer(
-                        output_file,
-                        screen_buffer,
-                        min(height, last_row_with_characters+1),
-                        width)
-
-                    column = 0
-                    row = 0
-                    last_row_with_characters = 0
-                elif ret[0] == Token.MOVE_CURSOR:
-
-                    if ret[1] == 0 and ret[2] == 0:
-                        control_codes_after_top_left_move = False
-                    else:
-                        control_codes_after_top_left_move = True
-
-                    # we just ignore the move token if it is out of
-                    # bounds
-                    if ret[1] < height and ret[2] < width:
-                        row = ret[1]
-                        column = ret[2]
-                        last_row_with_characters += max(
-                            last_row_with_characters,
-                            row)
-                elif ret[0] == Token.RESET_COLOR:
-                    # We enter the world of messy heuristic here. Sometimes
-                    # parser ended up writing bios screens and whatnot on top
-                    # of real, relevant log messages. These scenarios were
-                    # typically preceded by MOVE<1, 1>, followed by
-                    # log messages, followed by reset color code. So we use
-                    # this as heuristic to print & clear screen, just in case
-
-                    if not control_codes_after_top_left_move:
-                        control_codes_after_top_left_move = True
-                        write_and_clear_buffer(
-                        output_file,
-                        screen_buffer,
-                        min(height, last_row_with_characters+1),
-                        width)
-
-        else:
-            screen_buffer[row][column] = char
-            column += 1
-
-        if column == width:
-            column = 0
-            row += 1
-            last_row_with_characters = max(row, last_row_with_characters)
-
-        if row == height:
-            write_and_clear_buffer(
-                output_file,
-                screen_buffer,
-                height,
-                width)
-
-            row = 0
-            last_row_with_characters = 0
-
-    # write any remaining characters in the buffer
-    write_and_clear_buffer(
-        output_file,
-        screen_buffer,
-        min(height, last_row_with_characters+1),
-        width)
-
-def create_screen_buffer(height, width):
-    """Initialize and return screen buffer"""
-    return [['\0' for _ in range(width)] for _ in range(height)]
-
-def parse_token(input_file):
+    Attributes:
+        WIDTH (integer): Screen buffer width
+        HEIGHT (integer): Screen buffer height
+    """
+    # width\height arbitrarily set to be large enough so it works
+    # (no out of bounds array accesses)
+    WIDTH = 300
+    HEIGHT = 32
+
+    _MAX_CODES = 4096
+    _UNPARSED = object()
+
+    def __init__(self, output_file):
+        self.output_file = output_file
+
+        # current row\column position; defines where next characters will be
+        # written
+        self.row = 0
+        self.column = 0
+
+        # avoids printing extra empty lines
+        self.last_row_with_characters = 0
+
+        # Empty screen positions are null bytes
+        self.screen_buffer = [bytearray(self.WIDTH)
+                              for _ in range(self.HEIGHT)]
+        self.row_lengths = [0] * self.HEIGHT
+        self._empty_row = bytes(bytearray(self.WIDTH))
+
+        # use for heuristic write & clear screen
+        self.control_codes_after_top_left_move = False
+
+        # Unfinished control code at the end of the previous chunk
+        self._pending = b""
+        # Parsed tokens of the control codes seen so far
+        self._codes = {}
+
+    def feed(self, data):
+        """
+        Parse the next chunk of the input
+
+        Args:
+            data (bytes): The input bytes
+        """
+        if isinstance(data, memoryview):
+            data = data.tobytes()
+        if self._pending:
+            data = self._pending + bytes(data)
+            self._pending = b""
+        view = memoryview(data)
+        codes = self._codes
+        position = 0
+
+        for match in _TOKEN.finditer(data):
+            start, end = match.span()
+            if start != position:
+                # Tokens match everything but a control code which continues
+                # in the next chunk
+                break
+            position = end
+
+            kind = match.lastindex
+            if kind == _TEXT:
+                self._write_text(view, start, end)
+            elif kind == _NEWLINES:
+                for _ in range(end - start):
+                    self._newline()
+            elif kind == _CODE_END:
+                code = match.group(_CODE, _CODE_END)
+                token = codes.get(code, self._UNPARSED)
+                if token is self._UNPARSED:
+                    token = parse_code(_decode(code[0]), _decode(code[1]))
+                    if len(codes) < self._MAX_CODES:
+                        codes[code] = token
+                if token is not None:
+                    self._execute(token)
+            # else: <ESC> not followed by '[', the next character is text
+
+        if position != len(data):
+            self._pending = view[position:].tobytes()
+
+    def flush(self):
+        """
+        Flush the output file. Text still in the screen buffer isn't written.
+        """
+        self.output_file.flush()
+
+    def finish(self):
+        """
+        Write any remaining characters in the buffer. An unfinished control
+        code at the end of the input is ignored.
+        """
+        self._pending = b""
+        self._write_and_clear_buffer(
+            min(self.HEIGHT, self.last_row_with_characters+1))
+        self.row = 0
+        self.column = 0
+        self.last_row_with_characters = 0
+        self.output_file.flush()
+
+    def _write_text(self, view, start, end):
+        """
+        Write characters view[start:end] to the screen
+        """
+        if self.column < 0:
+            # Cursor moved to column 0, which indexes the last column
+            self.screen_buffer[self.row][self.column:] = view[start:start + 1]
+            self.row_lengths[self.row] = self.WIDTH
+            self.column += 1
+            start += 1
+
+        while start < end:
+            count = min(end - start, self.WIDTH - self.column)
+            row = self.row
+            self.screen_buffer[row][self.column:self.column + count] = \
+                view[start:start + count]
+            self.column += count
+            start += count
+            if self.column > self.row_lengths[row]:
+                self.row_lengths[row] = self.column
+
+            if self.column == self.WIDTH:
+                self.column = 0
+                self.row += 1
+                self.last_row_with_characters = max(
+                    self.row, self.last_row_with_characters)
+                self._check_screen_full()
+
+    def _newline(self):
+        self.row += 1
+        self.last_row_with_characters += max(
+            self.last_row_with_characters, self.row)
+        self.column = 0
+        self._check_screen_full()
+
+    def _check_screen_full(self):
+        if self.row == self.HEIGHT:
+            self._write_and_clear_buffer(self.HEIGHT)
+
+            self.row = 0
+            self.last_row_with_characters = 0
+
+    def _write_and_clear_buffer(self, last_row):
+        """
+        Prints and clears the first last_row rows of the buffer. Trailing
+        empty positions are not printed and other empty positions are printed
+        as spaces.
+        """
+        lines = []
+        for row in range(last_row):
+            length = self.row_lengths[row]
+            line = self.screen_buffer[row][:length].rstrip(b"\0")
+            lines.append(_decode(line.translate(_NULL_TO_SPACE)))
+            if length:
+                self.screen_buffer[row][:length] = self._empty_row[:length]
+                self.row_lengths[row] = 0
+        if lines:
+            self.output_file.write("\n".join(lines) + "\n")
+
+    def _execute(self, ret):
+        """
+        Execute a parsed control code token
+        """
+        if ret == None:
+            return
+
+        if ret[0] == Token.CLEAR_SCREEN:
+            self.control_codes_after_top_left_move = True
+            self._write_and_clear_buffer(
+                min(self.HEIGHT, self.last_row_with_characters+1))
+
+            self.column = 0
+            self.row = 0
+            self.last_row_with_characters = 0
+        elif ret[0] == Token.MOVE_CURSOR:
+
+            if ret[1] == 0 and ret[2] == 0:
+                self.control_codes_after_top_left_move = False
+            else:
+                self.control_codes_after_top_left_move = True
+
+            # we just ignore the move token if it is out of
+            # bounds
+            if ret[1] < self.HEIGHT and ret[2] < self.WIDTH:
+                self.row = ret[1]
+                self.column = ret[2]
+                self.last_row_with_characters += max(
+                    self.last_row_with_characters,
+                    self.row)
+        elif ret[0] == Token.RESET_COLOR:
+            # We enter the world of messy heuristic here. Sometimes
+            # parser ended up writing bios screens and whatnot on top
+            # of real, relevant log messages. These scenarios were
+            # typically preceded by MOVE<1, 1>, followed by
+            # log messages, followed by reset color code. So we use
+            # this as heuristic to print & clear screen, just in case
+
+            if not self.control_codes_after_top_left_move:
+                self.control_codes_after_top_left_move = True
+                self._write_and_clear_buffer(
+                    min(self.HEIGHT, self.last_row_with_characters+1))
+
+def parse_code(code, char):
     """
     Parse ansi control token
 
     Args:
-        file: file handle for the file we are parsing
+        code: Characters between '<ESC>[' and the final character
+        char: The final character, an upper or lower case letter or '['
     Returns:
         None, if no valid or supported ansi control token was found
         Array containing code specific data, if code was found
     """
-    # note - we really would like to use peek() here, but python standard
-    # file api does not provide such function
-    char = input_file.read(1)
-    if sys.version_info[0] == 3:
-        char = char.decode("ISO-8859-1")
-
-    # not ANSI control code
-    if char != '[':
-        # as we read a character, move file position back by one character
-        input_file.seek(-1, 1)
-        return None
+    # there are some corrupted\invalid commands in the output;
+    # we assume any command that ends in '[' is actually cursor move.
+    # assumption is based on manual inspection of corrupted codes
+
+    # clear screen
+    if char == 'J':
+        return parse_clear_screen(code)
+    # color code
+    # we ignore this, with the exception <ESC>[0m which is color reset
+    # code. Reset color code is to clear screen under certain
+    # circumstances
+    elif char == 'm':
+        if code == "0":
+            return [Token.RESET_COLOR]
 
-    code = ""
-
-    # keep reading until we find upper or lower case ascii letter or [
-    while True:
-        char = input_file.read(1)
-        if sys.version_info[0] == 3:
-            char = char.decode("ISO-8859-1")
-        # unexpected EOF - return none
-        if not char:
-            return None
-
-        # there are some corrupted\invalid commands in the output;
-        # we assume any command that ends in '[' is actually cursor move.
-        # assumption is based on manual inspection of corrupted codes
-        if char.isalpha() or char == '[':
-            # clear screen
-            if char == 'J':
-                return parse_clear_screen(code)
-            # color code
-            # we ignore this, with the exception <ESC>[0m which is color reset
-            # code. Reset color code is to clear screen under certain
-            # circumstances
-            elif char == 'm':
-                if code == "0":
-                    return [Token.RESET_COLOR]
-
-                return None
-            # move cursor to <Row, Column>
-            elif char == 'H' or char == 'f' or char == '[':
-                return parse_cursor_move(code)
-            # hide\show cursor - ignore
-            elif char == 'h':
-                return None
-            else:
-                # unimplemented command
-                return None
-        else:
-            code += char
+        return None
+    # move cursor to <Row, Column>
+    elif char == 'H' or char == 'f' or char == '[':
+        return parse_cursor_move(code)
+    # hide\show cursor - ignore
+    elif char == 'h':
+        return None
+    else:
+        # unimplemented command
+        return None
 
 def parse_clear_screen(code):
     """
@@ -297,55 +417,3 @@ def parse_cursor_move(code):
     row = int(row) - 1
     column = int(column) - 1
     return [Token.MOVE_CURSOR, row, column]
-
-def write_and_clear_buffer(output_file, screen_buffer, last_row, width):
-    """
-    Prints and clears buffer. We use null terminator characters to signify where
-    the buffer ends (that is, empty buffer is filled with null terminators).
-    This prevents printing any extra whitespace characters, as the buffer
-    width is arbitrary and does not match actual screen dimensions.
-
-    Args:
-        output_file: The file where the output is written
-        screen_buffer: The screen buffer
-        last_row: Last row with characters; remaining rows will be skipped
-        width: Maximum row width
-    Returns:
-        None
-    """
-    for row in range(last_row):
-        line = ""
-        line_width = get_line_length(row, screen_buffer, width)
-        for column in range(line_width):
-            char = screen_buffer[row][column]
-            screen_buffer[row][column] = '\0'
-            # replace null with space
-            if char == '\0':
-                char = ' '
-            # skip newline symbols to make output prettier
-            if char == '\n':
-                continue
-            line += char
-
-        print(line, file=output_file)
-
-def get_line_length(row, screen_buffer, width):
-    """
-    Return line length by returning the position of null byte after first
-    non-null character, when scanning from right
-    Example: "hello\0" returns 5
-             "hello\0world\0" returns 11
-             "hello\0world\0\0\0\0\0\0" returns 11
-
-    Args:
-        row: Current row
-        screen_buffer: The screen buffer
-        width: Maximum row width
-
-    Returns:
-        Line length: Line length, up to width
-    """
-    for column in reversed(list(range(width))):
-        if screen_buffer[row][column] != '\0':
-            return column + 1
-    return 0
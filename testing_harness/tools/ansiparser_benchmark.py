@@ -0,0 +1,121 @@
+# coding=utf-8
+# Copyright (c) 2016 Intel, Inc.
+# Author Erkka Kääriä <erkka.kaaria@intel.com>
+#
+# This program is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the
+# Free Software Foundation; version 2 of the License
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU General Public License for more details.
+
+"""
+ANSI parser throughput benchmark. Parses a recorded serial log, or a generated
+log of the given size, and reports the parsing speed.
+
+Example:
+    python ansiparser_benchmark.py --size 500
+    python ansiparser_benchmark.py --file serial.log.raw.gz
+"""
+
+from __future__ import print_function
+import os
+import sys
+import gzip
+import time
+import random
+import argparse
+import tempfile
+
+import aft.tools.ansiparser as ansiparser
+
+_MEGABYTE = 1024 * 1024
+
+def generate_log(file_name, size):
+    """
+    Write a serial log like file of about size bytes: timestamped kernel and
+    systemd lines with color codes, and firmware menu screens drawn with
+    cursor moves.
+    """
+    randomizer = random.Random(0)
+    chunks = []
+    for index in range(2000):
+        stamp = "[{0:.6f} {1:.6f}] ".format(1e9 + index / 10.0, index / 10.0)
+        choice = randomizer.randint(0, 9)
+        if choice < 6:
+            chunks.append(stamp + "[ {0:10.6f}] usb 1-1: new high-speed USB "
+                          "device number {1} using ehci-pci\n".format(
+                              index / 10.0, index))
+        elif choice < 9:
+            chunks.append(stamp + "[  \x1b[0;32mOK  \x1b[0m] Started Service "
+                          + str(index) + ".\n")
+        else:
+            screen = ["\x1b[2J\x1b[1;1H"]
+            for row in range(1, 25):
+                screen.append("\x1b[{0};3H\x1b[37;44m Boot option {1} "
+                              "\x1b[0m".format(row, row))
+            chunks.append("".join(screen) + "\n")
+    block = "".join(chunks).encode("ISO-8859-1")
+
+    written = 0
+    with open(file_name, "wb") as log_file:
+        while written < size:
+            log_file.write(block)
+            written += len(block)
+    return written
+
+
+class CountingReader(object):
+    """
+    File wrapper counting the bytes read, the uncompressed size for gzip files
+    """
+    def __init__(self, input_file):
+        self.input_file = input_file
+        self.size = 0
+
+    def read(self, size=-1):
+        data = self.input_file.read(size)
+        self.size += len(data)
+        return data
+
+
+def main(argv=None):
+    """
+    Entry point
+    """
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--file", help="Recorded log to parse")
+    parser.add_argument("--size", type=int, default=200,
+                        help="Size of the generated log in megabytes")
+    args = parser.parse_args(argv)
+
+    file_name = args.file
+    if file_name is None:
+        descriptor, file_name = tempfile.mkstemp(prefix="aft_ansibench_")
+        os.close(descriptor)
+        print("Generating " + str(args.size) + " MB log")
+        generate_log(file_name, args.size * _MEGABYTE)
+
+    try:
+        start = time.time()
+        opener = gzip.open if file_name.endswith(".gz") else open
+        with opener(file_name, "rb") as input_file:
+            with open(os.devnull, "w") as output_file:
+                reader = CountingReader(input_file)
+                ansiparser.do_parse(reader, output_file)
+        duration = time.time() - start
+        size = reader.size
+    finally:
+        if args.file is None:
+            os.unlink(file_name)
+
+    print("Parsed " + "{0:.1f}".format(size / float(_MEGABYTE)) + " MB in " +
+          "{0:.2f}".format(duration) + " s, " +
+          "{0:.1f}".format(size / float(_MEGABYTE) / max(duration, 1e-6)) +
+          " MB/s")
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -14,9 +14,9 @@
 Script to turn on and off a USB-powercutter
 """
 
-import serial
 import sys
-import time
+
+from aft.cutters.usbrelay import Usbrelay
 
 def show_help():
     """
@@ -24,22 +24,24 @@ def show_help():
     """
     print(sys.argv[0] + " port [0|1]")
     sys.exit(1)
-if len(sys.argv) < 3 :
-    show_help()
-
-PORT = sys.argv[1]
-ACTION = sys.argv[2]
 
-SER = serial.Serial(PORT, 9600)
-# disconnect
-if str(ACTION) == '0' :
-    SER.write('\xFE\x05\x00\x00\x00\x00\xD9\xC5')
-# connect
-elif str(ACTION) == '1' :
-    SER.write('\xFE\x05\x00\x00\xFF\x00\x98\x35')
+def main():
+    """
+    Entry point
+    """
+    if len(sys.argv) < 3 or sys.argv[2] not in ("0", "1"):
+        show_help()
 
-else:
-    show_help()
+    relay = Usbrelay({"cutter": sys.argv[1]})
+    try:
+        # disconnect
+        if sys.argv[2] == "0":
+            relay.disconnect()
+        # connect
+        else:
+            relay.connect()
+    finally:
+        relay.close()
 
-time.sleep(1)
-SER.close()
+if __name__ == '__main__':
+    main()
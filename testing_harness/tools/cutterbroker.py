@@ -0,0 +1,344 @@
+# coding=utf-8
+# Copyright (c) 2016 Intel, Inc.
+# Author Erkka Kääriä <erkka.kaaria@intel.com>
+#
+# This program is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the
+# Free Software Foundation; version 2 of the License
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU General Public License for more details.
+
+"""
+Per-host broker serializing Cleware cutter access.
+
+Two clewarecontrol instances running at the same time interfere with each
+other. The broker owns a Unix socket, queues the power commands of all aft
+processes on the host and runs one clewarecontrol at a time, batching the
+queued commands of the same cutter into a single invocation. Commands setting
+a channel to different states are run in separate invocations in the order
+they were queued, so every command is executed.
+
+The broker is started on demand by the first client and exits after being
+idle for a while.
+
+Protocol, one request and one response line per connection:
+    power <cutter_id> <channel> <0|1>
+    ok | error <message>
+"""
+
+import os
+import sys
+import time
+import errno
+import fcntl
+import socket
+import threading
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+try:
+    import subprocess32
+except ImportError:
+    import subprocess as subprocess32
+
+import aft.tools.misc as misc
+
+_BATCH_WINDOW = 0.05 # Time to wait for more commands to batch [s]
+_IDLE_TIMEOUT = 600 # Broker exits after being idle this long [s]
+_RETRIES = 3 # clewarecontrol attempts per batch
+_START_TIMEOUT = 5 # Time to wait for an on-demand started broker [s]
+
+class _Request(object):
+    """
+    A queued power command waiting for its result
+    """
+    def __init__(self, cutter, channel, state):
+        self.cutter = cutter
+        self.channel = channel
+        self.state = state
+        self.error = None
+        self.done = threading.Event()
+
+
+class CutterBroker(object):
+    """
+    Broker server. Call run() to serve until idle.
+    """
+
+    def __init__(self, socket_path, idle_timeout=_IDLE_TIMEOUT):
+        self.socket_path = socket_path
+        self.idle_timeout = idle_timeout
+        self._requests = queue.Queue()
+        self._last_activity = time.time()
+        self._server = None
+
+    def run(self):
+        """
+        Serve requests until the broker has been idle for idle_timeout
+        seconds. Returns immediately if another broker is already running.
+
+        Returns:
+            True if this broker served, False if another one was running
+        """
+        lock_file = open(self.socket_path + ".lock", "w")
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except IOError as err:
+            if err.errno in (errno.EACCES, errno.EAGAIN):
+                lock_file.close()
+                return False
+            raise
+
+        try:
+            if os.path.exists(self.socket_path):
+                os.unlink(self.socket_path)
+            self._server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            self._server.bind(self.socket_path)
+            os.chmod(self.socket_path, 0o660)
+            self._server.listen(16)
+            self._server.settimeout(1)
+
+            worker = threading.Thread(target=self._work)
+            worker.daemon = True
+            worker.start()
+
+            while time.time() - self._last_activity < self.idle_timeout or \
+                  not self._requests.empty():
+                try:
+                    client, _ = self._server.accept()
+                except socket.timeout:
+                    continue
+                self._last_activity = time.time()
+                thread = threading.Thread(target=self._serve, args=(client,))
+                thread.daemon = True
+                thread.start()
+        finally:
+            if self._server:
+                self._server.close()
+            if os.path.exists(self.socket_path):
+                os.unlink(self.socket_path)
+            lock_file.close()
+        return True
+
+    def _serve(self, client):
+        """
+        Handle one client connection
+        """
+        try:
+            request_line = client.makefile("r").readline().split()
+            if len(request_line) != 4 or request_line[0] != "power" or \
+               request_line[3] not in ("0", "1"):
+                client.sendall(b"error bad request\n")
+                return
+
+            request = _Request(request_line[1], request_line[2],
+                               request_line[3])
+            self._requests.put(request)
+            request.done.wait()
+            self._last_activity = time.time()
+
+            if request.error is None:
+                client.sendall(b"ok\n")
+            else:
+                message = " ".join(str(request.error).split())
+                client.sendall(("error " + message + "\n").encode("utf-8"))
+        except socket.error:
+            pass
+        finally:
+            client.close()
+
+    def _work(self):
+        """
+        Run queued commands one clewarecontrol at a time
+        """
+        while True:
+            batch = [self._requests.get()]
+            deadline = time.time() + _BATCH_WINDOW
+            while True:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._requests.get(timeout=remaining))
+                except queue.Empty:
+                    break
+
+            cutters = {}
+            for request in batch:
+                cutters.setdefault(request.cutter, []).append(request)
+
+            for cutter, requests in cutters.items():
+                for command_requests in _split_conflicting(requests):
+                    error = self._execute(cutter, command_requests)
+                    for request in command_requests:
+                        request.error = error
+                        request.done.set()
+
+    def _execute(self, cutter, requests):
+        """
+        Set the channels of one cutter with a single clewarecontrol. The
+        requests don't set any channel to different states.
+
+        Returns:
+            None on success, the error otherwise
+        """
+        states = {}
+        for request in requests:
+            states[request.channel] = request.state
+
+        command = ["clewarecontrol", "-d", cutter, "-c", "1"]
+        for channel, state in sorted(states.items()):
+            command += ["-as", channel, state]
+
+        try:
+            execute_locked(command, cleware_lock_path(self.socket_path))
+        except (subprocess32.CalledProcessError,
+                subprocess32.TimeoutExpired) as err:
+            return err
+        return None
+
+
+def _split_conflicting(requests):
+    """
+    Split the queued requests of one cutter into consecutive batches in
+    which no channel is set to different states
+
+    Returns:
+        List of the batches as lists of requests, in queue order
+    """
+    batches = [[]]
+    states = {}
+    for request in requests:
+        if states.get(request.channel, request.state) != request.state:
+            batches.append([])
+            states = {}
+        states[request.channel] = request.state
+        batches[-1].append(request)
+    return batches
+
+
+def cleware_lock_path(socket_path):
+    """
+    Return the path of the host wide lock file held while clewarecontrol runs
+    """
+    return os.path.join(os.path.dirname(socket_path), "aft_cleware.lock")
+
+
+def execute_locked(command, lock_path):
+    """
+    Execute clewarecontrol command while holding the host wide lock, so it
+    never runs concurrently with another clewarecontrol started by aft.
+    Retries up to _RETRIES times on failure.
+
+    Raises:
+        subprocess32.CalledProcessError or subprocess32.TimeoutExpired
+        on failure
+    """
+    with open(lock_path, "a") as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            error = None
+            for _ in range(_RETRIES):
+                try:
+                    return misc.local_execute(command)
+                except (subprocess32.CalledProcessError,
+                        subprocess32.TimeoutExpired) as err:
+                    error = err
+            raise error
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def send_power_command(socket_path, cutter, channel, state, timeout=120):
+    """
+    Ask the broker to set a cutter channel, starting the broker if it isn't
+    running.
+
+    Args:
+        socket_path (str): Path to the broker socket
+        cutter (str): Cleware cutter id
+        channel (str): Cutter channel
+        state (str): "1" to turn power on, "0" to turn it off
+        timeout (integer): Timeout for the command in seconds
+
+    Returns:
+        None
+
+    Raises:
+        subprocess32.CalledProcessError if clewarecontrol failed
+        socket.error if the broker couldn't be reached
+    """
+    try:
+        connection = _connect(socket_path)
+    except socket.error:
+        _start_broker(socket_path)
+        connection = _connect_retrying(socket_path, _START_TIMEOUT)
+
+    try:
+        connection.settimeout(timeout)
+        connection.sendall(("power " + str(cutter) + " " + str(channel) +
+                            " " + str(state) + "\n").encode("utf-8"))
+        response = connection.makefile("r").readline().strip()
+    finally:
+        connection.close()
+
+    if response == "ok":
+        return
+    raise subprocess32.CalledProcessError(
+        returncode=1,
+        cmd=["clewarecontrol", "-d", str(cutter), "-c", "1", "-as",
+             str(channel), str(state)],
+        output=response[len("error "):] if response else "broker failed")
+
+
+def _connect(socket_path):
+    connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        connection.connect(socket_path)
+    except socket.error:
+        connection.close()
+        raise
+    return connection
+
+
+def _connect_retrying(socket_path, timeout):
+    deadline = time.time() + timeout
+    while True:
+        try:
+            return _connect(socket_path)
+        except socket.error:
+            if time.time() > deadline:
+                raise
+            time.sleep(0.05)
+
+
+def _start_broker(socket_path):
+    """
+    Start a broker process in the background. If another process started one
+    at the same time, the extra broker exits immediately.
+    """
+    subprocess32.Popen([sys.executable, "-m", "aft.tools.cutterbroker",
+                        socket_path],
+                       stdin=open(os.devnull, "r"),
+                       stdout=open(os.devnull, "w"),
+                       stderr=open(os.devnull, "w"),
+                       close_fds=True,
+                       preexec_fn=os.setsid)
+
+
+def main():
+    """
+    Entry point. Usage: cutterbroker.py socket_path
+    """
+    if len(sys.argv) < 2:
+        print(sys.argv[0] + " socket_path")
+        return 1
+    CutterBroker(sys.argv[1]).run()
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,154 @@
+# coding=utf-8
+# Copyright (c) 2016 Intel, Inc.
+# Author Erkka Kääriä <erkka.kaaria@intel.com>
+#
+# This program is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the
+# Free Software Foundation; version 2 of the License
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU General Public License for more details.
+
+"""
+Local TCP stand-in for an ETH-RLY16 relay board. Implements the single byte
+command protocol documented in aft/cutters/ethernetrelay16.py, so the
+EthernetRelay16 cutter can be tested without hardware.
+
+Usage:
+    python ethernetrelay16emulator.py [port]
+"""
+
+from __future__ import print_function
+import sys
+import socket
+import threading
+
+class EthernetRelay16Emulator(object):
+    """
+    Emulated ETH-RLY16 board listening on localhost.
+
+    Attributes:
+        relay_states (integer): Relay states as a bitmask
+        commands (list(integer)): All received command bytes
+    """
+    SOFTWARE_VERSION = 1
+    VOLTAGE = 120 # 12.0V DC
+    MAC_ADDRESS = bytearray([0x00, 0x04, 0xA3, 0x00, 0x00, 0x01])
+
+    def __init__(self, port=0):
+        self.relay_states = 0
+        self.commands = []
+        self._server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self._server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self._server.bind(("127.0.0.1", port))
+        self._server.listen(5)
+        self.ip, self.port = self._server.getsockname()
+        self._thread = None
+        self._clients = []
+        self._running = False
+
+    def start(self):
+        """
+        Start accepting connections in a background thread
+        """
+        self._running = True
+        self._thread = threading.Thread(target=self._accept)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        """
+        Stop the emulator and close all connections
+        """
+        self._running = False
+        try:
+            self._server.shutdown(socket.SHUT_RDWR)
+        except socket.error:
+            pass
+        self._server.close()
+        for client in self._clients:
+            try:
+                client.shutdown(socket.SHUT_RDWR)
+            except socket.error:
+                pass
+            client.close()
+        if self._thread:
+            self._thread.join(5)
+
+    def _accept(self):
+        while self._running:
+            try:
+                client, _ = self._server.accept()
+            except socket.error:
+                return
+            self._clients.append(client)
+            thread = threading.Thread(target=self._serve, args=(client,))
+            thread.daemon = True
+            thread.start()
+
+    def _serve(self, client):
+        while self._running:
+            try:
+                data = client.recv(1)
+            except socket.error:
+                return
+            if not data:
+                return
+            command = bytearray(data)[0]
+            self.commands.append(command)
+            try:
+                response = self._handle(command, client)
+                if response:
+                    client.sendall(bytes(response))
+            except socket.error:
+                return
+
+    def _handle(self, command, client):
+        """
+        Execute a command
+
+        Returns:
+            Response bytes as a bytearray, or None if there is no response
+        """
+        if command == 0x5A:
+            return bytearray([self.SOFTWARE_VERSION])
+        elif command == 0x5B:
+            return bytearray([self.relay_states])
+        elif command == 0x5C:
+            data = client.recv(1)
+            if data:
+                self.relay_states = bytearray(data)[0]
+        elif command == 0x5D:
+            return bytearray([self.VOLTAGE])
+        elif command == 0x64:
+            self.relay_states = 0xFF
+        elif 0x65 <= command <= 0x6C:
+            self.relay_states |= 1 << (command - 0x65)
+        elif command == 0x6E:
+            self.relay_states = 0
+        elif 0x6F <= command <= 0x76:
+            self.relay_states &= ~(1 << (command - 0x6F)) & 0xFF
+        elif command == 0x77:
+            return self.MAC_ADDRESS
+        return None
+
+
+def main():
+    """
+    Run the emulator in the foreground
+    """
+    port = int(sys.argv[1]) if len(sys.argv) > 1 else 17494
+    emulator = EthernetRelay16Emulator(port)
+    emulator.start()
+    print("Emulating ETH-RLY16 on " + emulator.ip + ":" + str(emulator.port))
+    try:
+        while True:
+            emulator._thread.join(1)
+    except KeyboardInterrupt:
+        emulator.stop()
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,164 @@
+# coding=utf-8
+# Copyright (c) 2016 Intel, Inc.
+# Author Simo Kuusela <simo.kuusela@intel.com>
+#
+# This program is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the
+# Free Software Foundation; version 2 of the License
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU General Public License for more details.
+
+"""
+FIFO backed stand-in for the /dev/hidg0 HID keyboard gadget device. Records the
+written HID reports with timestamps and decodes them back into keys.
+"""
+
+import os
+import time
+import select
+import tempfile
+import threading
+
+from aft.kb_emulators.gadgetkeyboard import GadgetKeyboard
+
+REPORT_LENGTH = 8
+
+class HidSink(object):
+    """
+    Fake HID keyboard device. Use HidSink.path as the pem_port of a
+    GadgetKeyboard.
+
+    Attributes:
+        reports (list): (timestamp, report) tuples of the received reports
+    """
+
+    def __init__(self, path=None):
+        if path is None:
+            self._directory = tempfile.mkdtemp(prefix="aft_hidsink_")
+            path = os.path.join(self._directory, "hidg0")
+        else:
+            self._directory = None
+        self.path = path
+        self.reports = []
+        self._thread = None
+        self._stop_read, self._stop_write = None, None
+
+    def start(self):
+        """
+        Create the FIFO and start recording reports
+        """
+        if not os.path.exists(self.path):
+            os.mkfifo(self.path)
+        self.reports = []
+        reader = os.open(self.path, os.O_RDONLY | os.O_NONBLOCK)
+        # Keep a writer open ourselves so that the reader doesn't see EOF
+        # whenever the keyboard emulator closes the device
+        keepalive = os.open(self.path, os.O_WRONLY | os.O_NONBLOCK)
+        self._stop_read, self._stop_write = os.pipe()
+        self._thread = threading.Thread(target=self._record,
+                                        args=(reader, keepalive))
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        """
+        Stop recording and remove the FIFO
+        """
+        if self._thread:
+            os.write(self._stop_write, b"x")
+            self._thread.join()
+            os.close(self._stop_read)
+            os.close(self._stop_write)
+            self._thread = None
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+        if self._directory:
+            os.rmdir(self._directory)
+            self._directory = None
+
+    def _record(self, reader, keepalive):
+        """
+        Recording thread main loop
+        """
+        poller = select.poll()
+        poller.register(reader, select.POLLIN)
+        poller.register(self._stop_read, select.POLLIN)
+        pending = b""
+        try:
+            while True:
+                events = dict(poller.poll())
+                if reader in events:
+                    data = os.read(reader, 4096)
+                    timestamp = time.time()
+                    pending += data
+                    while len(pending) >= REPORT_LENGTH:
+                        self.reports.append(
+                            (timestamp, pending[:REPORT_LENGTH]))
+                        pending = pending[REPORT_LENGTH:]
+                elif self._stop_read in events:
+                    return
+        finally:
+            os.close(reader)
+            os.close(keepalive)
+
+    def pressed_keys(self):
+        """
+        Returns the key presses in the received reports, see pressed_keys()
+        """
+        return pressed_keys([report for _, report in self.reports])
+
+
+def pressed_keys(reports):
+    """
+    Decode HID keyboard reports into key presses. A key is pressed when its
+    key code appears in a report and wasn't in the previous report.
+
+    Args:
+        reports (list(bytes)): 8 byte HID keyboard reports
+
+    Returns:
+        List of (key code, modifier) tuples in the order the keys were pressed
+    """
+    presses = []
+    held = []
+    for report in reports:
+        report = bytearray(report)
+        codes = [code for code in report[2:] if code]
+        for code in codes:
+            if code not in held:
+                presses.append((code, report[0]))
+        held = codes
+    return presses
+
+
+def key_names(presses):
+    """
+    Translate (key code, modifier) tuples into readable key names with the
+    GadgetKeyboard US key table.
+
+    Args:
+        presses (list): (key code, modifier) tuples as from pressed_keys()
+
+    Returns:
+        List of key names, e.g. ["F7", "a", "A", "!"]
+    """
+    shift = (GadgetKeyboard.modifier_codes["SHIFT_L"] |
+             GadgetKeyboard.modifier_codes["SHIFT_R"])
+    names = {}
+    for letter in range(26):
+        names[(0x04 + letter, False)] = chr(ord('a') + letter)
+        names[(0x04 + letter, True)] = chr(ord('A') + letter)
+    for key, code in GadgetKeyboard.key_codes.items():
+        shifted = key in GadgetKeyboard.keys_with_shift
+        if (code, shifted) not in names or len(key) == 1:
+            names[(code, shifted)] = key
+
+    result = []
+    for code, modifier in presses:
+        shifted = bool(modifier & shift)
+        name = names.get((code, shifted), names.get((code, not shifted)))
+        result.append(name if name else format(code, '#04x'))
+    return result
@@ -0,0 +1,206 @@
+# coding=utf-8
+# Copyright (c) 2016 Intel, Inc.
+# Author Simo Kuusela <simo.kuusela@intel.com>
+#
+# This program is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the
+# Free Software Foundation; version 2 of the License
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU General Public License for more details.
+
+"""
+Keyboard emulator throughput benchmark. Replays keystroke files through
+GadgetKeyboard into a fake HID device and reports keys per second, report
+latency percentiles and whether the received reports decode back to the
+expected keys.
+
+Example:
+    python kb_benchmark.py testing_harness_image_extras/kbsequences --burst
+"""
+
+from __future__ import print_function
+import os
+import sys
+import time
+import shutil
+import argparse
+import tempfile
+
+import aft.config as config
+from aft.kb_emulators.gadgetkeyboard import GadgetKeyboard, HidWriter
+from aft.tools.hidsink import HidSink, pressed_keys, key_names
+
+class TimedHidWriter(HidWriter):
+    """
+    HidWriter which records the time each report was written
+    """
+    def __init__(self, path, max_report_rate=0):
+        super(TimedHidWriter, self).__init__(path, max_report_rate)
+        self.write_times = []
+
+    def write(self, report, timeout=20):
+        super(TimedHidWriter, self).write(report, timeout)
+        self.write_times.append(self.last_write_start)
+
+
+def percentile(values, percent):
+    """
+    Return the percent'th percentile of values (nearest rank)
+    """
+    if not values:
+        return 0.0
+    values = sorted(values)
+    index = int(round(percent / 100.0 * (len(values) - 1)))
+    return values[index]
+
+
+def find_sequences(directory):
+    """
+    Return the keystroke files under directory, README files excluded
+    """
+    sequences = []
+    for root, _, files in os.walk(directory):
+        for name in sorted(files):
+            if not name.upper().startswith("README"):
+                sequences.append(os.path.join(root, name))
+    return sorted(sequences)
+
+
+def benchmark_file(filepath, args):
+    """
+    Replay a single keystroke file through a HidSink
+
+    Returns:
+        Dictionary of results, or None if the file was skipped
+    """
+    settings = {"kb_burst_mode": str(args.burst),
+                "kb_max_report_rate": str(args.max_report_rate)}
+
+    # Reference key presses are compiled without burst mode
+    reference = GadgetKeyboard({"pem_port": os.devnull})
+    program = reference.compile_keystrokes(filepath)
+    if any(instruction in (GadgetKeyboard.WAIT, GadgetKeyboard.REPEAT)
+           for instruction, _ in program):
+        print(filepath + ": skipped, waits for serial output")
+        return None
+    expected = pressed_keys([argument for instruction, argument in program
+                             if instruction == GadgetKeyboard.WRITE])
+
+    sink = HidSink()
+    sink.start()
+    try:
+        settings["pem_port"] = sink.path
+        keyboard = GadgetKeyboard(settings)
+        keyboard.writer = TimedHidWriter(sink.path, args.max_report_rate)
+        program = keyboard.compile_keystrokes(filepath)
+        if not args.keep_delays:
+            program = [(instruction, argument)
+                       for instruction, argument in program
+                       if instruction != GadgetKeyboard.DELAY]
+
+        start = time.time()
+        keyboard.play(program, filepath)
+        duration = time.time() - start
+        keyboard.close()
+
+        # Wait for the last reports to arrive
+        deadline = time.time() + 5
+        while len(sink.reports) < len(keyboard.writer.write_times) and \
+              time.time() < deadline:
+            time.sleep(0.01)
+    finally:
+        sink.stop()
+
+    received = pressed_keys([report for _, report in sink.reports])
+    latencies = [(received_time - written_time) * 1000
+                 for (received_time, _), written_time in
+                 zip(sink.reports, keyboard.writer.write_times)]
+    return {"keys": len(received),
+            "reports": len(sink.reports),
+            "duration": duration,
+            "latencies": latencies,
+            "correct": received == expected,
+            "expected": expected,
+            "received": received}
+
+
+def main(argv=None):
+    """
+    Entry point
+    """
+    default_directory = os.path.join(os.path.dirname(
+        os.path.abspath(__file__)), os.path.pardir, os.path.pardir,
+                                     "testing_harness_image_extras",
+                                     "kbsequences")
+    if not os.path.isdir(default_directory):
+        default_directory = "/root/kbsequences"
+
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("directory", nargs="?", default=default_directory,
+                        help="Directory containing keystroke files")
+    parser.add_argument("--burst", action="store_true",
+                        help="Send text with 6-key rollover reports")
+    parser.add_argument("--max_report_rate", type=float, default=0,
+                        help="Maximum reports per second, 0 for no limit")
+    parser.add_argument("--keep_delays", action="store_true",
+                        help="Keep the DELAY values of the keystroke files")
+    args = parser.parse_args(argv)
+
+    # Don't touch the system wide compiled keystroke cache
+    config.KEYSTROKE_CACHE_FOLDER = tempfile.mkdtemp(prefix="aft_kbcache_")
+    try:
+        return run_benchmark(args)
+    finally:
+        shutil.rmtree(config.KEYSTROKE_CACHE_FOLDER)
+
+
+def run_benchmark(args):
+    """
+    Benchmark all keystroke files and print the results
+
+    Returns:
+        0 if all files decoded correctly, 1 otherwise
+    """
+    all_correct = True
+    total_keys = 0
+    total_duration = 0.0
+    all_latencies = []
+    for filepath in find_sequences(args.directory):
+        result = benchmark_file(filepath, args)
+        if result is None:
+            continue
+
+        total_keys += result["keys"]
+        total_duration += result["duration"]
+        all_latencies += result["latencies"]
+        all_correct = all_correct and result["correct"]
+
+        print(os.path.relpath(filepath, args.directory) + ": " +
+              str(result["keys"]) + " keys in " + str(result["reports"]) +
+              " reports, " +
+              "{0:.1f}".format(result["keys"] / max(result["duration"], 1e-6)) +
+              " keys/s, latency p50 " +
+              "{0:.3f}".format(percentile(result["latencies"], 50)) +
+              " ms p99 " +
+              "{0:.3f}".format(percentile(result["latencies"], 99)) +
+              " ms, decode " + ("OK" if result["correct"] else "MISMATCH"))
+        if not result["correct"]:
+            print("  expected: " + " ".join(key_names(result["expected"])))
+            print("  received: " + " ".join(key_names(result["received"])))
+
+    print("Total: " + str(total_keys) + " keys, " +
+          "{0:.1f}".format(total_keys / max(total_duration, 1e-6)) +
+          " keys/s, latency p50 " +
+          "{0:.3f}".format(percentile(all_latencies, 50)) + " ms p90 " +
+          "{0:.3f}".format(percentile(all_latencies, 90)) + " ms p99 " +
+          "{0:.3f}".format(percentile(all_latencies, 99)) + " ms max " +
+          "{0:.3f}".format(max(all_latencies) if all_latencies else 0.0) +
+          " ms")
+
+    return 0 if all_correct else 1
+
+if __name__ == '__main__':
+    sys.exit(main())
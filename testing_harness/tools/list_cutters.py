@@ -12,47 +12,302 @@
 # See the GNU General Public License for more details.
 
 """
-Script to list attached USB-powercutters/usbrelays
+Script to list attached USB-powercutters/usbrelays, Cleware cutters, GPIO
+output pins and ETH-RLY16 relay boards.
+
+USB devices are found by reading vendor and product ids from sysfs, so listing
+doesn't run a subprocess per device.
+
+Usage:
+    list_cutters.py [--ethernetrelay ip[:port] ...] [--json]
 """
 
-import fnmatch
+from __future__ import print_function
 import os
+import sys
+import json
+import glob
+import socket
+import argparse
+
 try:
     import subprocess32
 except ImportError:
     import subprocess as subprocess32
 
+import aft.tools.misc as misc
+from aft.logger import Logger as logger
+
 ACCEPTED_DEVICES = [("0b00", "3070"), ("10c4", "ea60")]
 
-def vidpid_filter(device):
+CLEWARE_VENDOR_ID = "0d50"
+# Cleware device version to the number of sockets
+CLEWARE_SOCKETS = {512: 4, 29: 4, 51: 1}
+
+SYSFS_ROOT = "/sys"
+
+def _read_attribute(path):
+    """
+    Returns the stripped contents of a sysfs attribute, or None if it can't be
+    read
+    """
+    try:
+        with open(path) as attribute:
+            return attribute.read().strip()
+    except (IOError, OSError):
+        return None
+
+
+def _usb_device_directory(path):
+    """
+    Returns the closest parent of sysfs device directory path which is a USB
+    device, or None
+    """
+    path = os.path.realpath(path)
+    for _ in range(4):
+        if os.path.isfile(os.path.join(path, "idVendor")):
+            return path
+        path = os.path.dirname(path)
+    return None
+
+
+def find_usb_relays(sysfs_root=SYSFS_ROOT):
     """
-    Filter function which tests if a 'device' is a USB-powercutter
+    Find the serial port controlled USB relays
+
+    Returns:
+        List of dictionaries with the following format:
+        {
+            "type": "usbrelay",
+            "cutter": "/dev/ttyUSB0",
+            "vid": "10c4",
+            "pid": "ea60",
+            "usb_path": "1-1.2"
+        }
+    """
+    relays = []
+    tty_class = os.path.join(sysfs_root, "class", "tty")
+    for tty in sorted(glob.glob(os.path.join(tty_class, "ttyUSB*")) +
+                      glob.glob(os.path.join(tty_class, "ttyACM*"))):
+        usb_device = _usb_device_directory(os.path.join(tty, "device"))
+        if usb_device is None:
+            continue
+        vid_pid = (_read_attribute(os.path.join(usb_device, "idVendor")),
+                   _read_attribute(os.path.join(usb_device, "idProduct")))
+        if vid_pid in ACCEPTED_DEVICES:
+            relays.append({
+                "type": "usbrelay",
+                "cutter": "/dev/" + os.path.basename(tty),
+                "vid": vid_pid[0],
+                "pid": vid_pid[1],
+                "usb_path": os.path.basename(usb_device)
+            })
+    return relays
+
+
+def find_cleware_cutters(sysfs_root=SYSFS_ROOT):
     """
+    Find the Cleware cutters. The serial numbers used as cutter ids and the
+    device versions are read from sysfs. If a Cleware device can't be
+    identified from sysfs, e.g. it doesn't report its serial number over USB
+    or its version isn't a known cutter, all the cutters are listed with
+    clewarecontrol instead. Cleware devices that aren't known cutters, e.g.
+    sensors, are skipped.
+
+    Returns:
+        List of dictionaries with the following format, usb_path is only
+        included if the cutter was found from sysfs:
+        {
+            "type": "cleware",
+            "cutter": (int) cleware_cutter_id,
+            "sockets": (int) number_of_sockets,
+            "usb_path": "1-1.2"
+        }
+    """
+    devices = []
+    for usb_device in sorted(glob.glob(os.path.join(sysfs_root, "bus", "usb",
+                                                    "devices", "*"))):
+        if _read_attribute(os.path.join(usb_device, "idVendor")) == \
+           CLEWARE_VENDOR_ID:
+            devices.append((usb_device,
+                            _read_attribute(os.path.join(usb_device,
+                                                         "serial")),
+                            _cleware_version(usb_device)))
+
+    if not all(serial and serial.isdigit() and version in CLEWARE_SOCKETS
+               for _, serial, version in devices):
+        try:
+            return _clewarecontrol_cutters()
+        except (OSError, subprocess32.CalledProcessError,
+                subprocess32.TimeoutExpired) as err:
+            logger.warning("Listing Cleware devices with clewarecontrol " +
+                           "failed, listing only the ones identified from " +
+                           "sysfs: " + str(err))
+
+    cutters = []
+    for usb_device, serial, version in devices:
+        if not serial or not serial.isdigit() or \
+           version not in CLEWARE_SOCKETS:
+            logger.warning("Skipping unidentified Cleware device " +
+                           os.path.basename(usb_device))
+            continue
+        cutters.append({
+            "type": "cleware",
+            "cutter": int(serial),
+            "sockets": CLEWARE_SOCKETS[version],
+            "usb_path": os.path.basename(usb_device)
+        })
+    return cutters
+
+
+def _cleware_version(usb_device):
+    """
+    Returns the version of a Cleware device as reported by clewarecontrol, or
+    None if it can't be read. sysfs shows the bcdDevice field, which
+    clewarecontrol reports as the version, in hexadecimal.
+    """
+    bcd_device = _read_attribute(os.path.join(usb_device, "bcdDevice"))
     try:
-        device_info = subprocess32.check_output(["udevadm", "info", device])
-        device_lines = device_info.split("\n")
-        vid_line = [line for line in device_lines if "ID_VENDOR_ID" in line][0]
-        pid_line = [line for line in device_lines if "ID_MODEL_ID" in line][0]
-        device_vid = vid_line.split("=")[-1]
-        device_pid = pid_line.split("=")[-1]
-
-        if (device_vid, device_pid) in ACCEPTED_DEVICES:
-            return True
-        return False
-    except subprocess32.CalledProcessError:
-        return False
-
-def main():
-    """
-    Entry point. Prints all usb device under /dev which are assigned to USB-powercutter devices
-    """
-    devices = os.listdir("/dev")
-    devices_full_paths = ["/dev/" + device for device in devices]
-    tty_devices = [dev for dev in devices_full_paths if fnmatch.fnmatch(dev, "/dev/ttyUSB*")]
-    cutter_devices = [dev for dev in tty_devices if vidpid_filter(dev)]
-    for device in enumerate(cutter_devices, start=1):
-        print(str(1) + " " + str(device[1]))
+        return int(bcd_device, 16)
+    except (TypeError, ValueError):
+        return None
+
+
+def _clewarecontrol_cutters():
+    """
+    List the Cleware cutters with clewarecontrol -l
+    """
+    output = misc.local_execute(["clewarecontrol", "-l"])
+    output = output.split("\n")
+
+    cutter_arrays = [line.split(",") for line in output if "Device: " in line]
+
+    cutter_values = [(line[2].strip().split(" ")[1],
+                      line[3].strip().split(" ")[2])
+                     for line in cutter_arrays]
+
+    cutters = []
+    for val in cutter_values:
+        if int(val[0]) not in CLEWARE_SOCKETS:
+            logger.warning("Skipping Cleware device " + val[1] +
+                           " of unknown version " + val[0])
+            continue
+        cutters.append({
+            "type": "cleware",
+            "cutter": int(val[1]),
+            "sockets": CLEWARE_SOCKETS[int(val[0])]
+        })
+    return cutters
+
+
+def find_gpio_outputs(sysfs_root=SYSFS_ROOT):
+    """
+    Find the exported GPIO pins configured as outputs, which can drive a relay
+
+    Returns:
+        List of dictionaries with the following format:
+        {
+            "type": "gpiocutter",
+            "gpio_pin": "gpio60",
+            "value": 1
+        }
+    """
+    outputs = []
+    for gpio in sorted(glob.glob(os.path.join(sysfs_root, "class", "gpio",
+                                              "gpio[0-9]*"))):
+        if _read_attribute(os.path.join(gpio, "direction")) != "out":
+            continue
+        value = _read_attribute(os.path.join(gpio, "value"))
+        outputs.append({
+            "type": "gpiocutter",
+            "gpio_pin": os.path.basename(gpio),
+            "value": int(value) if value and value.isdigit() else None
+        })
+    return outputs
+
+
+def find_ethernet_relays(addresses):
+    """
+    Query ETH-RLY16 boards, which can't be discovered, at the given addresses
+
+    Args:
+        addresses (list): (ip, port) tuples of the boards
+
+    Returns:
+        List of dictionaries with the following format. relay_states is None
+        if the board didn't respond.
+        {
+            "type": "ethernetrelay16",
+            "ip": "123.45.67.89",
+            "port": 17494,
+            "relay_states": 0b00000101
+        }
+    """
+    from aft.cutters.ethernetrelay16 import EthernetRelay16, \
+        RelayBoardConnection
+
+    relays = []
+    for ip, port in addresses:
+        board = RelayBoardConnection.get(ip, port,
+                                         EthernetRelay16.DEFAULT_TIMEOUT)
+        try:
+            relay_states = board.get_relay_states()
+        except (socket.error, socket.timeout):
+            relay_states = None
+        relays.append({
+            "type": "ethernetrelay16",
+            "ip": ip,
+            "port": int(port),
+            "relay_states": relay_states
+        })
+    return relays
+
+
+def list_cutters(ethernet_relays=(), sysfs_root=SYSFS_ROOT):
+    """
+    Returns the inventory of all the found cutters as a list of dictionaries,
+    see the find_* functions for the formats
+
+    Args:
+        ethernet_relays (list): (ip, port) tuples of the ETH-RLY16 boards
+        sysfs_root (str): Mount point of sysfs
+    """
+    return (find_usb_relays(sysfs_root) + find_cleware_cutters(sysfs_root) +
+            find_gpio_outputs(sysfs_root) +
+            find_ethernet_relays(ethernet_relays))
+
+
+def _parse_address(address):
+    from aft.cutters.ethernetrelay16 import EthernetRelay16
+    if ":" in address:
+        ip, port = address.rsplit(":", 1)
+        return ip, int(port)
+    return address, EthernetRelay16._DEFAULT_PORT
+
+
+def main(argv=None):
+    """
+    Entry point. Prints the found cutters, one per line, or the whole
+    inventory as JSON
+    """
+    parser = argparse.ArgumentParser(description="List attached cutters")
+    parser.add_argument("--ethernetrelay", action="append", default=[],
+                        help="Address of an ETH-RLY16 board as ip[:port]")
+    parser.add_argument("--json", action="store_true",
+                        help="Print the inventory as JSON")
+    args = parser.parse_args(argv)
+
+    cutters = list_cutters([_parse_address(address)
+                            for address in args.ethernetrelay])
+    if args.json:
+        print(json.dumps(cutters, indent=4, sort_keys=True))
+        return 0
+
+    for index, cutter in enumerate(cutters, start=1):
+        details = " ".join(key + "=" + str(value) for key, value in
+                           sorted(cutter.items()) if key != "type")
+        print(str(index) + " " + cutter["type"] + " " + details)
     return 0
 
 if __name__ == '__main__':
-    main()
+    sys.exit(main())
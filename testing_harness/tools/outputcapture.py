@@ -0,0 +1,81 @@
+# coding=utf-8
+# Copyright (c) 2016 Intel, Inc.
+# Author Simo Kuusela <simo.kuusela@intel.com>
+#
+# This program is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the
+# Free Software Foundation; version 2 of the License
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU General Public License for more details.
+
+"""
+Bounded memory capture of command output.
+"""
+
+from collections import deque
+
+class OutputCapture(object):
+    """
+    Writes output to a file as it arrives, counts occurrences of strings in
+    it and keeps only its end in memory.
+
+    Attributes:
+        path (str): File the whole output is written to
+        counts (dictionary): Occurrences of each counted string
+        size (integer): Number of characters written
+    """
+    def __init__(self, path, counted=(), tail_size=65536):
+        """
+        Args:
+            path (str): File the whole output is written to
+            counted (list(str)): Strings to count in the output
+            tail_size (integer): Number of characters kept in memory
+        """
+        self.path = path
+        self.counts = dict((string, 0) for string in counted)
+        self.size = 0
+        self._tail_size = tail_size
+        self._tail = deque()
+        self._tail_length = 0
+        # End of the previous write that may hold the beginning of a counted
+        # string
+        self._overlap = ""
+        self._overlap_size = max([len(string) for string in counted] or [1]) - 1
+        self._file = open(path, "w")
+
+    def write(self, text):
+        """
+        Capture a piece of output
+        """
+        if not text:
+            return
+        self._file.write(text)
+        self.size += len(text)
+
+        # The overlap is shorter than any counted string, so only the matches
+        # ending in text are counted
+        searched = self._overlap + text
+        for string in self.counts:
+            self.counts[string] += searched.count(string)
+        self._overlap = searched[-self._overlap_size:] \
+            if self._overlap_size else ""
+
+        self._tail.append(text)
+        self._tail_length += len(text)
+        while self._tail_length - len(self._tail[0]) >= self._tail_size:
+            self._tail_length -= len(self._tail.popleft())
+
+    def tail(self):
+        """
+        Returns the last tail_size characters of the output
+        """
+        return "".join(self._tail)[-self._tail_size:]
+
+    def close(self):
+        """
+        Close the output file
+        """
+        self._file.close()
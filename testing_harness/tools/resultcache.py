@@ -0,0 +1,207 @@
+# coding=utf-8
+# Copyright (c) 2016 Intel, Inc.
+# Author Simo Kuusela <simo.kuusela@intel.com>
+#
+# This program is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the
+# Free Software Foundation; version 2 of the License
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU General Public License for more details.
+
+"""
+Cache of passed test case results.
+
+Results are keyed by the content hash of the tested image, the device model,
+a hash of the test case definition and a hash of the harness sources, so a
+result is only reused for the very same test of the very same image.
+
+aft flashes and tests in separate runs, so the image flashed to each device is
+recorded, and test runs without an image use the recorded one.
+"""
+
+import os
+import json
+import time
+import hashlib
+import tempfile
+
+import aft.config as config
+from aft.logger import Logger as logger
+
+_CHUNK_SIZE = 1048576 # Bytes hashed at a time
+
+_HARNESS_VERSION = []
+
+def record_flashed_image(device_name, image_file):
+    """
+    Record the image flashed to a device. None records that the contents of
+    the device are unknown, e.g. while flashing. Failing to record only
+    disables reusing results.
+    """
+    try:
+        path = _flashed_image_file(device_name)
+        if image_file is None:
+            if os.path.exists(path):
+                os.unlink(path)
+            return
+        image_file = os.path.realpath(image_file)
+        _write_json(path, {"image": image_file,
+                           "stat": _stat(image_file)})
+    except (IOError, OSError) as err:
+        logger.warning("Recording the image flashed to " + device_name +
+                       " failed: " + str(err))
+
+def flashed_image(device_name):
+    """
+    Returns the image recorded as flashed to a device, or None if there is no
+    record or the image file has changed since
+    """
+    try:
+        record = _read_json(_flashed_image_file(device_name))
+    except (IOError, OSError) as err:
+        logger.warning("Reading the image flashed to " + device_name +
+                       " failed: " + str(err))
+        return None
+    if record is None or not os.path.isfile(record["image"]) or \
+       _stat(record["image"]) != record["stat"]:
+        return None
+    return record["image"]
+
+def image_hash(image_file):
+    """
+    Returns the SHA-256 digest of an image. Digests are cached by the path,
+    size and modification time of the image, as hashing an image takes long.
+    """
+    image_file = os.path.realpath(image_file)
+    cache_file = os.path.join(_folder("images"), hashlib.sha1(
+        image_file.encode("utf-8")).hexdigest() + ".json")
+    stat = _stat(image_file)
+    cached = _read_json(cache_file)
+    if cached is not None and cached["stat"] == stat:
+        return cached["sha256"]
+
+    logger.info("Hashing image " + image_file)
+    digest = hashlib.sha256()
+    with open(image_file, "rb") as image:
+        for chunk in iter(lambda: image.read(_CHUNK_SIZE), b""):
+            digest.update(chunk)
+    _write_json(cache_file, {"stat": stat, "sha256": digest.hexdigest()})
+    return digest.hexdigest()
+
+def open_cache(image_file, model):
+    """
+    Returns the result cache of an image on a device model, or None if the
+    image is unknown or can't be read
+    """
+    if image_file is None:
+        logger.info("Tested image unknown, not reusing results.")
+        return None
+    try:
+        return ResultCache(image_file, model)
+    except (IOError, OSError) as err:
+        logger.warning("Opening the result cache failed: " + str(err))
+        return None
+
+def harness_version():
+    """
+    Returns a hash of the aft sources, so that results of other aft versions
+    aren't reused
+    """
+    if not _HARNESS_VERSION:
+        root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        digest = hashlib.sha256()
+        for directory, subdirectories, files in os.walk(root):
+            subdirectories.sort()
+            for name in sorted(files):
+                if name.endswith(".py"):
+                    path = os.path.join(directory, name)
+                    digest.update(os.path.relpath(path, root).encode("utf-8"))
+                    with open(path, "rb") as source:
+                        digest.update(source.read())
+        _HARNESS_VERSION.append(digest.hexdigest())
+    return _HARNESS_VERSION[0]
+
+def test_case_hash(test_case):
+    """
+    Returns a hash of the test plan section defining test case
+    """
+    return hashlib.sha256(json.dumps(sorted(test_case.config.items()))
+                          .encode("utf-8")).hexdigest()
+
+
+class ResultCache(object):
+    """
+    Passed test case results of one image on one device model
+    """
+    def __init__(self, image_file, model):
+        self._image_hash = image_hash(image_file)
+        self._model = model
+
+    def _path(self, test_case):
+        key = "\n".join([self._image_hash, self._model,
+                         test_case_hash(test_case), harness_version()])
+        return os.path.join(_folder("results"), hashlib.sha256(
+            key.encode("utf-8")).hexdigest() + ".json")
+
+    def get(self, test_case):
+        """
+        Returns the xunit section of a cached passed result of test case, or
+        None if there is none
+        """
+        try:
+            entry = _read_json(self._path(test_case))
+        except (IOError, OSError) as err:
+            logger.warning("Reading the cached result of " + test_case.name +
+                           " failed: " + str(err))
+            return None
+        return entry["xunit_section"] if entry else None
+
+    def put(self, test_case):
+        """
+        Cache the result of test case if it passed
+        """
+        if not test_case.result or test_case.cached or \
+           test_case.error is not None or test_case.abort_reason is not None:
+            return
+        try:
+            _write_json(self._path(test_case),
+                        {"name": test_case.name,
+                         "time": time.time(),
+                         "xunit_section": test_case.xunit_section})
+        except (IOError, OSError) as err:
+            logger.warning("Caching the result of " + test_case.name +
+                           " failed: " + str(err))
+
+
+def _flashed_image_file(device_name):
+    return os.path.join(_folder("flashed"), device_name + ".json")
+
+def _folder(name):
+    folder = os.path.join(config.RESULT_CACHE_FOLDER, name)
+    if not os.path.isdir(folder):
+        os.makedirs(folder)
+    return folder
+
+def _stat(path):
+    stat = os.stat(path)
+    return [stat.st_size, stat.st_mtime]
+
+def _read_json(path):
+    try:
+        with open(path) as json_file:
+            return json.load(json_file)
+    except (IOError, OSError, ValueError):
+        return None
+
+def _write_json(path, data):
+    """
+    Write data to path atomically, so concurrent aft runs never read a
+    partially written file
+    """
+    descriptor, temporary = tempfile.mkstemp(dir=os.path.dirname(path))
+    with os.fdopen(descriptor, "w") as json_file:
+        json.dump(data, json_file)
+    os.rename(temporary, path)
@@ -0,0 +1,243 @@
+# coding=utf-8
+# Copyright (c) 2016 Intel, Inc.
+# Author Simo Kuusela <simo.kuusela@intel.com>
+#
+# This program is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the
+# Free Software Foundation; version 2 of the License
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU General Public License for more details.
+
+"""
+Compressed, time indexed store for the raw serial log.
+
+The log is written as independently compressed gzip members (frames), so the
+file is a normal .gz file, and each frame can be decompressed on its own. A
+sidecar index file has one line per frame:
+    <wall clock time> <monotonic time> <file offset> <uncompressed offset>
+
+Usage:
+    seriallogstore.py serial.log.raw.gz [--start TIME] [--end TIME]
+                      [--last SECONDS] [--raw]
+
+TIME is seconds since the epoch or "YYYY-MM-DD HH:MM:SS" in local time.
+"""
+
+from __future__ import print_function
+import io
+import re
+import sys
+import time
+import zlib
+import argparse
+
+import aft.tools.ansiparser as ansiparser
+
+_FRAME_SIZE = 262144 # Start a new frame after this many bytes...
+_FRAME_INTERVAL = 10.0 # ...or after this many seconds [s]
+_COMPRESSION_LEVEL = 6
+_GZIP_WBITS = 16 + zlib.MAX_WBITS
+
+INDEX_SUFFIX = ".idx"
+
+_monotonic = getattr(time, "monotonic", time.time)
+
+# Timestamp prefix written by the serial recorder
+_LINE_STAMP = re.compile(br"\[(\d+\.\d+) \d+\.\d+\] ")
+
+class FrameWriter(object):
+    """
+    Binary file like object compressing the written bytes to gzip frames.
+
+    flush() makes the written bytes decompressible from the file, and closes
+    the frame once it is _FRAME_SIZE bytes or _FRAME_INTERVAL seconds old, so
+    frames end where the writer flushes. The serial recorder flushes only
+    after complete lines.
+    """
+    def __init__(self, path):
+        self.path = path
+        self._file = open(path, "wb")
+        self._index = open(path + INDEX_SUFFIX, "w")
+        self._compressor = None
+        self._frame_start = 0
+        self._frame_size = 0
+        self._uncompressed_offset = 0
+
+    def write(self, data):
+        """
+        Compress data to the current frame, starting a new one if needed
+        """
+        if not data:
+            return
+        if self._compressor is None:
+            self._start_frame()
+        self._file.write(self._compressor.compress(data))
+        self._frame_size += len(data)
+
+    def flush(self):
+        """
+        Flush the compressed data to the file
+        """
+        if self._compressor is None:
+            return
+        if self._frame_size >= _FRAME_SIZE or \
+           _monotonic() - self._frame_start >= _FRAME_INTERVAL:
+            self._end_frame()
+        else:
+            self._file.write(self._compressor.flush(zlib.Z_SYNC_FLUSH))
+        self._file.flush()
+
+    def close(self):
+        """
+        Finish the last frame and close the files
+        """
+        if self._compressor is not None:
+            self._end_frame()
+        self._file.close()
+        self._index.close()
+
+    def _start_frame(self):
+        self._compressor = zlib.compressobj(_COMPRESSION_LEVEL, zlib.DEFLATED,
+                                            _GZIP_WBITS)
+        self._frame_start = _monotonic()
+        self._index.write("{0:.6f} {1:.6f} {2} {3}\n".format(
+            time.time(), self._frame_start, self._file.tell(),
+            self._uncompressed_offset))
+        self._index.flush()
+
+    def _end_frame(self):
+        self._file.write(self._compressor.flush(zlib.Z_FINISH))
+        self._uncompressed_offset += self._frame_size
+        self._compressor = None
+        self._frame_size = 0
+
+
+def read_index(path):
+    """
+    Returns the index of the log as a list of (wall clock time, file offset)
+    tuples
+    """
+    index = []
+    with open(path + INDEX_SUFFIX) as index_file:
+        for line in index_file:
+            fields = line.split()
+            if len(fields) == 4:
+                index.append((float(fields[0]), int(fields[2])))
+    return index
+
+
+def read_window(path, start=None, end=None):
+    """
+    Read the lines recorded between start and end. Only the frames covering
+    the window are decompressed.
+
+    Args:
+        path (str): The compressed log
+        start (float): Wall clock time, None for the beginning of the log
+        end (float): Wall clock time, None for the end of the log
+
+    Returns:
+        Generator of the lines as bytes
+    """
+    index = read_index(path)
+    with open(path, "rb") as log_file:
+        selected = False
+        for number, (frame_time, offset) in enumerate(index):
+            if end is not None and frame_time > end:
+                break
+            next_time = index[number + 1][0] if number + 1 < len(index) \
+                else None
+            if start is not None and next_time is not None and \
+               next_time < start:
+                continue
+
+            log_file.seek(offset)
+            size = index[number + 1][1] - offset if number + 1 < len(index) \
+                else -1
+            data = _decompress(log_file.read(size))
+
+            for line in io.BytesIO(data):
+                match = _LINE_STAMP.match(line)
+                if match:
+                    line_time = float(match.group(1))
+                    # Lines without a timestamp belong to the previous line
+                    selected = (start is None or line_time >= start) and \
+                        (end is None or line_time <= end)
+                    if end is not None and line_time > end:
+                        return
+                if selected:
+                    yield line
+
+
+def _decompress(data):
+    """
+    Decompress one frame. A frame which was being written when the recording
+    ended may be truncated, in which case its complete part is returned.
+    """
+    decompressor = zlib.decompressobj(_GZIP_WBITS)
+    try:
+        return decompressor.decompress(data)
+    except zlib.error:
+        return b""
+
+
+def parse_time(value):
+    """
+    Parse seconds since the epoch or "YYYY-MM-DD HH:MM:SS" local time
+    """
+    try:
+        return float(value)
+    except ValueError:
+        return time.mktime(time.strptime(value, "%Y-%m-%d %H:%M:%S"))
+
+
+def main(argv=None):
+    """
+    Entry point. Renders the selected part of the log to stdout.
+    """
+    parser = argparse.ArgumentParser(
+        description="Render a time window of a compressed serial log")
+    parser.add_argument("log", help="Compressed log, e.g. serial.log.raw.gz")
+    parser.add_argument("--start", type=parse_time,
+                        help="Start of the window")
+    parser.add_argument("--end", type=parse_time, help="End of the window")
+    parser.add_argument("--last", type=float,
+                        help="Show the last LAST seconds of the log, or of "
+                        "the window ending at --end")
+    parser.add_argument("--raw", action="store_true",
+                        help="Print the raw output without parsing ANSI "
+                        "control codes")
+    args = parser.parse_args(argv)
+
+    start, end = args.start, args.end
+    if args.last is not None:
+        if end is None:
+            index = read_index(args.log)
+            # The last line can be up to a frame interval after the last frame
+            # started, find it from the last frame
+            last_times = [float(match.group(1)) for match in
+                          (_LINE_STAMP.match(line) for line in
+                           read_window(args.log, index[-1][0] if index
+                                       else None))
+                          if match]
+            end = last_times[-1] if last_times else time.time()
+        start = end - args.last
+
+    if args.raw:
+        output = getattr(sys.stdout, "buffer", sys.stdout)
+        for line in read_window(args.log, start, end):
+            output.write(line)
+        output.flush()
+        return 0
+
+    ansi_parser = ansiparser.StreamParser(sys.stdout)
+    for line in read_window(args.log, start, end):
+        ansi_parser.feed(line)
+    ansi_parser.finish()
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,425 @@
+# coding=utf-8
+# Copyright (c) 2016 Intel, Inc.
+# Author Simo Kuusela <simo.kuusela@intel.com>
+#
+# This program is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the
+# Free Software Foundation; version 2 of the License
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU General Public License for more details.
+
+"""
+Publishes the live serial output of recorded ports on Unix or TCP sockets.
+
+Every connected reader receives the raw serial output as a byte stream,
+optionally starting with the last replay bytes recorded before it connected.
+Each reader has a bounded queue. While its queue is full, the output is
+dropped for that reader only, and a line telling how many bytes were dropped
+is sent when the reader catches up, so slow readers never block recording.
+
+Usage, to watch a published port:
+    serialpublisher.py ADDRESS
+
+ADDRESS is the path of a Unix socket or HOST:PORT of a TCP socket.
+"""
+
+from __future__ import print_function
+import os
+import sys
+import errno
+import fcntl
+import select
+import socket
+import threading
+from collections import deque
+
+import aft.errors as errors
+import aft.tools.serialrecorder as serialrecorder
+from aft.logger import Logger as logger
+from aft.tools.thread_handler import Thread_handler as thread_handler
+
+_QUEUE_SIZE = 262144 # Maximum bytes queued per reader
+_SEND_ERRORS = (errno.EAGAIN, errno.EWOULDBLOCK)
+
+# The publisher of the process, see get_publisher()
+_PUBLISHER = None
+_PUBLISHER_LOCK = threading.Lock()
+
+def get_publisher():
+    """
+    Returns the serial publisher of the process, starting it on first use.
+    The publisher thread is stopped with the RECORDERS_STOP flag.
+    """
+    global _PUBLISHER
+    with _PUBLISHER_LOCK:
+        if _PUBLISHER is None or not _PUBLISHER.is_alive():
+            _PUBLISHER = SerialPublisher()
+            thread_handler.add_thread(_PUBLISHER.start())
+        return _PUBLISHER
+
+def unpublish(port):
+    """
+    Stop publishing a port with the publisher of the process. Unlike
+    get_publisher().unpublish(), doesn't start a publisher that has already
+    been stopped.
+    """
+    with _PUBLISHER_LOCK:
+        publisher = _PUBLISHER
+    if publisher is not None and publisher.is_alive():
+        publisher.unpublish(port)
+
+def parse_address(address):
+    """
+    Returns the socket family and address of a Unix socket path or a
+    HOST:PORT string
+    """
+    if not address.startswith("/") and ":" in address:
+        host, port = address.rsplit(":", 1)
+        return socket.AF_INET, (host, int(port))
+    return socket.AF_UNIX, address
+
+
+class _Reader(object):
+    """
+    A connected reader and the output queued for it
+    """
+    def __init__(self, connection):
+        self.connection = connection
+        self.connection.setblocking(False)
+        self._queue = deque()
+        self._queued = 0
+        # Bytes dropped since the reader last had room in its queue
+        self._dropped = 0
+        self.total_dropped = 0
+
+    def push(self, data):
+        """
+        Queue data for the reader, or drop it if the queue is full
+        """
+        if self._queued + len(data) > _QUEUE_SIZE:
+            self._dropped += len(data)
+            self.total_dropped += len(data)
+            return
+        self._append_dropped()
+        self._append(data)
+
+    def _append_dropped(self):
+        """
+        Tell the reader how much output it missed, right after the last
+        output it got
+        """
+        if self._dropped:
+            self._append(("\r\n[aft: dropped " + str(self._dropped) +
+                          " bytes]\r\n").encode("ascii"))
+            self._dropped = 0
+
+    def _append(self, data):
+        self._queue.append(data)
+        self._queued += len(data)
+
+    def pending(self):
+        """
+        Returns True if there is output queued for the reader
+        """
+        return bool(self._queue)
+
+    def send(self):
+        """
+        Send queued output until the socket buffer is full
+
+        Raises:
+            socket.error if the reader has disconnected
+        """
+        while self._queue:
+            data = self._queue[0]
+            try:
+                sent = self.connection.send(data)
+            except socket.error as err:
+                if err.args[0] in _SEND_ERRORS:
+                    return
+                raise
+            self._queued -= sent
+            if sent < len(data):
+                self._queue[0] = data[sent:]
+                return
+            self._queue.popleft()
+            if not self._queue:
+                self._append_dropped()
+
+
+class _Channel(object):
+    """
+    A published port, its server socket and its readers
+    """
+    def __init__(self, port, address, replay):
+        self.port = port
+        self.address = address
+        self.replay = replay
+        self.history = bytearray()
+        self.readers = []
+        family, self._bind_address = parse_address(address)
+        if family == socket.AF_UNIX and os.path.exists(address):
+            os.unlink(address)
+        self.server = socket.socket(family, socket.SOCK_STREAM)
+        if family == socket.AF_INET:
+            self.server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.server.bind(self._bind_address)
+        self.server.listen(16)
+        self.server.setblocking(False)
+
+    def record(self, data):
+        """
+        Keep the last replay bytes for new readers and queue data for the
+        connected ones
+        """
+        if self.replay:
+            self.history += data
+            if len(self.history) > self.replay:
+                del self.history[:len(self.history) - self.replay]
+        for reader in self.readers:
+            reader.push(data)
+
+    def close(self):
+        for reader in self.readers:
+            reader.connection.close()
+        self.readers = []
+        self.server.close()
+        if self.server.family == socket.AF_UNIX and \
+           os.path.exists(self.address):
+            os.unlink(self.address)
+
+
+class SerialPublisher(object):
+    """
+    Serves the readers of all published ports from a single thread
+    """
+    def __init__(self):
+        self._channels = {}
+        self._lock = threading.Lock()
+        self._wakeup = os.pipe()
+        for fd in self._wakeup:
+            fcntl.fcntl(fd, fcntl.F_SETFL,
+                        fcntl.fcntl(fd, fcntl.F_GETFL) | os.O_NONBLOCK)
+        self._running = True
+        self._stopped = threading.Event()
+
+    def start(self):
+        """
+        Run the publisher in a new thread
+
+        Returns:
+            The started thread
+        """
+        thread = threading.Thread(target=self.run,
+                                  name=str(os.getpid()) + "publisher")
+        thread.daemon = True
+        thread.start()
+        return thread
+
+    def is_alive(self):
+        """
+        Returns True if the publisher is running
+        """
+        return not self._stopped.is_set()
+
+    def publish(self, port, address, replay=0):
+        """
+        Publish the output of a recorded port
+
+        Args:
+            port (str): Serial port being recorded, e.g. /dev/ttyUSB0
+            address (str): Unix socket path or HOST:PORT to listen on
+            replay (integer): Number of previously recorded bytes sent to new
+                              readers
+
+        Raises:
+            aft.errors.AFTDeviceError if port isn't being recorded or is
+            already published
+        """
+        with self._lock:
+            if port in self._channels:
+                raise errors.AFTDeviceError("Serial port " + str(port) +
+                                            " is already published")
+            channel = _Channel(port, address, int(replay))
+            self._channels[port] = channel
+
+        channel.listener = lambda data: self._record(channel, data)
+        if not serialrecorder.add_listener(port, channel.listener):
+            with self._lock:
+                del self._channels[port]
+            channel.close()
+            raise errors.AFTDeviceError("Serial port " + str(port) +
+                                        " isn't being recorded")
+        logger.info("Publishing serial output of " + str(port) + " on " +
+                    str(address))
+        self._wake()
+
+    def unpublish(self, port):
+        """
+        Stop publishing a port and disconnect its readers
+        """
+        with self._lock:
+            channel = self._channels.pop(port, None)
+        if channel:
+            serialrecorder.remove_listener(port, channel.listener)
+            self._wake()
+
+    def stop(self):
+        """
+        Stop publishing all ports
+        """
+        self._running = False
+        self._wake()
+
+    def _record(self, channel, data):
+        """
+        Serial recorder listener, called from the recorder thread
+        """
+        with self._lock:
+            channel.record(data)
+            pending = bool(channel.readers)
+        if pending:
+            self._wake()
+
+    def _wake(self):
+        try:
+            os.write(self._wakeup[1], b"x")
+        except OSError as err:
+            # Pipe full, the publisher will wake up anyway
+            if err.errno != errno.EAGAIN:
+                raise
+
+    def run(self):
+        """
+        Accept readers and send them the output until stopped with stop() or
+        the RECORDERS_STOP flag
+        """
+        stop_fd = thread_handler.get_flag_fd(thread_handler.RECORDERS_STOP)
+        # Channels with open sockets, including unpublished ones until their
+        # sockets have been closed in this thread
+        open_channels = {}
+        try:
+            while self._running:
+                with self._lock:
+                    channels = dict(self._channels)
+                for port, channel in list(open_channels.items()):
+                    if channels.get(port) is not channel:
+                        channel.close()
+                        del open_channels[port]
+                open_channels.update(channels)
+
+                poller = select.poll()
+                poller.register(stop_fd, select.POLLIN)
+                poller.register(self._wakeup[0], select.POLLIN)
+                sockets = {}
+                with self._lock:
+                    for channel in open_channels.values():
+                        sockets[channel.server.fileno()] = (channel, None)
+                        poller.register(channel.server, select.POLLIN)
+                        for reader in channel.readers:
+                            sockets[reader.connection.fileno()] = \
+                                (channel, reader)
+                            poller.register(reader.connection, select.POLLIN |
+                                            (select.POLLOUT if reader.pending()
+                                             else 0))
+
+                try:
+                    events = poller.poll()
+                except (select.error, IOError, OSError) as err:
+                    if err.args[0] == errno.EINTR:
+                        continue
+                    raise
+                if any(fd == stop_fd for fd, _ in events):
+                    break
+
+                for fd, event in events:
+                    if fd == self._wakeup[0]:
+                        self._clear_wakeup()
+                    elif fd in sockets:
+                        channel, reader = sockets[fd]
+                        if reader is None:
+                            self._accept(channel)
+                        else:
+                            self._serve(channel, reader, event)
+        finally:
+            with self._lock:
+                open_channels.update(self._channels)
+                self._channels = {}
+            for channel in open_channels.values():
+                serialrecorder.remove_listener(channel.port,
+                                               getattr(channel, "listener",
+                                                       None))
+                channel.close()
+            self._stopped.set()
+
+    def _clear_wakeup(self):
+        try:
+            while os.read(self._wakeup[0], 4096):
+                pass
+        except OSError:
+            pass
+
+    def _accept(self, channel):
+        try:
+            connection, _ = channel.server.accept()
+        except socket.error:
+            return
+        reader = _Reader(connection)
+        with self._lock:
+            if channel.history:
+                reader.push(bytes(channel.history))
+            channel.readers.append(reader)
+        logger.info("Reader connected to " + str(channel.address))
+
+    def _serve(self, channel, reader, event):
+        """
+        Send queued output to a reader, or close it if it has disconnected.
+        Anything the reader sends is ignored.
+        """
+        try:
+            if event & select.POLLIN:
+                if not reader.connection.recv(4096):
+                    raise socket.error(errno.ECONNRESET, "disconnected")
+            if event & (select.POLLERR | select.POLLHUP | select.POLLNVAL):
+                raise socket.error(errno.ECONNRESET, "disconnected")
+            with self._lock:
+                reader.send()
+        except socket.error:
+            with self._lock:
+                if reader in channel.readers:
+                    channel.readers.remove(reader)
+            reader.connection.close()
+            logger.info("Reader disconnected from " + str(channel.address) +
+                        ", " + str(reader.total_dropped) + " bytes dropped")
+
+
+def main(argv=None):
+    """
+    Entry point. Writes the output published on an address to stdout.
+    """
+    argv = sys.argv[1:] if argv is None else argv
+    if len(argv) != 1:
+        print(__doc__.split("\n\n")[-2])
+        return 1
+    family, address = parse_address(argv[0])
+    connection = socket.socket(family, socket.SOCK_STREAM)
+    connection.connect(address)
+    output = getattr(sys.stdout, "buffer", sys.stdout)
+    try:
+        while True:
+            data = connection.recv(4096)
+            if not data:
+                break
+            output.write(data)
+            output.flush()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        connection.close()
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
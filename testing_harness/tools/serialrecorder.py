@@ -14,67 +14,628 @@
 # See the GNU General Public License for more details.
 
 """
-A script to record serial output from a tty-device.
+A script to record serial output from tty-devices. A single RecorderService
+thread records all serial ports of the process, see get_service().
 """
 
+import io
+import os
 import sys
-import serial
 import time
+import errno
+import fcntl
+import select
+import struct
+import serial
+import threading
+import aft.errors as errors
 import aft.tools.ansiparser as ansiparser
+import aft.tools.seriallogstore as seriallogstore
 from aft.tools.thread_handler import Thread_handler as thread_handler
 
+_BUFFER_SIZE = 65536 # Longer lines are written out in parts [bytes]
+_FLUSH_BYTES = 4096 # Flush the log after this many bytes...
+_FLUSH_INTERVAL = 1.0 # ...or after this many seconds [s]
+_RECONNECT_DELAY = 1.0 # Delay between failing reconnects [s]
+_POLL_ERRORS = select.POLLERR | select.POLLHUP | select.POLLNVAL
+
+# Linux ioctl returning the serial_icounter_struct of a serial port
+_TIOCGICOUNT = 0x545D
+_ICOUNT_FORMAT = "20i"
+_ICOUNT_OVERRUN = 7
+_ICOUNT_BUF_OVERRUN = 10
+
+_monotonic = getattr(time, "monotonic", time.time)
+
+# Ports currently being recorded and the functions that are called with every
+# chunk of bytes read from them
+_RECORDING = {}
+_LISTENERS_LOCK = threading.Lock()
+
+# The recorder service of the process, see get_service()
+_SERVICE = None
+_SERVICE_LOCK = threading.Lock()
+
+class RecorderStatistics(object):
+    """
+    Counters of a recording
+
+    Attributes:
+        bytes (integer): Number of bytes recorded
+        lines (integer): Number of lines recorded
+        reconnects (integer): Number of times the port was reopened on error
+        overruns (integer):
+            Number of UART overruns reported by the driver, or None if the
+            driver doesn't report them
+        dropped_bytes (integer):
+            Number of bytes dropped by the driver because the tty buffer was
+            full, or None if the driver doesn't report them
+    """
+    def __init__(self):
+        self.bytes = 0
+        self.lines = 0
+        self.reconnects = 0
+        self.overruns = None
+        self.dropped_bytes = None
+
+    def __str__(self):
+        return (str(self.bytes) + " bytes, " + str(self.lines) + " lines, " +
+                str(self.reconnects) + " reconnects, " +
+                str(self.overruns) + " overruns, " +
+                str(self.dropped_bytes) + " dropped bytes")
+
+def add_listener(port, listener):
+    """
+    Call listener with every chunk of bytes recorded from port
+
+    Args:
+        port (str): Serial port, e.g. /dev/ttyUSB0
+        listener (function): Function taking the read bytes as argument
+
+    Returns:
+        True if port is being recorded, False otherwise. Listener is called
+        only if port is being recorded.
+    """
+    with _LISTENERS_LOCK:
+        if port not in _RECORDING:
+            return False
+        _RECORDING[port].append(listener)
+        return True
+
+def remove_listener(port, listener):
+    """
+    Stop calling listener with bytes recorded from port
+    """
+    with _LISTENERS_LOCK:
+        if port in _RECORDING and listener in _RECORDING[port]:
+            _RECORDING[port].remove(listener)
+
+def _notify_listeners(port, data):
+    """
+    Pass recorded bytes to the listeners of port
+    """
+    with _LISTENERS_LOCK:
+        listeners = list(_RECORDING.get(port, []))
+    for listener in listeners:
+        listener(data)
+
 def main(port, rate, output):
     """
-    Initialization.
+    Record a single port in the calling thread until the RECORDERS_STOP flag
+    is set. The timestamped output is written compressed to
+    output + ".raw.gz", see seriallogstore.py, and the same output with ANSI
+    control codes parsed to output while recording.
     """
+    service = RecorderService()
+    service.add_port(port, rate, output)
+    service.run()
 
-    serial_stream = serial.Serial(port, rate, timeout=0.01, xonxoff=True)
-    output_file = open(output, "w")
+def get_service():
+    """
+    Returns the recorder service of the process, starting it on first use.
+    The service thread is stopped with the RECORDERS_STOP flag.
+    """
+    global _SERVICE
+    with _SERVICE_LOCK:
+        if _SERVICE is None or not _SERVICE.is_alive():
+            _SERVICE = RecorderService()
+            thread_handler.add_thread(_SERVICE.start())
+        return _SERVICE
+
+def remove_port(port, timeout=None):
+    """
+    Stop recording a serial port with the recorder service of the process.
+    Unlike get_service().remove_port(), doesn't start a service that has
+    already been stopped, e.g. with the RECORDERS_STOP flag.
+
+    Returns:
+        See RecorderService.remove_port()
+    """
+    with _SERVICE_LOCK:
+        service = _SERVICE
+    if service is None or not service.is_alive():
+        return None
+    return service.remove_port(port, timeout)
 
-    print("Starting recording from " + str(port) + " to " + str(output) + ".")
-    record(serial_stream, output_file)
+class _ParsingOutput(object):
+    """
+    Writes the recorded bytes to the raw log and feeds them to the ANSI parser
+    """
+    def __init__(self, raw_file, parser):
+        self._raw_file = raw_file
+        self._parser = parser
+
+    def write(self, data):
+        self._raw_file.write(data)
+        self._parser.feed(data)
 
-    print("Parsing output")
-    ansiparser.parse_file(output)
+    def flush(self):
+        self._raw_file.flush()
+        self._parser.flush()
 
-    serial_stream.close()
-    output_file.close()
+def _read_icount(serial_stream):
+    """
+    Returns the (overrun, buf_overrun) counters of the serial port driver, or
+    None if the driver doesn't support TIOCGICOUNT
+    """
+    try:
+        icount = struct.unpack(_ICOUNT_FORMAT, fcntl.ioctl(
+            serial_stream.fileno(), _TIOCGICOUNT,
+            bytes(bytearray(struct.calcsize(_ICOUNT_FORMAT)))))
+    except (IOError, OSError, ValueError, AttributeError,
+            serial.SerialException):
+        return None
+    return icount[_ICOUNT_OVERRUN], icount[_ICOUNT_BUF_OVERRUN]
 
-def record(serial_stream, output):
+def _timestamp():
     """
-    Recording loop
+    Returns the line timestamp prefix with wall clock and monotonic time
     """
-    read_buffer = ""
-    while True:
+    return ("[{0:.6f} {1:.6f}] ".format(time.time(), _monotonic())
+            ).encode("ascii")
+
+class _LineWriter(object):
+    """
+    Splits recorded bytes to lines and writes them to the log with timestamps.
+    Bytes are read straight into the free part of the buffer, see free().
+    """
+    def __init__(self, output, statistics):
+        self._output = output
+        self._statistics = statistics
+        self._buffer = bytearray(_BUFFER_SIZE)
+        self._view = memoryview(self._buffer)
+        # Length of the unfinished line at the start of _buffer
+        self._filled = 0
+        # Timestamp of the unfinished line, None before its first byte and
+        # empty if the beginning of the line has already been written
+        self._line_stamp = None
+        self._unflushed = 0
+        self._last_flush = _monotonic()
+
+    def free(self):
+        """
+        Returns the free part of the buffer as a writable memoryview
+        """
+        return self._view[self._filled:]
+
+    def commit(self, count):
+        """
+        Write out the lines completed by count bytes read to free()
+        """
+        buffer, view = self._buffer, self._view
+        stamp = _timestamp()
+        if self._line_stamp is None:
+            self._line_stamp = stamp
+        end = self._filled + count
+        start = 0
+        newline = buffer.find(b"\n", self._filled, end)
+        while newline != -1:
+            self._output.write(self._line_stamp)
+            self._output.write(view[start:newline + 1])
+            self._unflushed += len(self._line_stamp) + newline + 1 - start
+            self._statistics.lines += 1
+            self._line_stamp = stamp
+            start = newline + 1
+            newline = buffer.find(b"\n", start, end)
+
+        self._filled = end - start
+        if self._filled == 0:
+            self._line_stamp = None
+        elif self._filled == _BUFFER_SIZE:
+            # Line doesn't fit the buffer, write the part read so far
+            self._output.write(self._line_stamp)
+            self._output.write(view[:self._filled])
+            self._unflushed += len(self._line_stamp) + self._filled
+            self._line_stamp = b""
+            self._filled = 0
+        elif start:
+            buffer[:self._filled] = buffer[start:end]
+
+        if self._unflushed >= _FLUSH_BYTES:
+            self.flush()
+
+    def flush_timeout(self):
+        """
+        Returns the time until the log has to be flushed in seconds, or None
+        if there is nothing to flush
+        """
+        if not self._unflushed:
+            return None
+        return max(0, self._last_flush + _FLUSH_INTERVAL - _monotonic())
+
+    def flush(self):
+        """
+        Flush the log
+        """
+        self._output.flush()
+        self._unflushed = 0
+        self._last_flush = _monotonic()
+
+    def finish(self):
+        """
+        Write out the unfinished line and flush the log
+        """
+        if self._filled:
+            self._output.write(self._line_stamp or b"")
+            self._output.write(self._view[:self._filled])
+            self._filled = 0
+        self.flush()
+
+
+class _Recording(object):
+    """
+    A serial port recorded by RecorderService, with its log files
+    """
+    def __init__(self, port, rate, output):
+        self.port = port
+        self.output = output
+        self.serial_stream = serial.Serial(port, rate, timeout=0, xonxoff=True)
+        self.raw_file = seriallogstore.FrameWriter(output + ".raw.gz")
+        self.parsed_file = open(output, "w")
+        self.parser = ansiparser.StreamParser(self.parsed_file)
+        self.statistics = RecorderStatistics()
+        self.writer = _LineWriter(_ParsingOutput(self.raw_file, self.parser),
+                                  self.statistics)
+        self.icount_start = _read_icount(self.serial_stream)
+        self.fd = None
+        self.reader = None
+        self._open_reader()
+        self.failed_reconnects = 0
+        # Monotonic time to reopen the port at after a failure
+        self.reconnect_time = None
+        self.finished = threading.Event()
+
+    def _open_reader(self):
+        # Read straight from the file descriptor into the buffer
+        self.fd = self.serial_stream.fileno()
+        self.reader = io.FileIO(self.fd, "r", closefd=False)
+
+    def read(self, drain=False):
+        """
+        Read available bytes to the log. Reads a buffer at a time, so that one
+        busy port doesn't starve the others, or everything if drain is True.
+
+        Raises:
+            serial.SerialException, IOError or OSError on read errors
+        """
+        writer = self.writer
+        while True:
+            free = writer.free()
+            count = self.reader.readinto(free)
+            if not count:
+                return
+            if _RECORDING.get(self.port):
+                _notify_listeners(self.port, bytes(free[:count]))
+            self.statistics.bytes += count
+            writer.commit(count)
+            self.failed_reconnects = 0
+            if not drain and count == len(free):
+                return
+
+    def fail(self):
+        """
+        Close the port after a read error. It is reopened right away the
+        first time, after _RECONNECT_DELAY if reopening didn't help.
+        """
+        self.serial_stream.close()
+        self.fd = None
+        self.reader = None
+        self.reconnect_time = _monotonic()
+        if self.failed_reconnects:
+            self.reconnect_time += _RECONNECT_DELAY
+
+    def reconnect(self):
+        """
+        Reopen the port
+
+        Returns:
+            True if the port was opened, False if it has to be retried later
+        """
+        # This is a hacky way to fix random, frequent, read errors.
+        # May catch more than intended.
+        self.statistics.reconnects += 1
+        self.failed_reconnects += 1
+        try:
+            self.serial_stream.open()
+        except (serial.SerialException, IOError, OSError):
+            self.reconnect_time = _monotonic() + _RECONNECT_DELAY
+            return False
+        self._open_reader()
+        self.reconnect_time = None
+        return True
+
+    def close(self):
+        """
+        Write out the unfinished line and close the port and the logs
+        """
         try:
-            if sys.version_info[0] == 2:
-                read_buffer += serial_stream.read(4096)
-            else:
-                read_buffer += serial_stream.read(4096).decode("ISO-8859-1")
-        except serial.SerialException as err:
-            # This is a hacky way to fix random, frequent, read errors.
-            # May catch more than intended.
-            serial_stream.close()
-            serial_stream.open()
-            continue
-
-        last_newline = read_buffer.rfind("\n")
-        if last_newline == -1 and not thread_handler.get_flag(thread_handler.RECORDERS_STOP):
-            continue
-
-        text_batch = read_buffer[0:last_newline + 1]
-        read_buffer = read_buffer[last_newline + 1:-1]
-
-        time_now = time.time()
-        timed_batch = text_batch.replace("\n", "\n[" + str(time_now) + "] ")
-        output.write(timed_batch)
-        output.flush()
-        if thread_handler.get_flag(thread_handler.RECORDERS_STOP):
-            # Write out the remaining buffer.
-            if read_buffer:
-                output.write(read_buffer)
-            output.flush()
+            self.writer.finish()
+            icount_end = _read_icount(self.serial_stream)
+            if self.icount_start and icount_end:
+                self.statistics.overruns = icount_end[0] - self.icount_start[0]
+                self.statistics.dropped_bytes = \
+                    icount_end[1] - self.icount_start[1]
+        finally:
+            self.parser.finish()
+            self.raw_file.close()
+            self.parsed_file.close()
+            self.serial_stream.close()
+            self.finished.set()
+        print("Recorded " + str(self.statistics) + " from " + str(self.port) +
+              ".")
+
+
+class RecorderService(object):
+    """
+    Records any number of serial ports from a single thread.
+
+    The thread blocks in poll() until a port has data, a log has to be
+    flushed, a port is added or removed, or the RECORDERS_STOP flag is set.
+    Bytes are read to a preallocated buffer per port and every line is written
+    to the log of the port prefixed with the wall clock and monotonic time its
+    first byte was read. Logs are flushed every _FLUSH_BYTES bytes or
+    _FLUSH_INTERVAL seconds.
+    """
+    def __init__(self):
+        self._recordings = {}
+        self._commands = []
+        self._commands_lock = threading.Lock()
+        self._wakeup = os.pipe()
+        for fd in self._wakeup:
+            fcntl.fcntl(fd, fcntl.F_SETFL,
+                        fcntl.fcntl(fd, fcntl.F_GETFL) | os.O_NONBLOCK)
+        self._thread = None
+        self._running = True
+        # Set when the service thread doesn't run commands anymore
+        self._closed = False
+        self._stopped = threading.Event()
+
+    def start(self):
+        """
+        Run the service in a new thread
+
+        Returns:
+            The started thread
+        """
+        self._thread = threading.Thread(target=self.run,
+                                        name=str(os.getpid()) + "recorder")
+        self._thread.start()
+        return self._thread
+
+    def is_alive(self):
+        """
+        Returns True if the service is running
+        """
+        return not self._stopped.is_set()
+
+    def add_port(self, port, rate, output):
+        """
+        Start recording a serial port. The port and the logs are opened in the
+        calling thread, so failures raise here.
+
+        Args:
+            port (str): Serial port, e.g. /dev/ttyUSB0
+            rate (integer): Baud rate
+            output (str): Parsed log file name. The raw log is written to
+                          output + ".raw.gz"
+
+        Raises:
+            aft.errors.AFTDeviceError if port is already being recorded
+        """
+        with _LISTENERS_LOCK:
+            if port in _RECORDING:
+                raise errors.AFTDeviceError("Serial port " + str(port) +
+                                            " is already being recorded")
+            _RECORDING[port] = []
+        try:
+            recording = _Recording(port, rate, output)
+        except:
+            with _LISTENERS_LOCK:
+                del _RECORDING[port]
+            raise
+        print("Starting recording from " + str(port) + " to " + str(output) +
+              ".")
+        self._command(self._add, recording)
+
+    def remove_port(self, port, timeout=None):
+        """
+        Stop recording a serial port and close its logs. Must not be called
+        from the service thread, e.g. from a listener.
+
+        Returns:
+            RecorderStatistics of the recording, or None if the port wasn't
+            being recorded or the recording didn't finish within timeout
+            seconds
+        """
+        finished = threading.Event()
+        result = []
+        def remove():
+            recording = self._recordings.get(port)
+            if recording:
+                self._remove(recording)
+                result.append(recording.statistics)
+            finished.set()
+        self._command(remove)
+        if not finished.wait(timeout) or not result:
+            return None
+        return result[0]
+
+    def ports(self):
+        """
+        Returns the ports being recorded
+        """
+        return list(self._recordings)
+
+    def stop(self):
+        """
+        Stop recording all ports and end the service
+        """
+        self._command(self._stop)
+
+    def join(self, timeout=None):
+        """
+        Wait until the service has stopped
+        """
+        return self._stopped.wait(timeout)
+
+    def _command(self, function, *args):
+        """
+        Run function in the service thread
+        """
+        with self._commands_lock:
+            closed = self._closed
+            if not closed:
+                self._commands.append((function, args))
+        if closed:
+            function(*args)
+            return
+        try:
+            os.write(self._wakeup[1], b"x")
+        except OSError as err:
+            # Pipe full, the service will wake up anyway
+            if err.errno != errno.EAGAIN:
+                raise
+
+    def run(self):
+        """
+        Record until stopped with stop() or the RECORDERS_STOP flag
+        """
+        stop_fd = thread_handler.get_flag_fd(thread_handler.RECORDERS_STOP)
+        self._poller = select.poll()
+        self._poller.register(stop_fd, select.POLLIN)
+        self._poller.register(self._wakeup[0], select.POLLIN)
+        self._by_fd = {}
+
+        try:
+            while self._running:
+                events = self._poll()
+                if self._wakeup[0] in events:
+                    self._run_commands()
+                if stop_fd in events:
+                    break
+
+                for fd, event in events.items():
+                    recording = self._by_fd.get(fd)
+                    if recording is None:
+                        continue
+                    try:
+                        if event & _POLL_ERRORS:
+                            raise serial.SerialException(
+                                "serial port hung up")
+                        recording.read()
+                    except (serial.SerialException, IOError, OSError):
+                        self._unregister(recording)
+                        recording.fail()
+
+                now = _monotonic()
+                for recording in list(self._recordings.values()):
+                    if recording.reconnect_time is not None and \
+                       recording.reconnect_time <= now and \
+                       recording.reconnect():
+                        self._register(recording)
+                    if recording.writer.flush_timeout() == 0:
+                        recording.writer.flush()
+        finally:
+            self._running = False
+            for recording in list(self._recordings.values()):
+                self._remove(recording)
+            # Run the pending commands, so that no caller is left waiting
+            with self._commands_lock:
+                self._closed = True
+            self._run_commands()
+            self._stopped.set()
+
+    def _poll(self):
+        """
+        Wait for events until the next flush or reconnect
+
+        Returns:
+            Dictionary of file descriptors and their events
+        """
+        timeout = None
+        now = _monotonic()
+        for recording in self._recordings.values():
+            for wait in (recording.writer.flush_timeout(),
+                         None if recording.reconnect_time is None
+                         else max(0, recording.reconnect_time - now)):
+                if wait is not None and (timeout is None or wait < timeout):
+                    timeout = wait
+        while True:
+            try:
+                return dict(self._poller.poll(None if timeout is None
+                                              else timeout * 1000))
+            except (select.error, IOError, OSError) as err:
+                if err.args[0] != errno.EINTR:
+                    raise
+
+    def _run_commands(self):
+        try:
+            while os.read(self._wakeup[0], 64):
+                pass
+        except OSError:
+            pass
+        with self._commands_lock:
+            commands, self._commands = self._commands, []
+        for function, args in commands:
+            function(*args)
+
+    def _register(self, recording):
+        self._by_fd[recording.fd] = recording
+        self._poller.register(recording.fd, select.POLLIN)
+
+    def _unregister(self, recording):
+        if recording.fd is not None and recording.fd in self._by_fd:
+            del self._by_fd[recording.fd]
+            self._poller.unregister(recording.fd)
+
+    def _add(self, recording):
+        if not self._running:
+            self._close(recording)
             return
+        self._recordings[recording.port] = recording
+        self._register(recording)
+
+    def _remove(self, recording):
+        """
+        Read everything available, so nothing is lost, and close the
+        recording
+        """
+        del self._recordings[recording.port]
+        self._unregister(recording)
+        if recording.reader is not None:
+            try:
+                recording.read(drain=True)
+            except (serial.SerialException, IOError, OSError):
+                pass
+        self._close(recording)
+
+    def _close(self, recording):
+        with _LISTENERS_LOCK:
+            _RECORDING.pop(recording.port, None)
+        recording.close()
+
+    def _stop(self):
+        self._running = False
 
 if __name__ == '__main__':
     import sys
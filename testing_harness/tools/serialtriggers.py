@@ -0,0 +1,219 @@
+# coding=utf-8
+# Copyright (c) 2016 Intel, Inc.
+# Author Simo Kuusela <simo.kuusela@intel.com>
+#
+# This program is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the
+# Free Software Foundation; version 2 of the License
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU General Public License for more details.
+
+"""
+Regular expression triggers on the live serial output of a DUT.
+
+Triggers are matched line by line against the recorded serial output, with
+ANSI control codes removed, and their callbacks are called with a TriggerMatch
+as soon as a matching line has been recorded.
+"""
+
+import re
+import time
+import threading
+from collections import deque
+
+import aft.errors as errors
+import aft.tools.serialrecorder as serialrecorder
+from aft.logger import Logger as logger
+
+# Trigger actions
+ABORT = "abort"
+ANNOTATE = "annotate"
+OFF = "off"
+
+# Built-in triggers as (name, pattern, action) tuples. ABORT triggers abort the
+# running test case, mark it failed and recover the device, ANNOTATE triggers
+# attach the matched output to the test case results.
+DEFAULT_TRIGGERS = [
+    ("kernel panic", r"Kernel panic - not syncing", ABORT),
+    ("out of memory", r"Out of memory: Kill(ed)? process", ABORT),
+    ("lockup", r"BUG: soft lockup|Watchdog detected hard LOCKUP", ABORT),
+    ("kernel oops", r"Oops: [0-9a-f]+ \[#\d+\]", ABORT),
+    ("kernel warning", r"WARNING: CPU: \d+ PID: \d+", ANNOTATE),
+]
+
+def trigger_actions(setting, actions=None):
+    """
+    Returns the actions of the built-in triggers with the actions of setting
+    applied
+
+    Args:
+        setting (str): Comma separated "name: action" pairs, e.g.
+                       "out of memory: annotate, lockup: off"
+        actions (dictionary): Actions to start from by trigger name, on
+                              default the actions of DEFAULT_TRIGGERS
+
+    Returns:
+        Dictionary of the actions by trigger name
+
+    Raises:
+        aft.errors.AFTConfigurationError if setting names an unknown trigger
+        or action
+    """
+    if actions is None:
+        actions = dict((name, action) for name, _, action in DEFAULT_TRIGGERS)
+    actions = dict(actions)
+    for item in setting.split(","):
+        if not item.strip():
+            continue
+        name, _, action = item.rpartition(":")
+        name = name.strip()
+        action = action.strip().lower()
+        if name not in actions or action not in (ABORT, ANNOTATE, OFF):
+            raise errors.AFTConfigurationError(
+                "Bad serial trigger setting '" + item.strip() + "', expected " +
+                "'name: abort|annotate|off' with name one of " +
+                ", ".join(sorted(actions)))
+        actions[name] = action
+    return actions
+
+
+class TriggerMatch(object):
+    """
+    A matched trigger
+
+    Attributes:
+        trigger (SerialTrigger): The trigger that matched
+        line (str): The matching line
+        context (list(str)): Lines recorded before the match and the matching
+                             line
+        time (float): Time of the match, seconds since the epoch
+    """
+    def __init__(self, trigger, line, context):
+        self.trigger = trigger
+        self.line = line
+        self.context = context
+        self.time = time.time()
+
+    def __str__(self):
+        return ("Serial output matched " + self.trigger.name + ": " +
+                self.line)
+
+
+class SerialTrigger(object):
+    """
+    A regular expression and the function called when it matches
+
+    Attributes:
+        name (str): Name used in logs and results
+        regex (re.RegexObject): The compiled pattern
+        callback (function): Called with a TriggerMatch from the serial
+                             recorder thread, so it must not block
+        once (boolean): Whether the trigger is removed after the first match
+    """
+    def __init__(self, pattern, callback, name=None, once=False):
+        self.name = name or pattern
+        self.regex = re.compile(pattern)
+        self.callback = callback
+        self.once = once
+
+
+class SerialMonitor(object):
+    """
+    Matches triggers against the serial output recorded from a port.
+
+    Only ports being recorded by serialrecorder can be monitored.
+
+    Attributes:
+        _CONTEXT_LINES (integer): Number of lines passed as match context
+        _MAX_LINE (integer): Longer lines are matched in parts [characters]
+    """
+    _CONTEXT_LINES = 50
+    _MAX_LINE = 4096
+
+    _ANSI_CODE = re.compile(r"\x1b\[[0-9;?]*[A-Za-z]")
+
+    def __init__(self, port):
+        self.port = port
+        self._triggers = []
+        self._lock = threading.Lock()
+        self._context = deque(maxlen=self._CONTEXT_LINES)
+        self._partial = ""
+        self._listening = False
+
+    def add_trigger(self, pattern, callback, name=None, once=False):
+        """
+        Call callback with a TriggerMatch when a serial output line matches
+        pattern
+
+        Returns:
+            The added SerialTrigger
+        """
+        trigger = SerialTrigger(pattern, callback, name, once)
+        with self._lock:
+            self._triggers.append(trigger)
+        return trigger
+
+    def remove_trigger(self, trigger):
+        """
+        Remove a trigger returned by add_trigger
+        """
+        with self._lock:
+            if trigger in self._triggers:
+                self._triggers.remove(trigger)
+
+    def start(self):
+        """
+        Start matching the recorded output
+
+        Returns:
+            True if the port is being recorded, False otherwise
+        """
+        self._context.clear()
+        self._partial = ""
+        self._listening = serialrecorder.add_listener(self.port, self._feed)
+        return self._listening
+
+    def stop(self):
+        """
+        Stop matching
+        """
+        if self._listening:
+            serialrecorder.remove_listener(self.port, self._feed)
+            self._listening = False
+
+    def _feed(self, data):
+        """
+        Serial recorder listener. Splits the recorded bytes to lines and
+        matches the complete ones.
+        """
+        lines = (self._partial + data.decode("ISO-8859-1")).split("\n")
+        self._partial = lines.pop()
+        if len(self._partial) > self._MAX_LINE:
+            lines.append(self._partial)
+            self._partial = ""
+
+        for line in lines:
+            line = self._ANSI_CODE.sub("", line).rstrip("\r")
+            self._context.append(line)
+            self._match(line)
+
+    def _match(self, line):
+        with self._lock:
+            triggers = list(self._triggers)
+
+        for trigger in triggers:
+            if not trigger.regex.search(line):
+                continue
+            if trigger.once:
+                self.remove_trigger(trigger)
+            match = TriggerMatch(trigger, line, list(self._context))
+            logger.info(str(match))
+            try:
+                trigger.callback(match)
+            except Exception as err:
+                # The recorder must keep recording whatever the callback does
+                logger.error("Serial trigger " + trigger.name + " failed: " +
+                             str(err))
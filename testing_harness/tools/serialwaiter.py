@@ -0,0 +1,132 @@
+# coding=utf-8
+# Copyright (c) 2016 Intel, Inc.
+# Author Simo Kuusela <simo.kuusela@intel.com>
+#
+# This program is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the
+# Free Software Foundation; version 2 of the License
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU General Public License for more details.
+
+"""
+Tool for waiting until a pattern appears in the live serial output of a DUT.
+"""
+
+import re
+import time
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+import serial
+
+import aft.tools.serialrecorder as serialrecorder
+from aft.logger import Logger as logger
+
+class SerialWaiter(object):
+    """
+    Matches regular expressions against the serial output of a DUT.
+
+    If the serial port is being recorded, the recorded bytes are used.
+    Otherwise the port is opened for as long as the waiter is started.
+
+    Every successful match consumes the output up to the end of the match, so
+    consecutive waits match output that arrived after the previous match.
+
+    Attributes:
+        _BUFFER_SIZE (integer):
+            Maximum number of characters kept for matching
+        _READ_TIMEOUT (float):
+            Maximum time to block on a single read in seconds
+    """
+    _BUFFER_SIZE = 16384
+    _READ_TIMEOUT = 0.05
+
+    # ANSI control codes are removed before matching as firmware menus are
+    # full of them
+    _ANSI_CODE = re.compile(r"\x1b\[[0-9;?]*[A-Za-z]")
+
+    def __init__(self, port, bauds):
+        self.port = port
+        self.bauds = int(bauds)
+        self._chunks = queue.Queue()
+        self._serial = None
+        self._listening = False
+        self._text = ""
+
+    def start(self):
+        """
+        Start collecting serial output
+        """
+        self._text = ""
+        self._listening = serialrecorder.add_listener(self.port,
+                                                      self._chunks.put)
+        if not self._listening:
+            self._serial = serial.Serial(self.port, self.bauds,
+                                         timeout=self._READ_TIMEOUT)
+
+    def stop(self):
+        """
+        Stop collecting serial output
+        """
+        if self._listening:
+            serialrecorder.remove_listener(self.port, self._chunks.put)
+            self._listening = False
+        if self._serial:
+            self._serial.close()
+            self._serial = None
+
+    def wait_for(self, pattern, timeout):
+        """
+        Wait until pattern appears in the serial output.
+
+        Args:
+            pattern (str): Regular expression to match
+            timeout (float): Timeout in seconds
+
+        Returns:
+            True if the pattern was found, False on timeout
+        """
+        regex = re.compile(pattern)
+        deadline = time.time() + timeout
+
+        while True:
+            match = regex.search(self._text)
+            if match:
+                logger.info("Found '" + pattern + "' in serial output",
+                            "kb_emulator.log")
+                self._text = self._text[match.end():]
+                return True
+
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                return False
+
+            self._read(min(remaining, self._READ_TIMEOUT))
+
+    def _read(self, timeout):
+        """
+        Read available serial output to the match buffer, waiting at most
+        timeout seconds
+        """
+        data = b""
+        if self._serial:
+            data = self._serial.read(4096)
+        else:
+            try:
+                data = self._chunks.get(timeout=timeout)
+                while not self._chunks.empty():
+                    data += self._chunks.get_nowait()
+            except queue.Empty:
+                pass
+
+        if not data:
+            return
+
+        text = self._text + data.decode("ISO-8859-1")
+        text = self._ANSI_CODE.sub("", text)
+        self._text = text[-self._BUFFER_SIZE:]
@@ -15,15 +15,22 @@
 Class for handling threads.
 '''
 
+import os
+import fcntl
+import threading
+
 class Thread_handler(object):
     '''
     Flags: Dictionary with aĺl flags added with set_flag()
     Threads: List with all thread objects
+    Flag pipes: Pipes which are readable while their flag is set
     '''
     RECORDERS_STOP = "recorders_stop"
 
     FLAGS = {}
     THREADS = []
+    FLAG_PIPES = {}
+    FLAG_PIPES_LOCK = threading.Lock()
 
     @staticmethod
     def add_thread(thread):
@@ -44,14 +51,20 @@ class Thread_handler(object):
         '''
         Add/change flag in FLAGS dictionary
         '''
-        Thread_handler.FLAGS[flag] = True
+        with Thread_handler.FLAG_PIPES_LOCK:
+            Thread_handler.FLAGS[flag] = True
+            if flag in Thread_handler.FLAG_PIPES:
+                _mark_pipe(Thread_handler.FLAG_PIPES[flag])
 
     @staticmethod
     def unset_flag(flag):
         '''
         Add/change flag in FLAGS dictionary
         '''
-        Thread_handler.FLAGS[flag] = False
+        with Thread_handler.FLAG_PIPES_LOCK:
+            Thread_handler.FLAGS[flag] = False
+            if flag in Thread_handler.FLAG_PIPES:
+                _clear_pipe(Thread_handler.FLAG_PIPES[flag])
 
     @staticmethod
     def get_flag(flag):
@@ -62,3 +75,37 @@ class Thread_handler(object):
             return Thread_handler.FLAGS[flag]
         except KeyError:
             return None
+
+    @staticmethod
+    def get_flag_fd(flag):
+        '''
+        Return a file descriptor which is readable while flag is set, so that
+        threads can wait for the flag with select/poll. Don't read from it.
+        '''
+        with Thread_handler.FLAG_PIPES_LOCK:
+            if flag not in Thread_handler.FLAG_PIPES:
+                pipe = os.pipe()
+                for fd in pipe:
+                    fcntl.fcntl(fd, fcntl.F_SETFL,
+                                fcntl.fcntl(fd, fcntl.F_GETFL) | os.O_NONBLOCK)
+                Thread_handler.FLAG_PIPES[flag] = pipe
+                if Thread_handler.FLAGS.get(flag):
+                    _mark_pipe(pipe)
+            return Thread_handler.FLAG_PIPES[flag][0]
+
+def _mark_pipe(pipe):
+    '''
+    Make the read end of pipe readable
+    '''
+    _clear_pipe(pipe)
+    os.write(pipe[1], b"x")
+
+def _clear_pipe(pipe):
+    '''
+    Empty pipe
+    '''
+    try:
+        while os.read(pipe[0], 64):
+            pass
+    except OSError:
+        pass
@@ -0,0 +1,123 @@
+# coding=utf-8
+# Copyright (c) 2016 Intel, Inc.
+# Author Simo Kuusela <simo.kuusela@intel.com>
+#
+# This program is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the
+# Free Software Foundation; version 2 of the License
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU General Public License for more details.
+
+"""
+Incremental xunit results file writer.
+
+The results file is complete and well formed after every added test case:
+each test case is written over the closing tag of the previous write, the
+closing tag is written after it, and the testsuite element, padded to a fixed
+size, is rewritten in place with the updated counts. If aft dies in the middle
+of a test plan, the results of the finished test cases are left in the file.
+"""
+
+import os
+import time
+
+_HEADER_SIZE = 512 # Bytes reserved for the xml declaration and testsuite tag
+_FOOTER = b"</testsuite>\n"
+
+class XunitWriter(object):
+    """
+    Writes test case results to an xunit file as they are added.
+
+    Test cases are written in the order of their indexes, so results added
+    out of order are kept in memory until the results before them have been
+    added, or the writer is closed.
+    """
+    def __init__(self, path, name, start_time):
+        """
+        Args:
+            path (str): Results file
+            name (str): Test suite name
+            start_time (float): Test plan start time, seconds since the epoch
+        """
+        self.path = path
+        self._name = name
+        self._start_time = start_time
+        self._tests = 0
+        self._failures = 0
+        # Results waiting for the results before them, by index
+        self._pending = {}
+        self._next_index = 0
+        self._file = open(path, "wb")
+        self._body_end = _HEADER_SIZE
+        self._write_header(start_time)
+        self._file.seek(self._body_end)
+        self._file.write(_FOOTER)
+        self._sync()
+
+    def add(self, index, xunit_section, passed):
+        """
+        Add the result of a test case
+
+        Args:
+            index (integer): Position of the test case in the test plan
+            xunit_section (str): The testcase element
+            passed (boolean): Whether the test case passed
+        """
+        self._pending[index] = (xunit_section, passed)
+        indexes = []
+        while self._next_index in self._pending:
+            indexes.append(self._next_index)
+            self._next_index += 1
+        if indexes:
+            self._write_results(indexes)
+            self._write_header(time.time())
+            self._sync()
+
+    def close(self, end_time=None):
+        """
+        Write the results still waiting for earlier results, which were never
+        added, e.g. because the test plan was interrupted, and the final test
+        suite duration, and close the file.
+        """
+        if self._pending:
+            self._write_results(sorted(self._pending))
+        self._write_header(time.time() if end_time is None else end_time)
+        self._sync()
+        self._file.close()
+
+    def _write_results(self, indexes):
+        """
+        Write the pending results of indexes after the written ones, followed
+        by the closing tag
+        """
+        self._file.seek(self._body_end)
+        for index in indexes:
+            xunit_section, passed = self._pending.pop(index)
+            if not isinstance(xunit_section, bytes):
+                xunit_section = xunit_section.encode("utf-8")
+            self._file.write(xunit_section)
+            self._tests += 1
+            if not passed:
+                self._failures += 1
+        self._body_end = self._file.tell()
+        self._file.write(_FOOTER)
+        self._file.truncate()
+
+    def _write_header(self, end_time):
+        header = ('<?xml version="1.0" encoding="utf-8"?>\n'
+                  '<testsuite errors="0" failures="{0}" name="{1}" skips="0" '
+                  'tests="{2}" time="{3}"'.format(self._failures, self._name,
+                                                  self._tests,
+                                                  end_time - self._start_time)
+                 ).encode("utf-8")
+        # Padding goes inside the tag, where whitespace is allowed
+        header += b" " * (_HEADER_SIZE - len(header) - 2) + b">\n"
+        self._file.seek(0)
+        self._file.write(header)
+
+    def _sync(self):
+        self._file.flush()
+        os.fsync(self._file.fileno())